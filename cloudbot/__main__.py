@@ -17,6 +17,7 @@ os.chdir(path0)
 
 # import bot
 from cloudbot.bot import CloudBot
+from cloudbot.supervisor import Supervisor, sharding_enabled
 
 
 def main():
@@ -28,8 +29,15 @@ def main():
     logger = logging.getLogger("cloudbot")
     logger.info("Starting CloudBot.")
 
-    # create the bot
-    _bot = CloudBot()
+    sharded = sharding_enabled()
+
+    # run loading plugins under cProfile, writing the stats to data/startup.prof
+    profile_startup = "--profile-startup" in sys.argv[1:]
+    if profile_startup and sharded:
+        logger.warning("--profile-startup isn't supported when running sharded, ignoring it")
+
+    # create the bot, unless every connection is run by a worker process with its own bot
+    _bot = None if sharded else CloudBot(profile_startup=profile_startup)
 
     # whether we are killed while restarting
     stopped_while_restarting = False
@@ -58,8 +66,12 @@ def main():
 
     # start the bot master
 
-    # CloudBot.run() will return True if it should restart, False otherwise
-    restart = _bot.run()
+    # CloudBot.run() and Supervisor.run() will return True if it should restart, False otherwise
+    if sharded:
+        # the supervisor handles signals itself until every worker has stopped
+        restart = Supervisor().run()
+    else:
+        restart = _bot.run()
 
     # the bot has stopped, do we want to restart?
     if restart:
@@ -87,4 +99,6 @@ def main():
     logging.shutdown()
 
 
-main()
+# the fork server sharded workers are started from imports this module again, without running the bot
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import asyncio
+import cProfile
 import time
 import logging
 import collections
@@ -18,6 +19,7 @@ from cloudbot.reloader import PluginReloader
 from cloudbot.plugin import PluginManager
 from cloudbot.event import Event, CommandEvent, RegexEvent, EventType
 from cloudbot.util import database, formatting
+from cloudbot.util.dbpool import DatabasePool
 from cloudbot.clients.irc import IrcClient
 
 try:
@@ -28,6 +30,9 @@ except ImportError:
 
 logger = logging.getLogger("cloudbot")
 
+# how many of the slowest plugins to list in the startup report
+STARTUP_REPORT_SIZE = 10
+
 
 def clean_name(n):
     """strip all spaces and capitalization
@@ -50,14 +55,28 @@ class CloudBot:
     :type db_factory: sqlalchemy.orm.session.sessionmaker
     :type db_session: sqlalchemy.orm.scoping.scoped_session
     :type db_metadata: sqlalchemy.sql.schema.MetaData
+    :type db_pool: DatabasePool
     :type loop: asyncio.events.AbstractEventLoop
     :type stopped_future: asyncio.Future
+    :type shard: list[str] | None
+    :type shard_link: cloudbot.supervisor.WorkerLink | None
+    :type profile_startup: bool
     :param: stopped_future: Future that will be given a result when the bot has stopped.
     """
 
-    def __init__(self, loop=asyncio.get_event_loop()):
+    def __init__(self, loop=asyncio.get_event_loop(), *, shard=None, profile_startup=False):
+        """
+        :param shard: When running sharded, the names of the connections this worker process runs
+        :type shard: list[str] | None
+        :param profile_startup: Whether to run loading plugins under cProfile, and write the stats to data/startup.prof
+        :type profile_startup: bool
+        """
         # basic variables
         self.loop = loop
+        self.shard = shard
+        self.profile_startup = profile_startup
+        # the pipe to the supervisor when running sharded, set by cloudbot.supervisor
+        self.shard_link = None
         self.start_time = time.time()
         self.running = True
         # future which will be called when the bot stopsIf you
@@ -97,6 +116,8 @@ class CloudBot:
         self.db_session = scoped_session(self.db_factory)
         self.db_metadata = MetaData()
         self.db_base = declarative_base(metadata=self.db_metadata, bind=self.db_engine)
+        # threads which run database calls for coroutine hooks, each hook opening its own session from db_factory
+        self.db_pool = DatabasePool(self.config.get('database_workers', 4))
 
         # create web interface
         if self.config.get("web", {}).get("enabled", False) and web_installed:
@@ -138,6 +159,9 @@ class CloudBot:
         for config in self.config['connections']:
             # strip all spaces and capitalization from the connection name
             name = clean_name(config['name'])
+            if self.shard is not None and name not in self.shard:
+                # run by another worker
+                continue
             nick = config['nick']
             server = config['connection']['server']
             port = config['connection'].get('port', 6667)
@@ -153,13 +177,18 @@ class CloudBot:
     @asyncio.coroutine
     def stop(self, reason=None, *, restart=False):
         """quits all networks and shuts the bot down"""
+        if self.shard_link is not None and not self.shard_link.stopping:
+            # every worker is stopped together, by the supervisor
+            self.shard_link.request_stop(reason, restart)
+            return
+
         logger.info("Stopping bot.")
 
         if self.config_reloading_enabled:
             logger.debug("Stopping config reloader.")
             self.config.stop()
 
-        if self.plugin_reloading_enabled:
+        if self.plugin_reloading_enabled and self.shard is None:
             logger.debug("Stopping plugin reloader.")
             self.reloader.stop()
 
@@ -173,12 +202,20 @@ class CloudBot:
 
         yield from asyncio.sleep(1.0)  # wait for 'QUIT' calls to take affect
 
+        # run on_stop hooks
+        yield from self.plugin_manager.unload_all()
+
         for connection in self.connections.values():
             if not connection.connected:
                 # Don't close a connection that hasn't connected
                 continue
             connection.close()
 
+        self.db_pool.shutdown(wait=False)
+
+        if self.shard_link is not None:
+            self.shard_link.stop()
+
         self.running = False
         # Give the stopped_future a result, so that run() will exit
         self.stopped_future.set_result(restart)
@@ -191,15 +228,38 @@ class CloudBot:
     @asyncio.coroutine
     def _init_routine(self):
         # Load plugins
-        yield from self.plugin_manager.load_all(os.path.abspath("plugins"))
+        profiler = cProfile.Profile() if self.profile_startup else None
+        load_start = time.monotonic()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield from self.plugin_manager.load_all(os.path.abspath("plugins"))
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        startup = self.plugin_manager.startup
+        startup.load_time = time.monotonic() - load_start
+
+        report = startup.report(STARTUP_REPORT_SIZE)
+        logger.info("Startup: {}".format(report[0]))
+        for line in report[1:]:
+            logger.info("Startup: {}".format(line))
+        if profiler is not None:
+            profile_path = os.path.join(self.data_dir, "startup.prof")
+            try:
+                profiler.dump_stats(profile_path)
+            except OSError:
+                logger.exception("Error writing the startup profile to {}:".format(profile_path))
+            else:
+                logger.info("Wrote the startup profile to {}".format(profile_path))
 
         # If we we're stopped while loading plugins, cancel that and just stop
         if not self.running:
             logger.info("Killed while loading, exiting")
             return
 
-        if self.plugin_reloading_enabled:
-            # start plugin reloader
+        if self.plugin_reloading_enabled and self.shard is None:
+            # start plugin reloader, unless the supervisor is watching the plugins for us
             self.reloader.start(os.path.abspath("plugins"))
 
         # Connect to servers
@@ -213,13 +273,15 @@ class CloudBot:
         gc.collect()
 
     @asyncio.coroutine
-    def process(self, event):
+    def process(self, event, launched=None):
         """
         :type event: Event
+        :param launched: If given, a future which is set once every hook for the event has been started, while they
+                         may still be running
+        :type launched: asyncio.Future
         """
         run_before_tasks = []
         tasks = []
-        command_prefix = event.conn.config.get('command_prefix', '.')
 
         # Raw IRC hook
         for raw_hook in self.plugin_manager.catch_all_triggers:
@@ -240,37 +302,25 @@ class CloudBot:
 
         if event.type is EventType.message:
             # Commands
+            channel_re, private_re = event.conn.get_command_regexes()
             if event.chan.lower() == event.nick.lower():  # private message, no command prefix
-                command_re = r'(?i)^(?:[{}]?|{}[,;:]+\s+)(\w+)(?:$|\s+)(.*)'.format(command_prefix, event.conn.nick)
+                cmd_match = private_re.match(event.content)
             else:
-                command_re = r'(?i)^(?:[{}]|{}[,;:]+\s+)(\w+)(?:$|\s+)(.*)'.format(command_prefix, event.conn.nick)
-
-            cmd_match = re.match(command_re, event.content)
+                cmd_match = channel_re.match(event.content)
 
             if cmd_match:
                 command = cmd_match.group(1).lower()
-                if command in self.plugin_manager.commands:
-                    command_hook = self.plugin_manager.commands[command]
+                match, potential_matches = self.plugin_manager.commands.lookup(command)
+                if match is not None:
+                    command_hook = match[1]
                     command_event = CommandEvent(hook=command_hook, text=cmd_match.group(2).strip(),
-                                             triggered_command=command, base_event=event)
+                                                 triggered_command=command, base_event=event)
                     tasks.append(self.plugin_manager.launch(command_hook, command_event))
-                else:
-                    potential_matches = []
-                    for potential_match, plugin in self.plugin_manager.commands.items():
-                        if potential_match.startswith(command):
-                            potential_matches.append((potential_match, plugin))
-                    if potential_matches:
-                        if len(potential_matches) == 1:
-                            command_hook = potential_matches[0][1]
-                            command_event = CommandEvent(hook=command_hook, text=cmd_match.group(2).strip(),
-                                                     triggered_command=command, base_event=event)
-                            tasks.append(self.plugin_manager.launch(command_hook, command_event))
-                        else:
-                            event.notice("Possible matches: {}".format(
-                                formatting.get_text_list([command for command, plugin in potential_matches])))
-
-            # Regex hooks
-            for regex, regex_hook in self.plugin_manager.regex_hooks:
+                elif potential_matches:
+                    event.notice("Possible matches: {}".format(formatting.get_text_list(potential_matches)))
+
+            # Regex hooks, skipping any regex which can't match because the line doesn't contain a string it needs
+            for regex, regex_hook in self.plugin_manager.regex_hooks.candidates(event.content):
                 if not regex_hook.run_on_cmd and cmd_match:
                     pass
                 else:
@@ -281,4 +331,7 @@ class CloudBot:
 
         # Run the tasks
         yield from asyncio.gather(*run_before_tasks, loop=self.loop)
+        tasks = [asyncio.async(task, loop=self.loop) for task in tasks]
+        if launched is not None and not launched.done():
+            launched.set_result(None)
         yield from asyncio.gather(*tasks, loop=self.loop)
@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import collections
+import re
 
 from cloudbot.permissions import PermissionManager
 
@@ -55,9 +56,31 @@ class Client:
         # set when on_load in core_misc is done
         self.ready = False
 
+        # (command_prefix, nick) the cached command regexes were compiled for, and the regexes themselves
+        self._command_re_key = None
+        self._command_re = None
+
     def describe_server(self):
         raise NotImplementedError
 
+    def get_command_regexes(self):
+        """
+        Returns compiled regexes matching a command in a channel message and in a private message, respectively.
+
+        The regexes are cached, and recompiled whenever the nick or command prefix of this connection changes.
+        :rtype: (re.__Regex, re.__Regex)
+        """
+        command_prefix = self.config.get('command_prefix', '.')
+        key = (command_prefix, self.nick)
+        if key != self._command_re_key:
+            nick = re.escape(self.nick)
+            self._command_re = (
+                re.compile(r'(?i)^(?:[{}]|{}[,;:]+\s+)(\w+)(?:$|\s+)(.*)'.format(command_prefix, nick)),
+                re.compile(r'(?i)^(?:[{}]?|{}[,;:]+\s+)(\w+)(?:$|\s+)(.*)'.format(command_prefix, nick))
+            )
+            self._command_re_key = key
+        return self._command_re
+
     @asyncio.coroutine
     def connect(self):
         """
@@ -1,25 +1,25 @@
 from _ssl import PROTOCOL_SSLv23
 import asyncio
-import re
 import ssl
 import logging
 from ssl import SSLContext
 
 from cloudbot.client import Client
+from cloudbot.clients.irc_batch import Batch, BatchCollector
+from cloudbot.clients.irc_caps import CapNegotiator, DEFAULT_CAPS
+from cloudbot.clients.irc_decoder import Decoder, DEFAULT_CODECS
+from cloudbot.clients.irc_ingress import IngressQueue, PRIORITY_CONTROL, PRIORITY_COMMAND, PRIORITY_PASSIVE
+from cloudbot.clients.irc_parser import irc_clean, parse_line
+from cloudbot.clients.irc_queue import SendQueue, PRIORITY_URGENT
+from cloudbot.clients.irc_state import IrcState
 from cloudbot.event import Event, EventType
+from cloudbot.util.formatting import chunk_bytes
+from cloudbot.util.linebuffer import LineBuffer
 
 logger = logging.getLogger("cloudbot")
 
-irc_prefix_re = re.compile(r":([^ ]*) ([^ ]*) (.*)")
-irc_noprefix_re = re.compile(r"([^ ]*) (.*)")
-irc_netmask_re = re.compile(r"([^!@]*)!([^@]*)@(.*)")
-irc_param_re = re.compile(r"(?:^|(?<= ))(:.*|[^ ]+)")
-
-irc_bad_chars = ''.join([chr(x) for x in list(range(0, 1)) + list(range(4, 32)) + list(range(127, 160))])
-irc_clean_re = re.compile('[{}]'.format(re.escape(irc_bad_chars)))
-
-def irc_clean(dirty):
-    return irc_clean_re.sub('',dirty)
+# the longest user@host we expect the server to show for us, until we've seen our real one
+DEFAULT_USER_HOST_LENGTH = 10 + 1 + 63
 
 irc_command_to_event_type = {
     "PRIVMSG": EventType.message,
@@ -30,18 +30,6 @@ irc_command_to_event_type = {
 }
 
 
-def decode(bytestring):
-    """
-    Tries to decode a bytestring using multiple encoding formats
-    """
-    for codec in ('utf-8', 'iso-8859-1', 'shift_jis', 'cp1252'):
-        try:
-            return bytestring.decode(codec)
-        except UnicodeDecodeError:
-            continue
-    return bytestring.decode('utf-8', errors='ignore')
-
-
 class IrcClient(Client):
     """
     An implementation of Client for IRC.
@@ -50,6 +38,13 @@ class IrcClient(Client):
     :type port: int
     :type _connected: bool
     :type _ignore_cert_errors: bool
+    :type decoder: Decoder
+    :type send_queue: SendQueue
+    :type ingress: IngressQueue
+    :type user_host: str
+    :type state: IrcState
+    :type caps: CapNegotiator
+    :type batches: BatchCollector
     """
 
     def __init__(self, bot, name, nick, *, channels=None, config=None,
@@ -84,6 +79,36 @@ class IrcClient(Client):
         else:
             self.ssl_context = None
 
+        self.decoder = Decoder(self.config.get("encodings", DEFAULT_CODECS), self.config.get("decode_cache_size", 1024))
+        if self.decoder.unreachable:
+            logger.warning("[{}] Encodings {} will never be used, as {} can decode anything".format(
+                self.name, ", ".join(self.decoder.unreachable), self.decoder.codecs[-1]))
+
+        send_config = self.config.get("send_queue", {})
+        self.send_queue = SendQueue(self.loop, burst=send_config.get("burst", 5), rate=send_config.get("rate", 1.0),
+                                    bulk_after=send_config.get("bulk_after", 3),
+                                    max_bulk=send_config.get("max_bulk", 200),
+                                    collapse_duplicates=send_config.get("collapse_duplicates", False))
+
+        ingress_config = self.config.get("ingress", {})
+        self.ingress = IngressQueue(self.loop, self._process_event,
+                                    concurrency=ingress_config.get("concurrency", 16),
+                                    high_water=ingress_config.get("high_water", 1000),
+                                    low_water=ingress_config.get("low_water"),
+                                    max_passive=ingress_config.get("max_passive", 500))
+
+        # the user@host the server shows for us, learned from our own JOINs
+        self.user_host = None
+
+        # the members of our channels, and their user@hosts
+        self.state = IrcState()
+
+        # the IRCv3 capabilities the server offers and has enabled, and the batches it's sending
+        self.caps = CapNegotiator()
+        self.batches = BatchCollector()
+        # batch types whose lines are only dispatched as the BATCH event, rather than also one by one after it
+        self.collapse_batches = frozenset(self.config.get("collapse_batches", []))
+
         # if we're connected
         self._connected = False
         # if we've quit
@@ -122,12 +147,46 @@ class IrcClient(Client):
         self._transport, self._protocol = yield from self.loop.create_connection(
             lambda: _IrcProtocol(self), host=self.server, port=self.port, ssl=self.ssl_context, **optional_params)
 
+        # start capability negotiation, which holds registration until we send CAP END
+        for line in self.caps.start():
+            self.send(line, PRIORITY_URGENT)
+
         # send the password, nick, and user
         self.set_pass(self.config["connection"].get("password"))
         self.set_nick(self.nick)
         self.cmd("USER", self.config.get('user', 'cloudbot'), "3", "*",
                  self.config.get('realname', 'CloudBot - https://git.io/CloudBot'))
 
+    def _process_event(self, event):
+        """
+        Starts processing an event taken from the ingress queue
+        :type event: Event
+        :return: A future which is done once the event's hooks have been started, so a queue slot isn't held while slow
+                 hooks run
+        :rtype: asyncio.Future
+        """
+        launched = asyncio.Future(loop=self.loop)
+        task = asyncio.async(self.bot.process(event, launched), loop=self.loop)
+        # processing can fail before every hook is started
+        task.add_done_callback(lambda _: launched.done() or launched.set_result(None))
+        return launched
+
+    def wanted_caps(self):
+        """
+        :return: The capabilities from the config, and those plugins have irc_cap hooks for
+        :rtype: set[str]
+        """
+        wanted = set(self.config.get("caps", DEFAULT_CAPS))
+        wanted.update(self.bot.plugin_manager.cap_hooks)
+        return wanted
+
+    def request_caps(self):
+        """
+        Requests any wanted capabilities the server offers which aren't enabled yet, eg. after loading a plugin
+        """
+        for line in self.caps.request(self.wanted_caps()):
+            self.send(line, PRIORITY_URGENT)
+
     def quit(self, reason=None):
         if self._quit:
             return
@@ -146,10 +205,26 @@ class IrcClient(Client):
         self._transport.close()
         self._connected = False
 
+    def message_budget(self, command, target):
+        """
+        Returns how many bytes of text fit in a message, once the server adds our prefix to relay it to others
+        :type command: str
+        :type target: str
+        :rtype: int
+        """
+        if self.user_host is None:
+            user_host_length = DEFAULT_USER_HOST_LENGTH
+        else:
+            user_host_length = len(self.user_host.encode("utf-8"))
+        # :nick!user@host COMMAND target :text\r\n
+        overhead = len(":{}! {} {} :\r\n".format(self.nick, command, target).encode("utf-8")) + user_host_length
+        return 512 - overhead
+
     def message(self, target, *messages):
         for text in messages:
             text = "".join(text.splitlines())
-            self.cmd("PRIVMSG", target, text)
+            for chunk in chunk_bytes(text, self.message_budget("PRIVMSG", target)):
+                self.cmd("PRIVMSG", target, chunk)
 
     def action(self, target, text):
         text = "".join(text.splitlines())
@@ -157,7 +232,8 @@ class IrcClient(Client):
 
     def notice(self, target, text):
         text = "".join(text.splitlines())
-        self.cmd("NOTICE", target, text)
+        for chunk in chunk_bytes(text, self.message_budget("NOTICE", target)):
+            self.cmd("NOTICE", target, chunk)
 
     def set_nick(self, nick):
         self.cmd("NICK", nick)
@@ -184,8 +260,10 @@ class IrcClient(Client):
         :type text: str
         :type target: str
         """
-        out = "\x01{} {}\x01".format(ctcp_type, text)
-        self.cmd("PRIVMSG", target, out)
+        budget = self.message_budget("PRIVMSG", target) - len("\x01{} \x01".format(ctcp_type).encode("utf-8"))
+        for chunk in chunk_bytes(text, budget):
+            out = "\x01{} {}\x01".format(ctcp_type, chunk)
+            self.cmd("PRIVMSG", target, out)
 
     def cmd(self, command, *params):
         """
@@ -202,22 +280,25 @@ class IrcClient(Client):
         else:
             self.send(command)
 
-    def send(self, line):
+    def send(self, line, priority=None):
         """
-        Sends a raw IRC line
+        Queues a raw IRC line to be sent
+        :param priority: One of the PRIORITY_ constants in cloudbot.clients.irc_queue, or None to pick one from the line
         :type line: str
+        :type priority: int | None
         """
         if not self._connected:
             raise ValueError("Client must be connected to irc server to use send")
-        self.loop.call_soon_threadsafe(self._send, line)
+        self.loop.call_soon_threadsafe(self._send, line, priority)
 
-    def _send(self, line):
+    def _send(self, line, priority=None):
         """
-        Sends a raw IRC line unchecked. Doesn't do connected check, and is *not* threadsafe
+        Queues a raw IRC line unchecked. Doesn't do connected check, and is *not* threadsafe
         :type line: str
+        :type priority: int | None
         """
         logger.info("[{}] >> {}".format(self.name, line))
-        asyncio.async(self._protocol.send(line), loop=self.loop)
+        self.send_queue.put(line, priority)
 
 
     @property
@@ -230,10 +311,9 @@ class _IrcProtocol(asyncio.Protocol):
     :type loop: asyncio.events.AbstractEventLoop
     :type conn: IrcClient
     :type bot: cloudbot.bot.CloudBot
-    :type _input_buffer: bytes
+    :type _input_buffer: LineBuffer
     :type _connected: bool
     :type _transport: asyncio.transports.Transport
-    :type _connected_future: asyncio.Future
     """
 
     def __init__(self, conn):
@@ -245,7 +325,7 @@ class _IrcProtocol(asyncio.Protocol):
         self.conn = conn
 
         # input buffer
-        self._input_buffer = b""
+        self._input_buffer = LineBuffer()
 
         # connected
         self._connected = False
@@ -253,20 +333,19 @@ class _IrcProtocol(asyncio.Protocol):
         # transport
         self._transport = None
 
-        # Future that waits until we are connected
-        self._connected_future = asyncio.Future(loop=self.loop)
-
     def connection_made(self, transport):
         self._transport = transport
+        self._input_buffer.clear()
+        self.conn.state.clear()
+        self.conn.batches.clear()
+        self.conn.send_queue.attach(transport.write)
+        self.conn.ingress.attach(transport.pause_reading, transport.resume_reading)
         self._connected = True
-        self._connected_future.set_result(None)
-        # we don't need the _connected_future, everything uses it will check _connected first.
-        del self._connected_future
 
     def connection_lost(self, exc):
         self._connected = False
-        # create a new connected_future for when we are connected.
-        self._connected_future = asyncio.Future(loop=self.loop)
+        self.conn.send_queue.detach(self._transport.write)
+        self.conn.ingress.detach(self._transport.pause_reading)
         if exc is None:
             # we've been closed intentionally, so don't reconnect
             return
@@ -275,129 +354,160 @@ class _IrcProtocol(asyncio.Protocol):
 
     def eof_received(self):
         self._connected = False
-        # create a new connected_future for when we are connected.
-        self._connected_future = asyncio.Future(loop=self.loop)
+        self.conn.send_queue.detach(self._transport.write)
+        self.conn.ingress.detach(self._transport.pause_reading)
         logger.info("[{}] EOF received.".format(self.conn.name))
         asyncio.async(self.conn.connect(), loop=self.loop)
         return True
 
-    @asyncio.coroutine
-    def send(self, line):
-        # make sure we are connected before sending
-        if not self._connected:
-            yield from self._connected_future
-        line = line[:510] + "\r\n"
-        data = line.encode("utf-8", "replace")
-        self._transport.write(data)
-
     def data_received(self, data):
-        self._input_buffer += data
+        dropped = self._input_buffer.dropped
+        lines = self._input_buffer.feed(data)
+        if self._input_buffer.dropped != dropped:
+            logger.warning("[{}] Dropped {} line(s) longer than {} bytes from {}".format(
+                self.conn.name, self._input_buffer.dropped - dropped, self._input_buffer.max_line_length,
+                self.conn.describe_server()))
 
-        while b"\r\n" in self._input_buffer:
-            line_data, self._input_buffer = self._input_buffer.split(b"\r\n", 1)
-            line = decode(line_data)
+        for line_data in lines:
+            line = self.conn.decoder.decode(line_data)
 
             # parse the line into a message
-            if line.startswith(":"):
-                prefix_line_match = irc_prefix_re.match(line)
-                if prefix_line_match is None:
-                    logger.critical("[{}] Received invalid IRC line '{}' from {}".format(
-                        self.conn.name, line, self.conn.describe_server()))
-                    continue
-
-                netmask_prefix, command, params = prefix_line_match.groups()
-                prefix = ":" + netmask_prefix  # TODO: Do we need to know this?
-                netmask_match = irc_netmask_re.match(netmask_prefix)
-                if netmask_match is None:
-                    # This isn't in the format of a netmask
-                    nick = netmask_prefix
-                    user = None
-                    host = None
-                    mask = netmask_prefix
-                else:
-                    nick = netmask_match.group(1)
-                    user = netmask_match.group(2)
-                    host = netmask_match.group(3)
-                    mask = netmask_prefix
-            else:
-                prefix = None
-                noprefix_line_match = irc_noprefix_re.match(line)
-                if noprefix_line_match is None:
-                    logger.critical("[{}] Received invalid IRC line '{}' from {}".format(
-                        self.conn.name, line, self.conn.describe_server()))
-                    continue
-                command = noprefix_line_match.group(1)
-                params = noprefix_line_match.group(2)
-                nick = None
-                user = None
-                host = None
-                mask = None
-
-            command_params = irc_param_re.findall(params)
+            message = parse_line(line)
+            if message is None:
+                logger.critical("[{}] Received invalid IRC line '{}' from {}".format(
+                    self.conn.name, line, self.conn.describe_server()))
+                continue
+
+            command = message.command
+
+            if command == "JOIN" and message.host is not None and message.nick.lower() == self.conn.nick.lower():
+                # this is how the server shows us to others, which decides how long our messages can be
+                self.conn.user_host = "{}@{}".format(message.user, message.host)
+
+            # update the channel state before any hooks see the line, while conn.nick is still our nick before it
+            self.conn.state.handle(message, self.conn.nick)
 
             # Reply to pings immediately
 
-            if command == "PING":
-                asyncio.async(self.send("PONG " + command_params[-1]), loop=self.loop)
+            if command == "PING" and message.params:
+                self.conn.send_queue.put("PONG " + message.params[-1], PRIORITY_URGENT)
+            elif command == "CAP":
+                self._handle_cap(message)
+            elif command == "001":
+                # we're registered, whether or not the server answered CAP LS
+                self.conn.caps.registered()
+
+            # lines in a batch are held until it ends, and then handled together
+            item = self.conn.batches.feed(line, message)
+            if item is None:
+                continue
+            if isinstance(item, Batch):
+                self._dispatch_batch(item)
+                continue
+
+            self._dispatch(line, message)
+
+    def _handle_cap(self, message):
+        """
+        :type message: cloudbot.clients.irc_parser.Message
+        """
+        params = [param[1:] if param.startswith(":") else param for param in message.params]
+        send, changes = self.conn.caps.handle(params, self.conn.wanted_caps())
+        for line in send:
+            self.conn.send_queue.put(line, PRIORITY_URGENT)
+        for cap, value, enabled in changes:
+            logger.info("[{}] Capability {} {}".format(self.conn.name, cap, "enabled" if enabled else "removed"))
+            asyncio.async(self.bot.plugin_manager.cap_changed(self.conn, cap, value, enabled), loop=self.loop)
+
+    def _dispatch_batch(self, batch):
+        """
+        Sends a whole batch to the plugins as one BATCH event, then each of its lines, unless its type is collapsed
+        :type batch: Batch
+        """
+        raw = " ".join(["BATCH", "+" + batch.reference, batch.type] + batch.params)
+        event = Event(bot=self.bot, conn=self.conn, event_type=EventType.other, irc_raw=raw, irc_command="BATCH",
+                      irc_paramlist=[batch.type] + batch.params, irc_tags=batch.tags, irc_batch=batch)
+        self.conn.ingress.put(event, PRIORITY_CONTROL)
 
-            # Parse the command and params
+        for line, message in batch.inner_lines(self.conn.collapse_batches):
+            self._dispatch(line, message)
 
-            # Content
-            if command_params and command_params[-1].startswith(":"):
-                # If the last param is in the format of `:content` remove the `:` from it, and set content from it
-                content_raw = command_params[-1][1:]
-                content = irc_clean(content_raw)
-            else:
-                content_raw = None
-                content = None
+    def _dispatch(self, line, message):
+        """
+        Sends a line to the plugins
+        :type line: str
+        :type message: cloudbot.clients.irc_parser.Message
+        """
+        command = message.command
+        command_params = message.params
+        nick = message.nick
 
-            # Event type
-            if command in irc_command_to_event_type:
-                event_type = irc_command_to_event_type[command]
-            else:
-                event_type = EventType.other
+        # Parse the command and params
 
-            # Target (for KICK, INVITE)
-            if event_type is EventType.kick:
-                target = command_params[1]
-            elif command == "INVITE":
-                target = command_params[0]
-            else:
-                # TODO: Find more commands which give a target
-                target = None
-
-            # Parse for CTCP
-            if event_type is EventType.message and content_raw.count("\x01") >= 2 and content_raw.startswith("\x01"):
-                # Remove the first \x01, then rsplit to remove the last one, and ignore text after the last \x01
-                ctcp_text = content_raw[1:].rsplit("\x01", 1)[0]
-                ctcp_text_split = ctcp_text.split(None, 1)
-                if ctcp_text_split[0] == "ACTION":
-                    # this is a CTCP ACTION, set event_type and content accordingly
-                    event_type = EventType.action
-                    content = ctcp_text_split[1]
-                else:
-                    # this shouldn't be considered a regular message
-                    event_type = EventType.other
-            else:
-                ctcp_text = None
+        # Content
+        content_raw = message.content_raw
+        if content_raw is not None:
+            content = irc_clean(content_raw)
+        else:
+            content = None
 
-            # Channel
-            # TODO: Migrate plugins using chan for storage to use chan.lower() instead so we can pass the original case
-            if command_params and (len(command_params) > 2 or not command_params[0].startswith(":")):
+        # Event type
+        if command in irc_command_to_event_type:
+            event_type = irc_command_to_event_type[command]
+        else:
+            event_type = EventType.other
 
-                if command_params[0].lower() == self.conn.nick.lower():
-                    # this is a private message - set the channel to the sender's nick
-                    channel = nick.lower()
-                else:
-                    channel = command_params[0].lower()
+        # Target (for KICK, INVITE)
+        if event_type is EventType.kick:
+            target = command_params[1]
+        elif command == "INVITE":
+            target = command_params[0]
+        else:
+            # TODO: Find more commands which give a target
+            target = None
+
+        # Parse for CTCP
+        if event_type is EventType.message and content_raw.count("\x01") >= 2 and content_raw.startswith("\x01"):
+            # Remove the first \x01, then rsplit to remove the last one, and ignore text after the last \x01
+            ctcp_text = content_raw[1:].rsplit("\x01", 1)[0]
+            ctcp_text_split = ctcp_text.split(None, 1)
+            if ctcp_text_split[0] == "ACTION":
+                # this is a CTCP ACTION, set event_type and content accordingly
+                event_type = EventType.action
+                content = ctcp_text_split[1]
             else:
-                channel = None
+                # this shouldn't be considered a regular message
+                event_type = EventType.other
+        else:
+            ctcp_text = None
 
-            # Set up parsed message
-            # TODO: Do we really want to send the raw `prefix` and `command_params` here?
-            event = Event(bot=self.bot, conn=self.conn, event_type=event_type, content=content, target=target,
-                          channel=channel, nick=nick, user=user, host=host, mask=mask, irc_raw=line, irc_prefix=prefix,
-                          irc_command=command, irc_paramlist=command_params, irc_ctcp_text=ctcp_text)
+        # Channel
+        # TODO: Migrate plugins using chan for storage to use chan.lower() instead so we can pass the original case
+        if command_params and (len(command_params) > 2 or not command_params[0].startswith(":")):
 
-            # handle the message, async
-            asyncio.async(self.bot.process(event), loop=self.loop)
+            if command_params[0].lower() == self.conn.nick.lower():
+                # this is a private message - set the channel to the sender's nick
+                channel = nick.lower()
+            else:
+                channel = command_params[0].lower()
+        else:
+            channel = None
+
+        # Set up parsed message
+        # TODO: Do we really want to send the raw `prefix` and `command_params` here?
+        event = Event(bot=self.bot, conn=self.conn, event_type=event_type, content=content, target=target,
+                      channel=channel, nick=nick, user=message.user, host=message.host, mask=message.mask,
+                      irc_raw=line, irc_prefix=message.prefix, irc_command=command, irc_paramlist=command_params,
+                      irc_ctcp_text=ctcp_text, irc_tags=message.tags)
+
+        # queue the message to be handled, commands before lines only passive hooks will look at
+        if event_type in (EventType.message, EventType.action, EventType.notice):
+            priority = PRIORITY_PASSIVE
+            if event_type is EventType.message and content is not None and channel is not None and nick is not None:
+                channel_re, private_re = self.conn.get_command_regexes()
+                command_re = private_re if channel == nick.lower() else channel_re
+                if command_re.match(content):
+                    priority = PRIORITY_COMMAND
+        else:
+            priority = PRIORITY_CONTROL
+        self.conn.ingress.put(event, priority)
@@ -0,0 +1,102 @@
+"""
+irc_batch.py
+
+Groups the lines of IRCv3 batches. A server with the batch capability wraps related lines, like the thousands of
+QUITs of a netsplit, in BATCH +reference and BATCH -reference lines, and tags every line in between with the
+reference. The lines are held until the batch ends, and then handed over together, followed by each line on its own
+so hooks which don't know about batches still see every QUIT and JOIN.
+"""
+
+
+class Batch:
+    """
+    :type reference: str
+    :type type: str
+    :type params: list[str]
+    :type tags: dict[str, str] | None
+    :type parent: str | None
+    :type lines: list[str]
+    :type messages: list[cloudbot.clients.irc_parser.Message]
+    """
+    __slots__ = ("reference", "type", "params", "tags", "parent", "lines", "messages")
+
+    def __init__(self, reference, batch_type, params, tags=None, parent=None):
+        self.reference = reference
+        self.type = batch_type
+        self.params = params
+        self.tags = tags
+        self.parent = parent
+        # the raw lines of the batch, and the same lines parsed, in the order they were received
+        self.lines = []
+        self.messages = []
+
+    def inner_lines(self, collapsed=()):
+        """
+        :param collapsed: The batch types whose lines are only handed over as the whole batch
+        :type collapsed: set[str]
+        :return: (line, message) for each line to hand over on its own, after the batch
+        :rtype: list[(str, cloudbot.clients.irc_parser.Message)]
+        """
+        if self.type in collapsed:
+            return []
+        return list(zip(self.lines, self.messages))
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __repr__(self):
+        return "Batch({!r}, {!r}, {} lines)".format(self.reference, self.type, len(self.messages))
+
+
+class BatchCollector:
+    """
+    :type open: dict[str, Batch]
+    """
+
+    def __init__(self):
+        self.open = {}
+
+    def clear(self):
+        """
+        Forgets every open batch, eg. after reconnecting
+        """
+        self.open.clear()
+
+    def feed(self, line, message):
+        """
+        Adds a line to the batch it's part of, if any. Lines in a nested batch are added straight to the outermost
+        batch, so they stay in the order they were received.
+        :type line: str
+        :type message: cloudbot.clients.irc_parser.Message
+        :return: The message itself if it isn't part of a batch, the Batch if this line ended one, or None if the line
+                 was held
+        :rtype: cloudbot.clients.irc_parser.Message | Batch | None
+        """
+        tags = message.tags
+        if message.command == "BATCH" and message.params:
+            reference = message.params[0]
+            if reference.startswith("+") and len(message.params) > 1:
+                parent = tags.get("batch") if tags else None
+                if parent not in self.open:
+                    parent = None
+                self.open[reference[1:]] = Batch(reference[1:], message.params[1], message.params[2:], tags, parent)
+                return None
+            if reference.startswith("-"):
+                batch = self.open.pop(reference[1:], None)
+                if batch is None:
+                    return message
+                if batch.parent is not None and batch.parent in self.open:
+                    # its lines are already in the outer batch
+                    return None
+                return batch
+            return message
+
+        if tags:
+            batch = self.open.get(tags.get("batch"))
+            if batch is not None:
+                while batch.parent is not None and batch.parent in self.open:
+                    batch = self.open[batch.parent]
+                batch.lines.append(line)
+                batch.messages.append(message)
+                return None
+        return message
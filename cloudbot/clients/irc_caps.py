@@ -0,0 +1,153 @@
+"""
+irc_caps.py
+
+IRCv3 capability negotiation. The server lists its capabilities in reply to CAP LS, we request the ones we want with
+CAP REQ, and registration continues once we send CAP END. Servers which don't support CAP ignore it, or reply with
+an unknown command error, and register us anyway.
+"""
+
+# capabilities requested when the connection's config doesn't list any
+DEFAULT_CAPS = ("multi-prefix", "userhost-in-names", "server-time", "batch", "message-tags", "cap-notify")
+
+# CAP REQ lines are split so the capability list stays well under the line length limit
+MAX_REQ_LENGTH = 400
+
+
+def parse_caps(text):
+    """
+    Parses a list of capabilities, some of which may have a value, eg. "sasl=PLAIN,EXTERNAL multi-prefix"
+    :type text: str
+    :rtype: dict[str, str | None]
+    """
+    caps = {}
+    for cap in text.split():
+        name, equals, value = cap.partition("=")
+        caps[name] = value if equals else None
+    return caps
+
+
+def req_lines(caps):
+    """
+    Creates the CAP REQ lines for some capabilities
+    :type caps: list[str]
+    :rtype: list[str]
+    """
+    lines = []
+    current = []
+    length = 0
+    for cap in caps:
+        if current and length + len(cap) + 1 > MAX_REQ_LENGTH:
+            lines.append("CAP REQ :" + " ".join(current))
+            current = []
+            length = 0
+        current.append(cap)
+        length += len(cap) + 1
+    if current:
+        lines.append("CAP REQ :" + " ".join(current))
+    return lines
+
+
+class CapNegotiator:
+    """
+    The capabilities of one connection.
+
+    :type available: dict[str, str | None]
+    :type enabled: dict[str, str | None]
+    :type negotiating: bool
+    """
+
+    def __init__(self):
+        self.available = {}
+        self.enabled = {}
+        # whether registration is waiting for us to send CAP END
+        self.negotiating = False
+        self._listing = {}
+        self._requested = set()
+
+    def start(self):
+        """
+        Starts negotiating on a new connection
+        :return: The lines to send
+        :rtype: list[str]
+        """
+        self.available.clear()
+        self.enabled.clear()
+        self._listing.clear()
+        self._requested.clear()
+        self.negotiating = True
+        return ["CAP LS 302"]
+
+    def registered(self):
+        """
+        Called once the server has registered us, so there's nothing to end even if the server never replied
+        """
+        self.negotiating = False
+
+    def request(self, wanted):
+        """
+        Requests the wanted capabilities which are available, but not enabled or already requested
+        :type wanted: collections.Set[str]
+        :return: The lines to send
+        :rtype: list[str]
+        """
+        caps = [cap for cap in self.available
+                if cap in wanted and cap not in self.enabled and cap not in self._requested]
+        self._requested.update(caps)
+        return req_lines(caps)
+
+    def handle(self, params, wanted):
+        """
+        Handles a CAP line from the server
+        :param params: The params of the CAP line, without the ':' of the trailing param
+        :param wanted: The capabilities we want to use
+        :type params: list[str]
+        :type wanted: collections.Set[str]
+        :return: The lines to send, and the (capability, value, enabled) of each capability enabled or removed
+        :rtype: (list[str], list[(str, str | None, bool)])
+        """
+        if len(params) < 3:
+            return [], []
+        subcommand = params[1].upper()
+        # with CAP LS 302, a "*" before the list means there are more lines to come
+        more = len(params) > 3 and params[2] == "*"
+        caps = parse_caps(params[-1])
+        send = []
+        changes = []
+
+        if subcommand == "LS":
+            self._listing.update(caps)
+            if more:
+                return [], []
+            self.available.update(self._listing)
+            self._listing.clear()
+            send = self.request(wanted)
+        elif subcommand == "NEW":
+            self.available.update(caps)
+            send = self.request(wanted)
+        elif subcommand == "DEL":
+            for cap in caps:
+                self.available.pop(cap, None)
+                if cap in self.enabled:
+                    changes.append((cap, self.enabled.pop(cap), False))
+        elif subcommand == "ACK":
+            for cap in caps:
+                if cap.startswith("-"):
+                    cap = cap[1:]
+                    self._requested.discard(cap)
+                    if cap in self.enabled:
+                        changes.append((cap, self.enabled.pop(cap), False))
+                else:
+                    self._requested.discard(cap)
+                    value = self.available.get(cap)
+                    self.enabled[cap] = value
+                    changes.append((cap, value, True))
+        elif subcommand == "NAK":
+            for cap in caps:
+                self._requested.discard(cap)
+        else:
+            return [], []
+
+        if self.negotiating and not self._requested:
+            send.append("CAP END")
+            self.negotiating = False
+        return send, changes
@@ -0,0 +1,237 @@
+"""
+irc_decoder.py
+
+Decodes incoming IRC lines, which don't come with any indication of their encoding.
+
+Pure ASCII lines, which are most of them, are decoded directly. For anything else, the codecs are tried in the
+configured order, but the codec which last worked for the same sender and for the same channel is tried first, so
+a user who always writes in shift_jis or cp1250 doesn't fail utf-8 on every line.
+"""
+
+import codecs
+import re
+from collections import OrderedDict
+
+DEFAULT_CODECS = ("utf-8", "iso-8859-1")
+
+try:
+    _is_ascii = bytes.isascii
+except AttributeError:
+    # Python < 3.7
+    _non_ascii_re = re.compile(b"[\x80-\xff]")
+
+    def _is_ascii(data):
+        return _non_ascii_re.search(data) is None
+# a lead byte followed by a continuation byte, which is very unlikely in text which isn't utf-8
+_utf8_sequence_re = re.compile(b"[\xc2-\xf4][\x80-\xbf]")
+
+_channel_prefixes = (b"#", b"&")
+
+
+def decodes_anything(codec):
+    """
+    Checks if a codec can decode any sequence of bytes, like iso-8859-1. Codecs after one of these are never tried.
+    :type codec: str
+    :rtype: bool
+    """
+    try:
+        bytes(range(256)).decode(codec)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def line_sender(data):
+    """
+    Finds the prefix (':' followed by the sender mask) of a raw IRC line, without decoding it
+    :type data: bytes
+    :rtype: bytes | None
+    """
+    start = 0
+    if data.startswith(b"@"):
+        # skip the tags
+        start = data.find(b" ") + 1
+        if not start:
+            return None
+    if not data.startswith(b":", start):
+        return None
+    end = data.find(b" ", start)
+    if end == -1:
+        return None
+    return data[start:end]
+
+
+def line_channel(data):
+    """
+    Finds the target of a raw IRC line if it's a channel, without decoding it
+    :type data: bytes
+    :rtype: bytes | None
+    """
+    if data[:1] == b"@":
+        parts = data.split(b" ", 4)[1:]
+        if not parts:
+            return None
+    else:
+        parts = data.split(b" ", 3)
+
+    if parts[0][:1] == b":":
+        target = parts[2] if len(parts) > 2 else None
+    else:
+        target = parts[1] if len(parts) > 1 else None
+
+    if target is None or target[:1] not in _channel_prefixes:
+        return None
+    return target.lower()
+
+
+class Decoder:
+    """
+    Decodes the lines received by one connection.
+
+    :type codecs: tuple[str]
+    :type unreachable: tuple[str]
+    :type cache_size: int
+    :type lines: int
+    :type ascii: int
+    :type cache_hits: int
+    :type failures: int
+    :type fallbacks: int
+    :type decoded: dict[str, int]
+    """
+
+    def __init__(self, codec_names=DEFAULT_CODECS, cache_size=1024):
+        """
+        :param codec_names: The codecs to try, in order. Unknown codecs raise a LookupError.
+        :param cache_size: How many senders, and how many channels, to remember codecs for
+        :type codec_names: collections.Iterable[str]
+        :type cache_size: int
+        """
+        names = []
+        for name in codec_names:
+            name = codecs.lookup(name).name
+            if name not in names:
+                names.append(name)
+        if not names:
+            raise ValueError("Decoder needs at least one codec")
+
+        self._catch_all = frozenset(name for name in names if decodes_anything(name))
+        # everything after the first codec which can't fail is useless
+        for i, name in enumerate(names):
+            if name in self._catch_all:
+                self.codecs = tuple(names[:i + 1])
+                self.unreachable = tuple(names[i + 1:])
+                break
+        else:
+            self.codecs = tuple(names)
+            self.unreachable = ()
+
+        self.cache_size = cache_size
+        self._senders = OrderedDict()
+        self._channels = OrderedDict()
+
+        self.lines = 0
+        self.ascii = 0
+        # lines decoded by the codec remembered for their sender or channel
+        self.cache_hits = 0
+        # decode attempts which raised UnicodeDecodeError
+        self.failures = 0
+        # lines no codec could decode, which were decoded with the first codec, ignoring errors
+        self.fallbacks = 0
+        self.decoded = {name: 0 for name in self.codecs}
+
+    def decode(self, data):
+        """
+        :type data: bytes
+        :rtype: str
+        """
+        self.lines += 1
+        if _is_ascii(data):
+            self.ascii += 1
+            return data.decode("ascii")
+
+        sender = channel = codec = None
+        # only look for the sender and channel if there's something remembered for them
+        if self._senders:
+            sender = line_sender(data)
+            codec = self._senders.get(sender)
+            if codec is not None:
+                self._senders.move_to_end(sender)
+        if codec is None and self._channels:
+            channel = line_channel(data)
+            codec = self._channels.get(channel)
+            if codec is not None:
+                self._channels.move_to_end(channel)
+
+        # a codec like iso-8859-1 will "decode" utf-8 text too, so don't trust it when the line looks like utf-8
+        remembered = codec
+        if codec is not None and (codec not in self._catch_all or _utf8_sequence_re.search(data) is None):
+            try:
+                text = data.decode(codec)
+            except UnicodeDecodeError:
+                self.failures += 1
+            else:
+                self.cache_hits += 1
+                self.decoded[codec] += 1
+                return text
+        else:
+            codec = None
+
+        for name in self.codecs:
+            if name == codec:
+                # already failed above
+                continue
+            try:
+                text = data.decode(name)
+            except UnicodeDecodeError:
+                self.failures += 1
+                continue
+            self.decoded[name] += 1
+            if name != self.codecs[0]:
+                self._remember(sender or line_sender(data), channel or line_channel(data), name)
+            elif remembered is not None:
+                # the first codec is always tried anyway, so there's no need to remember anything else
+                self._forget(sender or line_sender(data), channel or line_channel(data))
+            return text
+
+        self.fallbacks += 1
+        return data.decode(self.codecs[0], errors="ignore")
+
+    def _remember(self, sender, channel, codec):
+        """
+        :type sender: bytes | None
+        :type channel: bytes | None
+        :type codec: str
+        """
+        for cache, key in ((self._senders, sender), (self._channels, channel)):
+            if key is None:
+                continue
+            cache[key] = codec
+            cache.move_to_end(key)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def _forget(self, sender, channel):
+        """
+        Forgets the codecs remembered for a sender and channel
+        :type sender: bytes | None
+        :type channel: bytes | None
+        """
+        if sender is not None:
+            self._senders.pop(sender, None)
+        if channel is not None:
+            self._channels.pop(channel, None)
+
+    def stats(self):
+        """
+        :rtype: dict[str, int | dict[str, int]]
+        """
+        return {
+            "lines": self.lines,
+            "ascii": self.ascii,
+            "cache_hits": self.cache_hits,
+            "failures": self.failures,
+            "fallbacks": self.fallbacks,
+            "decoded": dict(self.decoded),
+            "senders": len(self._senders),
+            "channels": len(self._channels)
+        }
@@ -0,0 +1,189 @@
+"""
+irc_ingress.py
+
+The incoming event queue of an IRC connection.
+
+Rather than starting a task for every line as soon as it's read, events are queued by priority and only a limited
+number are started at once: server and state lines first, then commands, then lines which only passive hooks (regex
+and event hooks) care about. An event only holds its slot until its hooks have been started, not while they run, so slow
+hooks can't hold up the lines behind them. Under overload the oldest passive events are dropped, and once too many
+control events are queued the connection stops reading until they have drained. A backlog of commands or passive
+events never stops reading, as that would also stop the bot from seeing the server's PINGs.
+"""
+
+from collections import deque
+
+PRIORITY_CONTROL = 0
+PRIORITY_COMMAND = 1
+PRIORITY_PASSIVE = 2
+
+
+class IngressQueue:
+    """
+    :type concurrency: int
+    :type high_water: int
+    :type low_water: int
+    :type max_passive: int
+    :type running: int
+    :type paused: bool
+    :type enqueued: int
+    :type processed: int
+    :type shed: int
+    :type pauses: int
+    :type total_wait: float
+    :type max_wait: float
+    """
+
+    def __init__(self, loop, spawn, *, concurrency=16, high_water=1000, low_water=None, max_passive=500):
+        """
+        :param loop: The event loop, used for timing how long events wait
+        :param spawn: Starts processing an event, returning a future which is done once its hooks have been started
+        :param concurrency: How many events can be started at once
+        :param high_water: How many queued control events stop reading from the connection
+        :param low_water: How few queued control events start reading again, half of high_water by default
+        :param max_passive: The most passive events which are queued, older ones are dropped to make room
+        :type loop: asyncio.events.AbstractEventLoop
+        :type spawn: (object) -> asyncio.Future
+        :type concurrency: int
+        :type high_water: int
+        :type low_water: int | None
+        :type max_passive: int
+        """
+        self.loop = loop
+        self.spawn = spawn
+        self.concurrency = max(concurrency, 1)
+        self.high_water = high_water
+        self.low_water = high_water // 2 if low_water is None else low_water
+        self.max_passive = max_passive
+
+        # one deque of (queued time, item) for each priority
+        self._queues = (deque(), deque(), deque())
+        self._pause = None
+        self._resume = None
+        self.running = 0
+        self.paused = False
+
+        self.enqueued = 0
+        self.processed = 0
+        self.shed = 0
+        self.pauses = 0
+        # seconds events spent queued before being started
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def attach(self, pause, resume):
+        """
+        Starts pausing and resuming reading with the given functions, usually a transport's pause_reading() and
+        resume_reading()
+        :type pause: () -> None
+        :type resume: () -> None
+        """
+        self._pause = pause
+        self._resume = resume
+        self.paused = False
+        self._check_water()
+
+    def detach(self, pause=None):
+        """
+        Stops pausing reading. Queued events are still processed, as they were already received.
+        :param pause: If given, only detach if this is the function currently attached, so a closing connection doesn't
+                      detach the one replacing it
+        :type pause: () -> None
+        """
+        if pause is not None and pause != self._pause:
+            return
+        self._pause = None
+        self._resume = None
+        self.paused = False
+
+    def put(self, item, priority=PRIORITY_PASSIVE):
+        """
+        Queues an event to be processed. This is not thread safe, and should only be called from the event loop.
+        :type item: object
+        :type priority: int
+        """
+        self.enqueued += 1
+        if priority == PRIORITY_PASSIVE and self.max_passive is not None:
+            passive = self._queues[PRIORITY_PASSIVE]
+            if len(passive) >= self.max_passive:
+                if not self.max_passive:
+                    self.shed += 1
+                    return
+                passive.popleft()
+                self.shed += 1
+        self._queues[priority].append((self.loop.time(), item))
+        self._start()
+        self._check_water()
+
+    def _start(self):
+        while self.running < self.concurrency:
+            for queue in self._queues:
+                if queue:
+                    queued_at, item = queue.popleft()
+                    break
+            else:
+                return
+            wait = self.loop.time() - queued_at
+            self.total_wait += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+            self.running += 1
+            self.spawn(item).add_done_callback(self._done)
+
+    def _done(self, future):
+        self.running -= 1
+        self.processed += 1
+        self._start()
+        self._check_water()
+
+    def _check_water(self):
+        if self._pause is None:
+            return
+        queued = len(self._queues[PRIORITY_CONTROL])
+        if not self.paused and queued >= self.high_water:
+            self.paused = True
+            self.pauses += 1
+            self._pause()
+        elif self.paused and queued <= self.low_water:
+            self.paused = False
+            self._resume()
+
+    def depth(self):
+        """
+        :return: The number of events queued at each priority
+        :rtype: (int, int, int)
+        """
+        return tuple(len(queue) for queue in self._queues)
+
+    def oldest_wait(self):
+        """
+        :return: How long the longest waiting queued event has waited, in seconds
+        :rtype: float
+        """
+        now = self.loop.time()
+        waits = [now - queue[0][0] for queue in self._queues if queue]
+        return max(waits) if waits else 0.0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues)
+
+    def stats(self):
+        """
+        :rtype: dict[str, int | float | bool]
+        """
+        control, command, passive = self.depth()
+        started = self.processed + self.running
+        return {
+            "control": control,
+            "command": command,
+            "passive": passive,
+            "running": self.running,
+            "paused": self.paused,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "shed": self.shed,
+            "pauses": self.pauses,
+            "avg_wait": self.total_wait / started if started else 0.0,
+            "max_wait": self.max_wait,
+            "oldest_wait": self.oldest_wait()
+        }
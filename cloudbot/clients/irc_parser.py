@@ -0,0 +1,159 @@
+"""
+irc_parser.py
+
+Splits a raw IRC line into its IRCv3 tags, prefix (and the nick, user and host in it), command and params in one pass
+from left to right, using str.partition() rather than running a separate regex for each part.
+"""
+
+import re
+
+irc_bad_chars = ''.join([chr(x) for x in list(range(0, 1)) + list(range(4, 32)) + list(range(127, 160))])
+irc_clean_re = re.compile('[{}]'.format(re.escape(irc_bad_chars)))
+
+_tag_escapes = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def irc_clean(dirty):
+    """
+    Removes control characters, other than formatting codes, from some text
+    :type dirty: str
+    :rtype: str
+    """
+    return irc_clean_re.sub('', dirty)
+
+
+def unescape_tag_value(value):
+    """
+    Unescapes an IRCv3 tag value. Unknown escapes are replaced by the escaped character, and a trailing \\ is dropped.
+    :type value: str
+    :rtype: str
+    """
+    if "\\" not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            escaped = next(chars, "")
+            out.append(_tag_escapes.get(escaped, escaped))
+        else:
+            out.append(char)
+    return "".join(out)
+
+
+def parse_tags(tags):
+    """
+    Parses the tags of an IRCv3 message, without the leading '@'. Tags without a value are given an empty string.
+    :type tags: str
+    :rtype: dict[str, str]
+    """
+    parsed = {}
+    for tag in tags.split(";"):
+        if not tag:
+            continue
+        key, _, value = tag.partition("=")
+        parsed[key] = unescape_tag_value(value)
+    return parsed
+
+
+def parse_params(params):
+    """
+    Splits the params of an IRC line. The trailing param keeps its leading ':', so it can be told apart from a
+    middle param.
+    :type params: str
+    :rtype: list[str]
+    """
+    if not params:
+        return []
+    if params[0] == ":":
+        return [params]
+    middle, separator, trailing = params.partition(" :")
+    param_list = middle.split(" ")
+    if "" in param_list:
+        # extra spaces between params, or a line ending with a space
+        param_list = [param for param in param_list if param]
+    if separator:
+        param_list.append(":" + trailing)
+    return param_list
+
+
+class Message:
+    """
+    A parsed IRC line.
+
+    :type tags: dict[str, str] | None
+    :type prefix: str | None
+    :type nick: str | None
+    :type user: str | None
+    :type host: str | None
+    :type mask: str | None
+    :type command: str
+    :type params: list[str]
+    """
+    __slots__ = ("tags", "prefix", "nick", "user", "host", "mask", "command", "params")
+
+    def __init__(self, tags, prefix, nick, user, host, mask, command, params):
+        self.tags = tags
+        self.prefix = prefix
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.mask = mask
+        self.command = command
+        self.params = params
+
+    @property
+    def content_raw(self):
+        """
+        The trailing param without its leading ':', or None if there isn't one
+        :rtype: str | None
+        """
+        if self.params and self.params[-1].startswith(":"):
+            return self.params[-1][1:]
+        return None
+
+    def __repr__(self):
+        return "Message(tags={!r}, prefix={!r}, command={!r}, params={!r})".format(self.tags, self.prefix,
+                                                                                   self.command, self.params)
+
+
+def parse_line(line):
+    """
+    Parses an IRC line, without its line ending. Returns None if the line has no command.
+    :type line: str
+    :rtype: Message | None
+    """
+    if line[:1] == "@":
+        tags, separator, line = line.partition(" ")
+        if not separator:
+            return None
+        tags = parse_tags(tags[1:])
+        line = line.lstrip(" ")
+    else:
+        tags = None
+
+    if line[:1] == ":":
+        prefix, separator, line = line.partition(" ")
+        if not separator:
+            return None
+        mask = prefix[1:]
+        # nick!user@host, where the nick can't contain '@'
+        nick, bang, user_host = mask.partition("!")
+        user, at, host = user_host.partition("@")
+        if not at or "@" in nick:
+            # this isn't in the format of a netmask, probably a server name
+            nick = mask
+            user = None
+            host = None
+    else:
+        prefix = None
+        nick = None
+        user = None
+        host = None
+        mask = None
+
+    command, _, params = line.partition(" ")
+    if not command or command[0] == ":":
+        return None
+
+    return Message(tags, prefix, nick, user, host, mask, command, parse_params(params))
@@ -0,0 +1,241 @@
+"""
+irc_queue.py
+
+The outgoing line queue of an IRC connection.
+
+Lines are queued by priority: registration and PONG lines first, then replies, then bulk output. Replies to a target
+which already has several lines waiting are treated as bulk output, so one long command output can't hold up
+everything else. Lines other than urgent ones are paced by a token bucket, so the server doesn't disconnect us for
+flooding, and every line which can be sent at once is written to the transport in a single write.
+"""
+
+from collections import deque
+
+from cloudbot.util.tokenbucket import TokenBucket
+
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+# commands which are always sent first, and never held back by the pacer
+URGENT_COMMANDS = frozenset(["PASS", "NICK", "USER", "CAP", "AUTHENTICATE", "PING", "PONG", "QUIT"])
+# commands which have a target, and are counted towards it for bulk output and duplicate collapsing
+TARGETED_COMMANDS = frozenset(["PRIVMSG", "NOTICE"])
+
+# longest line we send in bytes, not counting the line ending
+MAX_LINE_LENGTH = 510
+
+
+def classify(line):
+    """
+    Finds the default priority and the target of a raw IRC line
+    :type line: str
+    :rtype: (int, str | None)
+    """
+    parts = line.split(" ", 2)
+    command = parts[0].upper()
+    if command in URGENT_COMMANDS:
+        return PRIORITY_URGENT, None
+    if command in TARGETED_COMMANDS and len(parts) > 1:
+        return PRIORITY_NORMAL, parts[1].lower()
+    return PRIORITY_NORMAL, None
+
+
+def _increment(counts, key):
+    counts[key] = counts.get(key, 0) + 1
+
+
+def _decrement(counts, key):
+    count = counts[key] - 1
+    if count:
+        counts[key] = count
+    else:
+        del counts[key]
+
+
+class SendQueue:
+    """
+    :type burst: int
+    :type rate: float
+    :type bulk_after: int
+    :type max_bulk: int
+    :type collapse_duplicates: bool
+    :type sent: int
+    :type writes: int
+    :type dropped: int
+    :type collapsed: int
+    """
+
+    def __init__(self, loop, *, burst=5, rate=1.0, bulk_after=3, max_bulk=200, collapse_duplicates=False):
+        """
+        :param loop: The event loop the queue is drained from
+        :param burst: How many lines can be sent at once after being idle
+        :param rate: How many lines can be sent per second after the burst. Pacing is disabled if this is 0.
+        :param bulk_after: How many replies to one target are queued as normal before the rest are treated as bulk
+        :param max_bulk: The most bulk lines which will be queued, further bulk lines are dropped
+        :param collapse_duplicates: Whether to drop a targeted line which is identical to the last line queued for its
+                                    target, eg. the same reply to several people in a row
+        :type loop: asyncio.events.AbstractEventLoop
+        :type burst: int
+        :type rate: float
+        :type bulk_after: int
+        :type max_bulk: int
+        :type collapse_duplicates: bool
+        """
+        self.loop = loop
+        self.burst = burst
+        self.rate = rate
+        self.bulk_after = bulk_after
+        self.max_bulk = max_bulk
+        self.collapse_duplicates = collapse_duplicates
+
+        self._bucket = TokenBucket(burst, rate) if rate > 0 else None
+        # one deque of (data, target) for each priority
+        self._queues = (deque(), deque(), deque())
+        # target -> the number of lines queued for it, and the number of those which are bulk
+        self._targets = {}
+        self._bulk_targets = {}
+        # target -> the last line queued for it
+        self._last = {}
+
+        self._write = None
+        self._handle = None
+
+        self.sent = 0
+        self.writes = 0
+        self.dropped = 0
+        self.collapsed = 0
+
+    def attach(self, write):
+        """
+        Starts sending queued lines with the given function, usually a transport's write()
+        :type write: (bytes) -> None
+        """
+        self._write = write
+        self._schedule()
+
+    def detach(self, write=None):
+        """
+        Stops sending, and drops everything still queued, as it was meant for the old connection
+        :param write: If given, only detach if this is the function currently attached, so a closing connection doesn't
+                      detach the one replacing it
+        :type write: (bytes) -> None
+        """
+        if write is not None and write != self._write:
+            return
+        self._write = None
+        self.dropped += len(self)
+        self.clear()
+
+    def clear(self):
+        for queue in self._queues:
+            queue.clear()
+        self._targets.clear()
+        self._bulk_targets.clear()
+        self._last.clear()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def put(self, line, priority=None):
+        """
+        Queues a raw IRC line, without its line ending. This is not thread safe, and should only be called from the
+        event loop.
+        :param priority: One of the PRIORITY_ constants, or None to pick one from the line's command
+        :type line: str
+        :type priority: int | None
+        """
+        default_priority, target = classify(line)
+        if priority is None:
+            priority = default_priority
+        data = line.encode("utf-8", "replace")
+        if len(data) > MAX_LINE_LENGTH:
+            # cut on a character boundary
+            data = data[:MAX_LINE_LENGTH].decode("utf-8", "ignore").encode("utf-8")
+        data += b"\r\n"
+
+        if target is not None:
+            if self.collapse_duplicates and self._last.get(target) == data:
+                self.collapsed += 1
+                return
+            # once a target has bulk lines queued, everything after them has to be bulk too, to keep them in order
+            if priority == PRIORITY_NORMAL and (self._targets.get(target, 0) >= self.bulk_after or
+                                                target in self._bulk_targets):
+                priority = PRIORITY_BULK
+
+        if priority == PRIORITY_BULK and len(self._queues[PRIORITY_BULK]) >= self.max_bulk:
+            self.dropped += 1
+            return
+
+        self._queues[priority].append((data, target))
+        if target is not None:
+            _increment(self._targets, target)
+            self._last[target] = data
+            if priority == PRIORITY_BULK:
+                _increment(self._bulk_targets, target)
+        self._schedule()
+
+    def _schedule(self, delay=0):
+        if self._handle is not None or self._write is None or not len(self):
+            return
+        if delay > 0:
+            self._handle = self.loop.call_later(delay, self._drain)
+        else:
+            # wait for the current loop iteration, so lines queued together are written together
+            self._handle = self.loop.call_soon(self._drain)
+
+    def _drain(self):
+        self._handle = None
+        if self._write is None:
+            return
+
+        out = []
+        delay = None
+        for priority, queue in enumerate(self._queues):
+            while queue:
+                if priority != PRIORITY_URGENT and self._bucket is not None and not self._bucket.consume(1):
+                    # wait until there's a whole token again
+                    delay = (1 - self._bucket.tokens) / self._bucket.fill_rate
+                    break
+                data, target = queue.popleft()
+                if target is not None:
+                    _decrement(self._targets, target)
+                    if target not in self._targets:
+                        del self._last[target]
+                    if priority == PRIORITY_BULK:
+                        _decrement(self._bulk_targets, target)
+                out.append(data)
+            if delay is not None:
+                break
+
+        if out:
+            self._write(b"".join(out))
+            self.sent += len(out)
+            self.writes += 1
+        if delay is not None:
+            self._schedule(max(delay, 0.01))
+
+    def depth(self):
+        """
+        :return: The number of lines queued at each priority
+        :rtype: (int, int, int)
+        """
+        return tuple(len(queue) for queue in self._queues)
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues)
+
+    def stats(self):
+        """
+        :rtype: dict[str, int]
+        """
+        urgent, normal, bulk = self.depth()
+        return {
+            "urgent": urgent,
+            "normal": normal,
+            "bulk": bulk,
+            "sent": self.sent,
+            "writes": self.writes,
+            "dropped": self.dropped,
+            "collapsed": self.collapsed
+        }
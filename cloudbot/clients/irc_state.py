@@ -0,0 +1,466 @@
+"""
+irc_state.py
+
+Tracks who is in each channel the bot is in, and the user@host of everyone it shares a channel with, from the
+NAMES, WHO, JOIN, PART, KICK, QUIT, NICK and MODE lines the server sends anyway.
+
+Big networks can put tens of thousands of users in the bot's channels, so the storage is kept small: users are slotted
+objects, nicks, idents, hosts and channel names are interned so repeated ones are only stored once, a user's channels
+are a tuple of channel keys, and a channel's members are a dict from user key to that user's status prefixes.
+"""
+
+import sys
+
+# ISUPPORT defaults, from RFC 1459 and what most servers send
+DEFAULT_PREFIX = "(ov)@+"
+DEFAULT_CHANMODES = "beI,k,l,imnpst"
+DEFAULT_CHANTYPES = "#&"
+DEFAULT_CASEMAPPING = "rfc1459"
+
+_casemaps = {
+    "ascii": str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz"),
+    "strict-rfc1459": str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\", "abcdefghijklmnopqrstuvwxyz{}|"),
+    "rfc1459": str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~", "abcdefghijklmnopqrstuvwxyz{}|^"),
+}
+
+_intern = sys.intern
+
+
+def parse_prefix_support(value):
+    """
+    Parses the PREFIX ISUPPORT token, eg. "(ov)@+"
+    :type value: str
+    :return: The status modes and their prefixes, both from highest to lowest
+    :rtype: (str, str)
+    """
+    if not value.startswith("(") or ")" not in value:
+        return "", ""
+    modes, _, prefixes = value[1:].partition(")")
+    if len(modes) != len(prefixes):
+        return "", ""
+    return modes, prefixes
+
+
+class User:
+    """
+    :type nick: str
+    :type user: str | None
+    :type host: str | None
+    :type channels: tuple[str]
+    """
+    __slots__ = ("nick", "user", "host", "channels")
+
+    def __init__(self, nick):
+        self.nick = nick
+        self.user = None
+        self.host = None
+        # keys of the channels this user shares with us
+        self.channels = ()
+
+    @property
+    def mask(self):
+        """
+        The nick!user@host of this user, or None if we haven't seen their user@host
+        :rtype: str | None
+        """
+        if self.host is None:
+            return None
+        return "{}!{}@{}".format(self.nick, self.user, self.host)
+
+    def __repr__(self):
+        return "User({!r}, user={!r}, host={!r}, channels={!r})".format(self.nick, self.user, self.host, self.channels)
+
+
+class Channel:
+    """
+    :type name: str
+    :type members: dict[str, str]
+    """
+    __slots__ = ("name", "members")
+
+    def __init__(self, name):
+        self.name = name
+        # user key -> their status prefixes in this channel, eg. "@+", or "" for none
+        self.members = {}
+
+    def __repr__(self):
+        return "Channel({!r}, {} members)".format(self.name, len(self.members))
+
+
+class IrcState:
+    """
+    The channels and users one connection can see.
+
+    :type channels: dict[str, Channel]
+    :type users: dict[str, User]
+    :type status_modes: str
+    :type status_prefixes: str
+    :type chantypes: str
+    """
+
+    def __init__(self):
+        self.channels = {}
+        self.users = {}
+        # channel key -> members not yet seen in the NAMES reply being received
+        self._names_pending = {}
+        self._reset_support()
+
+    def _reset_support(self):
+        self.status_modes, self.status_prefixes = parse_prefix_support(DEFAULT_PREFIX)
+        self.chantypes = DEFAULT_CHANTYPES
+        self._casemap = _casemaps[DEFAULT_CASEMAPPING]
+        self._set_chanmodes(DEFAULT_CHANMODES)
+
+    def _set_chanmodes(self, value):
+        # type A and B modes always take a param, type C only when set, type D never
+        types = value.split(",")
+        types += [""] * (4 - len(types))
+        self._param_modes = frozenset(types[0] + types[1])
+        self._set_param_modes = frozenset(types[2])
+
+    def clear(self):
+        """
+        Forgets everything, eg. after reconnecting
+        """
+        self.channels.clear()
+        self.users.clear()
+        self._names_pending.clear()
+        self._reset_support()
+
+    def casefold(self, name):
+        """
+        Folds the case of a nick or channel name using the server's case mapping, so it can be used as a key
+        :type name: str
+        :rtype: str
+        """
+        return name.translate(self._casemap)
+
+    def _key(self, name):
+        return _intern(name.translate(self._casemap))
+
+    # lookups for plugins
+
+    def get_user(self, nick):
+        """
+        :type nick: str
+        :rtype: User | None
+        """
+        return self.users.get(self.casefold(nick))
+
+    def get_channel(self, name):
+        """
+        :type name: str
+        :rtype: Channel | None
+        """
+        return self.channels.get(self.casefold(name))
+
+    def channel_nicks(self, name):
+        """
+        :return: The nicks of everyone in a channel, or an empty list if we're not in it
+        :type name: str
+        :rtype: list[str]
+        """
+        channel = self.get_channel(name)
+        if channel is None:
+            return []
+        users = self.users
+        return [users[key].nick for key in channel.members]
+
+    def user_channels(self, nick):
+        """
+        :return: The names of the channels we share with a user
+        :type nick: str
+        :rtype: list[str]
+        """
+        user = self.get_user(nick)
+        if user is None:
+            return []
+        return [self.channels[key].name for key in user.channels]
+
+    def status(self, nick, channel):
+        """
+        :return: The status prefixes of a user in a channel, eg. "@", "" if they have none, or None if they're not in it
+        :type nick: str
+        :type channel: str
+        :rtype: str | None
+        """
+        channel = self.get_channel(channel)
+        if channel is None:
+            return None
+        return channel.members.get(self.casefold(nick))
+
+    def is_on(self, nick, channel):
+        """
+        :type nick: str
+        :type channel: str
+        :rtype: bool
+        """
+        return self.status(nick, channel) is not None
+
+    def stats(self):
+        """
+        :rtype: dict[str, int]
+        """
+        return {
+            "channels": len(self.channels),
+            "users": len(self.users),
+            "memberships": sum(len(channel.members) for channel in self.channels.values())
+        }
+
+    # updating
+
+    def handle(self, message, own_nick):
+        """
+        Updates the state from a parsed line
+        :param own_nick: The bot's nick on this connection, before this line
+        :type message: cloudbot.clients.irc_parser.Message
+        :type own_nick: str
+        """
+        handler = self._handlers.get(message.command)
+        if handler is not None:
+            params = [param[1:] if param.startswith(":") else param for param in message.params]
+            handler(self, message, params, own_nick)
+
+    def _is_self(self, nick, own_nick):
+        return nick is not None and self.casefold(nick) == self.casefold(own_nick)
+
+    def _user(self, nick):
+        """
+        Gets a user, adding them if they're new
+        """
+        key = self._key(nick)
+        user = self.users.get(key)
+        if user is None:
+            user = self.users[key] = User(_intern(nick))
+        return key, user
+
+    def _learn_host(self, message, user):
+        if message.host is not None and user.host != message.host:
+            user.user = _intern(message.user)
+            user.host = _intern(message.host)
+
+    def _add_member(self, channel_key, channel, nick, status=""):
+        key, user = self._user(nick)
+        if key not in channel.members:
+            user.channels += (channel_key,)
+        channel.members[key] = _intern(status)
+        return user
+
+    def _remove_member(self, channel_key, channel, user_key):
+        if channel.members.pop(user_key, None) is None:
+            return
+        user = self.users[user_key]
+        user.channels = tuple(key for key in user.channels if key != channel_key)
+        if not user.channels:
+            del self.users[user_key]
+
+    def _drop_channel(self, channel_key):
+        channel = self.channels.pop(channel_key, None)
+        if channel is None:
+            return
+        self._names_pending.pop(channel_key, None)
+        for user_key in list(channel.members):
+            self._remove_member(channel_key, channel, user_key)
+
+    def _on_welcome(self, message, params, own_nick):
+        self.clear()
+
+    def _on_isupport(self, message, params, own_nick):
+        # the first param is our nick and the last is "are supported by this server"
+        for token in params[1:-1]:
+            name, _, value = token.partition("=")
+            if name == "PREFIX":
+                self.status_modes, self.status_prefixes = parse_prefix_support(value)
+            elif name == "CHANMODES":
+                self._set_chanmodes(value)
+            elif name == "CHANTYPES":
+                self.chantypes = value
+            elif name == "CASEMAPPING" and value in _casemaps:
+                self._casemap = _casemaps[value]
+
+    def _on_join(self, message, params, own_nick):
+        if message.nick is None or not params:
+            return
+        channel_key = self._key(params[0])
+        if self._is_self(message.nick, own_nick):
+            # start from nothing, NAMES will follow
+            self._drop_channel(channel_key)
+            self.channels[channel_key] = Channel(_intern(params[0]))
+        channel = self.channels.get(channel_key)
+        if channel is None:
+            return
+        user = self._add_member(channel_key, channel, message.nick)
+        self._learn_host(message, user)
+
+    def _on_part(self, message, params, own_nick):
+        if message.nick is None or not params:
+            return
+        for name in params[0].split(","):
+            self._leave(self._key(name), message.nick, own_nick)
+
+    def _on_kick(self, message, params, own_nick):
+        if len(params) < 2:
+            return
+        self._leave(self._key(params[0]), params[1], own_nick)
+
+    def _leave(self, channel_key, nick, own_nick):
+        if self._is_self(nick, own_nick):
+            self._drop_channel(channel_key)
+            return
+        channel = self.channels.get(channel_key)
+        if channel is not None:
+            self._remove_member(channel_key, channel, self.casefold(nick))
+
+    def _on_quit(self, message, params, own_nick):
+        if message.nick is None:
+            return
+        user_key = self.casefold(message.nick)
+        user = self.users.get(user_key)
+        if user is None:
+            return
+        for channel_key in user.channels:
+            del self.channels[channel_key].members[user_key]
+        del self.users[user_key]
+
+    def _on_nick(self, message, params, own_nick):
+        if message.nick is None or not params:
+            return
+        old_key = self.casefold(message.nick)
+        user = self.users.pop(old_key, None)
+        if user is None:
+            return
+        new_key = self._key(params[0])
+        user.nick = _intern(params[0])
+        self._learn_host(message, user)
+        if new_key == old_key:
+            self.users[new_key] = user
+            return
+        # if someone else was tracked under the new nick, they must have changed nick or left while we weren't looking
+        stale = self.users.get(new_key)
+        if stale is not None:
+            for channel_key in stale.channels:
+                self.channels[channel_key].members.pop(new_key, None)
+        self.users[new_key] = user
+        for channel_key in user.channels:
+            members = self.channels[channel_key].members
+            members[new_key] = members.pop(old_key)
+
+    def _on_mode(self, message, params, own_nick):
+        if len(params) < 2 or params[0][:1] not in self.chantypes:
+            return
+        channel = self.get_channel(params[0])
+        if channel is None:
+            return
+        args = iter(params[2:])
+        adding = True
+        for mode in params[1]:
+            if mode == "+":
+                adding = True
+            elif mode == "-":
+                adding = False
+            elif mode in self.status_modes:
+                nick = next(args, None)
+                if nick is None:
+                    return
+                key = self.casefold(nick)
+                status = channel.members.get(key)
+                if status is not None:
+                    channel.members[key] = self._change_status(status, self.status_modes.index(mode), adding)
+            elif mode in self._param_modes or (adding and mode in self._set_param_modes):
+                next(args, None)
+
+    def _change_status(self, status, index, adding):
+        """
+        Adds or removes a prefix from a member's status, keeping the prefixes in order from highest to lowest
+        """
+        prefix = self.status_prefixes[index]
+        if adding:
+            if prefix in status:
+                return status
+            status += prefix
+        else:
+            status = status.replace(prefix, "")
+        return _intern("".join(p for p in self.status_prefixes if p in status))
+
+    def _split_status(self, name):
+        """
+        Splits the status prefixes off a nick in a NAMES reply, which may have several with multi-prefix
+        """
+        i = 0
+        while i < len(name) and name[i] in self.status_prefixes:
+            i += 1
+        return name[:i], name[i:]
+
+    def _on_names(self, message, params, own_nick):
+        # <our nick> <type> <channel> :<names>
+        if len(params) < 4:
+            return
+        channel_key = self._key(params[2])
+        channel = self.channels.get(channel_key)
+        if channel is None:
+            return
+        stale = self._names_pending.get(channel_key)
+        if stale is None:
+            # a new NAMES reply replaces what we knew, once it's complete
+            stale = self._names_pending[channel_key] = set(channel.members)
+        for name in params[3].split():
+            status, mask = self._split_status(name)
+            # with userhost-in-names, names are full masks
+            nick, _, user_host = mask.partition("!")
+            if not nick:
+                continue
+            user = self._add_member(channel_key, channel, nick, status)
+            stale.discard(self.casefold(nick))
+            user_name, at, host = user_host.partition("@")
+            if at:
+                user.user = _intern(user_name)
+                user.host = _intern(host)
+
+    def _on_end_of_names(self, message, params, own_nick):
+        if len(params) < 2:
+            return
+        channel_key = self.casefold(params[1])
+        stale = self._names_pending.pop(channel_key, None)
+        channel = self.channels.get(channel_key)
+        if stale and channel is not None:
+            for user_key in stale:
+                self._remove_member(channel_key, channel, user_key)
+
+    def _on_who(self, message, params, own_nick):
+        # <our nick> <channel> <user> <host> <server> <nick> <flags> :<hops> <realname>
+        if len(params) < 7:
+            return
+        user = self.get_user(params[5])
+        if user is None:
+            return
+        user.user = _intern(params[2])
+        user.host = _intern(params[3])
+        channel_key = self.casefold(params[1])
+        channel = self.channels.get(channel_key)
+        if channel is not None and channel_key in user.channels:
+            status = "".join(p for p in self.status_prefixes if p in params[6])
+            channel.members[self.casefold(params[5])] = _intern(status)
+
+    def _on_message(self, message, params, own_nick):
+        # fill in the user@host of anyone we only know from NAMES
+        if message.host is None:
+            return
+        user = self.users.get(self.casefold(message.nick))
+        if user is not None and user.host is None:
+            self._learn_host(message, user)
+
+    _handlers = {
+        "001": _on_welcome,
+        "005": _on_isupport,
+        "JOIN": _on_join,
+        "PART": _on_part,
+        "KICK": _on_kick,
+        "QUIT": _on_quit,
+        "NICK": _on_nick,
+        "MODE": _on_mode,
+        "353": _on_names,
+        "366": _on_end_of_names,
+        "352": _on_who,
+        "PRIVMSG": _on_message,
+        "NOTICE": _on_message,
+    }
@@ -0,0 +1,74 @@
+from cloudbot.clients.irc_batch import Batch, BatchCollector
+from cloudbot.clients.irc_parser import parse_line
+
+
+def feed(collector, line):
+    return collector.feed(line, parse_line(line))
+
+
+def test_unbatched_lines_pass_through():
+    collector = BatchCollector()
+    line = ":nick!u@h PRIVMSG #chan :hi"
+    assert feed(collector, line).command == "PRIVMSG"
+    assert feed(collector, "@time=2015-01-01T00:00:00.000Z " + line).command == "PRIVMSG"
+
+
+def test_netsplit():
+    collector = BatchCollector()
+    assert feed(collector, ":irc.host BATCH +yXNAbvnRHTRBv netsplit irc.hub other.host") is None
+    quits = ["@batch=yXNAbvnRHTRBv :user{}!u@h QUIT :irc.hub other.host".format(i) for i in range(1000)]
+    for line in quits:
+        assert feed(collector, line) is None
+    # lines from other batches or no batch aren't held
+    assert feed(collector, ":nick!u@h PRIVMSG #chan :hi").command == "PRIVMSG"
+    assert feed(collector, "@batch=unknown :nick!u@h QUIT :bye").command == "QUIT"
+
+    batch = feed(collector, ":irc.host BATCH -yXNAbvnRHTRBv")
+    assert isinstance(batch, Batch)
+    assert batch.type == "netsplit"
+    assert batch.params == ["irc.hub", "other.host"]
+    assert len(batch) == 1000
+    assert batch.lines == quits
+    assert all(message.command == "QUIT" for message in batch.messages)
+    assert collector.open == {}
+
+
+def test_nested_batches():
+    collector = BatchCollector()
+    feed(collector, ":irc.host BATCH +outer example")
+    feed(collector, "@batch=outer :irc.host BATCH +inner netjoin a b")
+    feed(collector, "@batch=inner :x!u@h JOIN #chan")
+    feed(collector, "@batch=outer :y!u@h JOIN #chan")
+    # the inner batch ending doesn't hand anything over yet
+    assert feed(collector, "@batch=outer :irc.host BATCH -inner") is None
+    batch = feed(collector, ":irc.host BATCH -outer")
+    assert batch.reference == "outer"
+    assert [message.nick for message in batch.messages] == ["x", "y"]
+
+
+def test_unknown_end():
+    collector = BatchCollector()
+    assert feed(collector, ":irc.host BATCH -nothing").command == "BATCH"
+
+
+def test_clear():
+    collector = BatchCollector()
+    feed(collector, ":irc.host BATCH +ref netsplit a b")
+    collector.clear()
+    assert feed(collector, "@batch=ref :x!u@h QUIT :a b").command == "QUIT"
+
+
+def test_inner_lines():
+    collector = BatchCollector()
+    feed(collector, ":irc.host BATCH +ref netsplit irc.hub other.host")
+    quit_line = "@batch=ref :user!u@h QUIT :irc.hub other.host"
+    feed(collector, quit_line)
+    batch = feed(collector, ":irc.host BATCH -ref")
+
+    # the QUIT is still handed over on its own, for hooks which don't know about batches
+    [(line, message)] = batch.inner_lines()
+    assert line == quit_line
+    assert message.command == "QUIT"
+    assert message.nick == "user"
+    assert batch.inner_lines({"netjoin"}) == [(quit_line, message)]
+    assert batch.inner_lines({"netsplit"}) == []
@@ -0,0 +1,96 @@
+from cloudbot.clients.irc_caps import CapNegotiator, parse_caps, req_lines, MAX_REQ_LENGTH
+
+WANTED = {"multi-prefix", "batch", "server-time", "sasl"}
+
+
+def test_parse_caps():
+    assert parse_caps("multi-prefix sasl=PLAIN,EXTERNAL draft/x=") == {
+        "multi-prefix": None, "sasl": "PLAIN,EXTERNAL", "draft/x": ""}
+    assert parse_caps("") == {}
+
+
+def test_req_lines_split():
+    caps = ["cap{:03}".format(i) for i in range(100)]
+    lines = req_lines(caps)
+    assert len(lines) > 1
+    assert all(line.startswith("CAP REQ :") for line in lines)
+    assert all(len(line) - len("CAP REQ :") <= MAX_REQ_LENGTH for line in lines)
+    assert " ".join(line[len("CAP REQ :"):] for line in lines).split() == caps
+    assert req_lines([]) == []
+
+
+def test_negotiation():
+    caps = CapNegotiator()
+    assert caps.start() == ["CAP LS 302"]
+    assert caps.negotiating
+
+    # multi-line LS only requests once the list is complete
+    assert caps.handle(["*", "LS", "*", "multi-prefix sasl=PLAIN"], WANTED) == ([], [])
+    send, changes = caps.handle(["*", "LS", "batch away-notify"], WANTED)
+    assert send == ["CAP REQ :multi-prefix sasl batch"]
+    assert changes == []
+    assert caps.negotiating
+
+    send, changes = caps.handle(["CloudBot", "ACK", "multi-prefix sasl"], WANTED)
+    assert send == []
+    assert changes == [("multi-prefix", None, True), ("sasl", "PLAIN", True)]
+
+    # registration continues once every request is answered
+    send, changes = caps.handle(["CloudBot", "NAK", "batch"], WANTED)
+    assert send == ["CAP END"]
+    assert not caps.negotiating
+    assert caps.enabled == {"multi-prefix": None, "sasl": "PLAIN"}
+
+
+def test_nothing_wanted_ends():
+    caps = CapNegotiator()
+    caps.start()
+    assert caps.handle(["*", "LS", "away-notify"], WANTED) == (["CAP END"], [])
+
+
+def test_new_and_del():
+    caps = CapNegotiator()
+    caps.start()
+    caps.handle(["*", "LS", "batch"], WANTED)
+    caps.handle(["CloudBot", "ACK", "batch"], WANTED)
+
+    # cap-notify, after registration, doesn't send CAP END again
+    send, changes = caps.handle(["CloudBot", "NEW", "server-time"], WANTED)
+    assert send == ["CAP REQ :server-time"]
+    send, changes = caps.handle(["CloudBot", "ACK", "server-time"], WANTED)
+    assert send == []
+    assert changes == [("server-time", None, True)]
+
+    send, changes = caps.handle(["CloudBot", "DEL", "batch"], WANTED)
+    assert changes == [("batch", None, False)]
+    assert "batch" not in caps.available
+    assert set(caps.enabled) == {"server-time"}
+
+
+def test_request_later():
+    caps = CapNegotiator()
+    caps.start()
+    caps.handle(["*", "LS", "batch account-tag"], WANTED)
+    caps.handle(["CloudBot", "ACK", "batch"], WANTED)
+    # a plugin wanting account-tag is loaded
+    assert caps.request(WANTED | {"account-tag"}) == ["CAP REQ :account-tag"]
+    # already requested
+    assert caps.request(WANTED | {"account-tag"}) == []
+
+
+def test_ack_disable():
+    caps = CapNegotiator()
+    caps.start()
+    caps.handle(["*", "LS", "batch"], WANTED)
+    caps.handle(["CloudBot", "ACK", "batch"], WANTED)
+    send, changes = caps.handle(["CloudBot", "ACK", "-batch"], WANTED)
+    assert changes == [("batch", None, False)]
+    assert caps.enabled == {}
+
+
+def test_registered_without_cap_support():
+    caps = CapNegotiator()
+    caps.start()
+    caps.registered()
+    assert not caps.negotiating
+    assert caps.handle(["CloudBot", "LIST", "batch"], WANTED) == ([], [])
@@ -0,0 +1,72 @@
+from cloudbot.clients.irc_decoder import Decoder, line_sender, line_channel, decodes_anything
+
+
+def line_keys(data):
+    return line_sender(data), line_channel(data)
+
+
+def test_line_keys():
+    assert line_keys(b":nick!user@host PRIVMSG #Chan :hi") == (b":nick!user@host", b"#chan")
+    assert line_keys(b"@time=x :nick!user@host PRIVMSG #chan :hi") == (b":nick!user@host", b"#chan")
+    assert line_keys(b":nick!user@host PRIVMSG bot :hi") == (b":nick!user@host", None)
+    assert line_keys(b":nick!user@host JOIN #chan") == (b":nick!user@host", b"#chan")
+    assert line_keys(b"PING :server") == (None, None)
+    assert line_keys(b"ERROR") == (None, None)
+    assert line_keys(b"@tags-only") == (None, None)
+
+
+def test_decodes_anything():
+    assert decodes_anything("iso-8859-1")
+    assert not decodes_anything("utf-8")
+    assert not decodes_anything("shift_jis")
+
+
+def test_unreachable():
+    decoder = Decoder(["utf-8", "latin-1", "shift_jis", "cp1252"])
+    assert decoder.codecs == ("utf-8", "iso8859-1")
+    assert decoder.unreachable == ("shift_jis", "cp1252")
+
+
+def test_decode():
+    decoder = Decoder(["utf-8", "shift_jis", "iso-8859-1"])
+    assert decoder.decode(b":a!b@c PRIVMSG #chan :plain") == ":a!b@c PRIVMSG #chan :plain"
+    assert decoder.decode(":a!b@c PRIVMSG #chan :héllo".encode("utf-8")) == ":a!b@c PRIVMSG #chan :héllo"
+
+    line = ":jp!b@c PRIVMSG #nihongo :こんにちは".encode("shift_jis")
+    assert decoder.decode(line) == ":jp!b@c PRIVMSG #nihongo :こんにちは"
+    assert decoder.failures == 1
+    # the next line from the same sender, or the same channel, goes straight to shift_jis
+    assert decoder.decode(line) == ":jp!b@c PRIVMSG #nihongo :こんにちは"
+    assert decoder.decode(":other!b@c PRIVMSG #nihongo :さようなら".encode("shift_jis")).endswith("さようなら")
+    assert decoder.failures == 1
+    assert decoder.cache_hits == 2
+
+    stats = decoder.stats()
+    assert stats["lines"] == 5
+    assert stats["ascii"] == 1
+    assert stats["decoded"] == {"utf-8": 1, "shift_jis": 3, "iso8859-1": 0}
+
+
+def test_cached_latin1_sender_sends_utf8():
+    decoder = Decoder()
+    assert decoder.decode(":a!b@c PRIVMSG #chan :caf\xe9".encode("iso-8859-1")).endswith("café")
+    # iso-8859-1 would decode this too, but it looks like utf-8
+    assert decoder.decode(":a!b@c PRIVMSG #chan :café".encode("utf-8")).endswith("café")
+    assert decoder.cache_hits == 0
+    # a utf-8 line makes the sender and channel forget iso-8859-1 again
+    assert decoder.decode(":a!b@c PRIVMSG #chan :caf\xe9".encode("iso-8859-1")).endswith("café")
+    assert decoder.cache_hits == 0
+    assert decoder.failures == 2
+
+
+def test_fallback():
+    decoder = Decoder(["utf-8"])
+    assert decoder.decode(b":a!b@c PRIVMSG #chan :\xff\xfebad") == ":a!b@c PRIVMSG #chan :bad"
+    assert decoder.fallbacks == 1
+
+
+def test_cache_size():
+    decoder = Decoder(cache_size=2)
+    for nick in (b"a", b"b", b"c"):
+        decoder.decode(b":" + nick + b"!u@h PRIVMSG bot :\xe9")
+    assert decoder.stats()["senders"] == 2
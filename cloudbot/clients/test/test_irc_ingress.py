@@ -0,0 +1,203 @@
+from cloudbot.clients.irc_ingress import IngressQueue, PRIORITY_CONTROL, PRIORITY_COMMAND, PRIORITY_PASSIVE
+
+
+class MockLoop:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class MockFuture:
+    def __init__(self, item):
+        self.item = item
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def finish(self):
+        for callback in self.callbacks:
+            callback(self)
+
+
+class Transport:
+    def __init__(self):
+        self.reading = True
+
+    def pause_reading(self):
+        assert self.reading
+        self.reading = False
+
+    def resume_reading(self):
+        assert not self.reading
+        self.reading = True
+
+
+def make_queue(**kwargs):
+    loop = MockLoop()
+    started = []
+
+    def spawn(item):
+        future = MockFuture(item)
+        started.append(future)
+        return future
+
+    queue = IngressQueue(loop, spawn, **kwargs)
+    transport = Transport()
+    queue.attach(transport.pause_reading, transport.resume_reading)
+    return loop, queue, started, transport
+
+
+def test_concurrency_limit():
+    loop, queue, started, transport = make_queue(concurrency=2)
+    for i in range(5):
+        queue.put(i)
+    assert [future.item for future in started] == [0, 1]
+    assert queue.running == 2
+    assert len(queue) == 3
+
+    started[0].finish()
+    assert [future.item for future in started] == [0, 1, 2]
+    assert queue.running == 2
+    assert queue.processed == 1
+
+
+def test_priority_order():
+    loop, queue, started, transport = make_queue(concurrency=1)
+    queue.put("running")
+    queue.put("passive", PRIORITY_PASSIVE)
+    queue.put("command", PRIORITY_COMMAND)
+    queue.put("control", PRIORITY_CONTROL)
+    queue.put("command 2", PRIORITY_COMMAND)
+    assert queue.depth() == (1, 2, 1)
+
+    order = []
+    while started:
+        future = started.pop(0)
+        order.append(future.item)
+        future.finish()
+    assert order == ["running", "control", "command", "command 2", "passive"]
+    assert len(queue) == 0
+    assert queue.running == 0
+
+
+def test_passive_shedding():
+    loop, queue, started, transport = make_queue(concurrency=1, max_passive=3)
+    queue.put("running", PRIORITY_CONTROL)
+    for i in range(5):
+        queue.put(i, PRIORITY_PASSIVE)
+    queue.put("command", PRIORITY_COMMAND)
+    # the oldest passive events make room, other priorities are never shed
+    assert queue.shed == 2
+    assert [item for _, item in queue._queues[PRIORITY_PASSIVE]] == [2, 3, 4]
+    assert queue.depth() == (0, 1, 3)
+
+
+def test_no_passive():
+    loop, queue, started, transport = make_queue(concurrency=1, max_passive=0)
+    queue.put("running", PRIORITY_CONTROL)
+    queue.put("passive", PRIORITY_PASSIVE)
+    assert queue.shed == 1
+    assert len(queue) == 0
+
+
+def test_backpressure():
+    loop, queue, started, transport = make_queue(concurrency=1, high_water=4, low_water=1)
+    queue.put("running", PRIORITY_CONTROL)
+    for i in range(3):
+        queue.put(i, PRIORITY_CONTROL)
+    assert transport.reading
+    queue.put(3, PRIORITY_CONTROL)
+    assert not transport.reading
+    assert queue.paused
+    assert queue.pauses == 1
+
+    # keep reading paused until the queue is down to the low water mark
+    started[0].finish()
+    started[1].finish()
+    assert not transport.reading
+    started[2].finish()
+    assert len(queue) == 1
+    assert transport.reading
+    assert not queue.paused
+
+
+def test_backlog_keeps_reading():
+    loop, queue, started, transport = make_queue(concurrency=1, high_water=4, max_passive=None)
+    queue.put("running", PRIORITY_CONTROL)
+    for i in range(10):
+        queue.put(i, PRIORITY_COMMAND)
+        queue.put(i, PRIORITY_PASSIVE)
+    # only queued control events stop reading, so PINGs are still seen
+    assert transport.reading
+    assert queue.pauses == 0
+
+
+def test_slow_hooks():
+    loop = MockLoop()
+    hooks = []
+    launching = []
+
+    def spawn(item):
+        # the event's hooks keep running, but its slot is released once they've been started
+        hooks.append(MockFuture(item))
+        launched = MockFuture(item)
+        launching.append(launched)
+        return launched
+
+    queue = IngressQueue(loop, spawn, concurrency=2, high_water=4)
+    transport = Transport()
+    queue.attach(transport.pause_reading, transport.resume_reading)
+
+    for i in range(20):
+        queue.put("slow {}".format(i), PRIORITY_PASSIVE)
+        queue.put("control {}".format(i), PRIORITY_CONTROL)
+        while launching:
+            launching.pop(0).finish()
+
+    # none of the hooks have finished, but every line was started
+    assert [future.item for future in hooks[-2:]] == ["slow 19", "control 19"]
+    assert len(hooks) == 40
+    assert len(queue) == 0
+    assert queue.running == 0
+    assert queue.processed == 40
+    assert transport.reading
+
+
+def test_detach():
+    loop, queue, started, transport = make_queue(concurrency=1, high_water=2)
+    queue.put("running", PRIORITY_CONTROL)
+    queue.put(1, PRIORITY_CONTROL)
+    queue.put(2, PRIORITY_CONTROL)
+    assert not transport.reading
+
+    # a new connection replaced this one before it detached
+    new_transport = Transport()
+    queue.attach(new_transport.pause_reading, new_transport.resume_reading)
+    assert not new_transport.reading
+    queue.detach(transport.pause_reading)
+    assert queue.paused
+
+    queue.detach(new_transport.pause_reading)
+    assert not queue.paused
+    # queued events are still processed
+    started[0].finish()
+    assert started[1].item == 1
+
+
+def test_wait_stats():
+    loop, queue, started, transport = make_queue(concurrency=1)
+    queue.put("first")
+    queue.put("second")
+    loop.now = 2.0
+    assert queue.oldest_wait() == 2.0
+    started[0].finish()
+    stats = queue.stats()
+    assert stats["max_wait"] == 2.0
+    assert stats["avg_wait"] == 1.0
+    assert stats["oldest_wait"] == 0.0
+    assert stats["enqueued"] == 2
+    assert stats["processed"] == 1
+    assert stats["running"] == 1
@@ -0,0 +1,116 @@
+import re
+
+from cloudbot.clients.irc_parser import parse_line, parse_tags, irc_clean
+
+# the regex parsing _IrcProtocol used before irc_parser, kept to check the parser gives the same results
+irc_prefix_re = re.compile(r":([^ ]*) ([^ ]*) (.*)")
+irc_noprefix_re = re.compile(r"([^ ]*) (.*)")
+irc_netmask_re = re.compile(r"([^!@]*)!([^@]*)@(.*)")
+irc_param_re = re.compile(r"(?:^|(?<= ))(:.*|[^ ]+)")
+
+irc_bad_chars = ''.join([chr(x) for x in list(range(0, 1)) + list(range(4, 32)) + list(range(127, 160))])
+irc_clean_re = re.compile('[{}]'.format(re.escape(irc_bad_chars)))
+
+
+def regex_parse(line):
+    if line.startswith(":"):
+        prefix_line_match = irc_prefix_re.match(line)
+        if prefix_line_match is None:
+            return None
+        netmask_prefix, command, params = prefix_line_match.groups()
+        prefix = ":" + netmask_prefix
+        netmask_match = irc_netmask_re.match(netmask_prefix)
+        if netmask_match is None:
+            nick, user, host = netmask_prefix, None, None
+        else:
+            nick, user, host = netmask_match.groups()
+        mask = netmask_prefix
+    else:
+        noprefix_line_match = irc_noprefix_re.match(line)
+        if noprefix_line_match is None:
+            return None
+        prefix = nick = user = host = mask = None
+        command, params = noprefix_line_match.groups()
+    return prefix, nick, user, host, mask, command, irc_param_re.findall(params)
+
+
+parity_lines = [
+    ":nick!user@host PRIVMSG #chan :hello world",
+    ":nick!user@host PRIVMSG #chan :",
+    ":nick!user@host PRIVMSG #chan ::starts with a colon",
+    ":nick!user@host PRIVMSG bot :\x01ACTION waves\x01",
+    ":nick!~user@some.host.example JOIN #chan",
+    ":nick!~user@some.host.example JOIN :#chan",
+    ":nick!user@host PART #chan :leaving now",
+    ":op!user@host KICK #chan victim :bye bye",
+    ":nick!user@host NICK :newnick",
+    ":nick!user@host MODE #chan +ov nick other",
+    ":nick!user@host INVITE bot :#chan",
+    ":nick!user@host QUIT :Quit: a:b c",
+    ":irc.example.net 001 bot :Welcome to the network bot",
+    ":irc.example.net 353 bot = #chan :@op +voice normal",
+    ":irc.example.net 005 bot CHANTYPES=# PREFIX=(ov)@+ :are supported by this server",
+    ":irc.example.net 324 bot #chan +ntr",
+    ":irc.example.net NOTICE * :*** Looking up your hostname",
+    ":server PONG server :token",
+    ":nick!user@host PRIVMSG #chan :trailing  with   spaces ",
+    ":nick!user@host PRIVMSG #chan  :double space before trailing",
+    ":nick!user@host MODE  #chan  +b  ",
+    ":nick!user@host PRIVMSG #chan a:b :c",
+    ":weird@host!user PRIVMSG #chan :@ before !",
+    ":nick!user@host@more PRIVMSG #chan :two @",
+    ":nick!us!er@host PRIVMSG #chan :two !",
+    ":nick PRIVMSG #chan :no user or host",
+    "PING :irc.example.net",
+    "PING irc.example.net",
+    "ERROR :Closing Link: bot (Quit)",
+    "NOTICE AUTH :*** Checking Ident",
+    "AUTHENTICATE +",
+]
+
+
+def test_parity():
+    for line in parity_lines:
+        message = parse_line(line)
+        expected = regex_parse(line)
+        assert expected is not None, line
+        assert (message.prefix, message.nick, message.user, message.host, message.mask, message.command,
+                message.params) == expected, line
+        assert message.tags is None
+
+
+def test_clean_parity():
+    text = "".join(chr(i) for i in range(0, 256)) + "normal \x02bold\x02 \x0304red\x03 ünïcödé"
+    assert irc_clean(text) == irc_clean_re.sub('', text)
+
+
+def test_tags():
+    message = parse_line("@time=2015-03-07T12:00:00.000Z;account=nick;draft/label :nick!user@host PRIVMSG #chan :hi")
+    assert message.tags == {"time": "2015-03-07T12:00:00.000Z", "account": "nick", "draft/label": ""}
+    assert message.nick == "nick"
+    assert message.command == "PRIVMSG"
+    assert message.params == ["#chan", ":hi"]
+    assert message.content_raw == "hi"
+
+    message = parse_line("@batch=abc PING :server")
+    assert message.tags == {"batch": "abc"}
+    assert message.prefix is None
+    assert message.params == [":server"]
+
+
+def test_tag_escapes():
+    assert parse_tags(r"a=one\:two\sthree\\four\r\n;b=\x;c=end\;d=;;e") == {
+        "a": "one;two three\\four\r\n", "b": "x", "c": "end", "d": "", "e": ""}
+
+
+def test_no_params():
+    message = parse_line(":irc.example.net RPL_LONE")
+    assert message.command == "RPL_LONE"
+    assert message.params == []
+    assert message.content_raw is None
+
+
+def test_invalid():
+    assert parse_line("") is None
+    assert parse_line(":prefix-only") is None
+    assert parse_line("@tags-only") is None
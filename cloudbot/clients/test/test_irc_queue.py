@@ -0,0 +1,144 @@
+from cloudbot.clients.irc_queue import SendQueue, PRIORITY_BULK, classify, PRIORITY_URGENT, PRIORITY_NORMAL
+
+
+class MockHandle:
+    def __init__(self, loop, callback, delay):
+        self.loop = loop
+        self.callback = callback
+        self.delay = delay
+
+    def cancel(self):
+        self.loop.handles.remove(self)
+
+
+class MockLoop:
+    def __init__(self):
+        self.handles = []
+
+    def call_soon(self, callback):
+        return self.call_later(0, callback)
+
+    def call_later(self, delay, callback):
+        handle = MockHandle(self, callback, delay)
+        self.handles.append(handle)
+        return handle
+
+    def run_ready(self):
+        for handle in [handle for handle in self.handles if handle.delay == 0]:
+            self.handles.remove(handle)
+            handle.callback()
+
+
+def make_queue(**kwargs):
+    loop = MockLoop()
+    queue = SendQueue(loop, **kwargs)
+    writes = []
+    queue.attach(writes.append)
+    return loop, queue, writes
+
+
+def test_classify():
+    assert classify("PONG :server") == (PRIORITY_URGENT, None)
+    assert classify("PRIVMSG #Chan :hi") == (PRIORITY_NORMAL, "#chan")
+    assert classify("JOIN #chan") == (PRIORITY_NORMAL, None)
+
+
+def test_coalesce():
+    loop, queue, writes = make_queue(rate=0)
+    queue.put("PRIVMSG #a :one")
+    queue.put("PRIVMSG #b :two")
+    queue.put("JOIN #c")
+    assert writes == []
+    loop.run_ready()
+    assert writes == [b"PRIVMSG #a :one\r\nPRIVMSG #b :two\r\nJOIN #c\r\n"]
+    assert queue.stats()["sent"] == 3
+    assert queue.stats()["writes"] == 1
+
+
+def test_priority_and_pacing():
+    loop, queue, writes = make_queue(burst=2, rate=0.01, bulk_after=2)
+    for i in range(5):
+        queue.put("PRIVMSG #chan :line {}".format(i))
+    queue.put("PRIVMSG #other :reply")
+    queue.put("PONG :server")
+    assert queue.depth() == (1, 3, 3)
+
+    loop.run_ready()
+    # the PONG goes first, then the burst, while the bulk output for #chan waits behind the reply to #other
+    assert writes == [b"PONG :server\r\nPRIVMSG #chan :line 0\r\nPRIVMSG #chan :line 1\r\n"]
+    assert queue.depth() == (0, 1, 3)
+    assert [handle.delay > 0 for handle in loop.handles] == [True]
+
+
+def test_bulk_keeps_order():
+    loop, queue, writes = make_queue(rate=0, bulk_after=1)
+    queue.put("PRIVMSG #chan :one")
+    queue.put("PRIVMSG #chan :two", PRIORITY_BULK)
+    queue.put("PRIVMSG #chan :three")
+    assert queue.depth() == (0, 1, 2)
+    loop.run_ready()
+    assert writes == [b"PRIVMSG #chan :one\r\nPRIVMSG #chan :two\r\nPRIVMSG #chan :three\r\n"]
+
+
+def test_collapse_and_drop():
+    loop, queue, writes = make_queue(rate=0, bulk_after=1, max_bulk=1, collapse_duplicates=True)
+    queue.put("PRIVMSG #chan :same")
+    queue.put("PRIVMSG #chan :same")
+    queue.put("PRIVMSG #chan :bulk")
+    queue.put("PRIVMSG #chan :too much")
+    assert queue.stats()["collapsed"] == 1
+    assert queue.stats()["dropped"] == 1
+    loop.run_ready()
+    assert writes == [b"PRIVMSG #chan :same\r\nPRIVMSG #chan :bulk\r\n"]
+
+    # once it's been sent, the same line can be queued again
+    queue.put("PRIVMSG #chan :same")
+    assert len(queue) == 1
+
+
+def test_keep_duplicates():
+    loop, queue, writes = make_queue(rate=0, collapse_duplicates=True)
+    lines = ["PRIVMSG #chan :----", "PRIVMSG #chan :row", "PRIVMSG #chan :----", "PRIVMSG #other :row"]
+    for line in lines:
+        queue.put(line)
+    # only a repeat of the last line queued for the same target is collapsed
+    assert queue.stats()["collapsed"] == 0
+    queue.put("PRIVMSG #other :row")
+    assert queue.stats()["collapsed"] == 1
+    loop.run_ready()
+    assert writes == ["".join(line + "\r\n" for line in lines).encode()]
+
+    # nothing is collapsed by default
+    loop, queue, writes = make_queue(rate=0)
+    queue.put("PRIVMSG #chan :same")
+    queue.put("PRIVMSG #chan :same")
+    assert len(queue) == 2
+
+
+def test_detach():
+    loop, queue, writes = make_queue(rate=0)
+    queue.put("PRIVMSG #chan :lost")
+    queue.detach(lambda data: None)
+    assert len(queue) == 1
+    queue.detach(writes.append)
+    assert len(queue) == 0
+    assert loop.handles == []
+    assert queue.stats()["dropped"] == 1
+
+    queue.put("PRIVMSG #chan :waits")
+    assert loop.handles == []
+    queue.attach(writes.append)
+    loop.run_ready()
+    assert writes == [b"PRIVMSG #chan :waits\r\n"]
+
+
+def test_long_line():
+    loop, queue, writes = make_queue(rate=0)
+    queue.put("PRIVMSG #chan :" + "x" * 600)
+    # cut to 510 bytes, without splitting a character
+    queue.put("PRIVMSG #chan :" + "é" * 300)
+    loop.run_ready()
+    first, second = writes[0].split(b"\r\n")[:2]
+    assert len(first) == 510
+    assert len(second) == 509
+    second.decode("utf-8")
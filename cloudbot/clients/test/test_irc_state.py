@@ -0,0 +1,186 @@
+from cloudbot.clients.irc_parser import parse_line
+from cloudbot.clients.irc_state import IrcState, parse_prefix_support
+
+ME = "CloudBot"
+
+
+def feed(state, *lines, own_nick=ME):
+    for line in lines:
+        state.handle(parse_line(line), own_nick)
+
+
+def joined_state():
+    state = IrcState()
+    feed(state,
+         ":CloudBot!bot@bot.host JOIN #Chan",
+         ":server 353 CloudBot = #Chan :CloudBot @op +voice @+both plain",
+         ":server 366 CloudBot #Chan :End of /NAMES list.")
+    return state
+
+
+def test_parse_prefix_support():
+    assert parse_prefix_support("(qaohv)~&@%+") == ("qaohv", "~&@%+")
+    assert parse_prefix_support("") == ("", "")
+    assert parse_prefix_support("(ov)@") == ("", "")
+
+
+def test_names():
+    state = joined_state()
+    assert sorted(state.channel_nicks("#chan")) == ["CloudBot", "both", "op", "plain", "voice"]
+    assert state.status("op", "#CHAN") == "@"
+    assert state.status("both", "#chan") == "@+"
+    assert state.status("plain", "#chan") == ""
+    assert state.status("nobody", "#chan") is None
+    assert state.get_user(ME).mask == "CloudBot!bot@bot.host"
+    assert state.get_user("plain").mask is None
+
+
+def test_names_replaces_members():
+    state = joined_state()
+    feed(state,
+         ":server 353 CloudBot = #chan :CloudBot newcomer")
+    # members missing from the new reply are only removed once it's complete
+    assert state.is_on("op", "#chan")
+    feed(state, ":server 366 CloudBot #chan :End of /NAMES list.")
+    assert sorted(state.channel_nicks("#chan")) == ["CloudBot", "newcomer"]
+    # users we no longer share a channel with are forgotten, the rest keep what we knew about them
+    assert state.get_user("op") is None
+    assert state.get_user(ME).host == "bot.host"
+
+
+def test_userhost_in_names():
+    state = IrcState()
+    feed(state,
+         ":CloudBot!bot@bot.host JOIN #chan",
+         ":server 353 CloudBot = #chan :@op!ident@some.host CloudBot!bot@bot.host")
+    assert state.get_user("op").mask == "op!ident@some.host"
+    assert state.status("op", "#chan") == "@"
+
+
+def test_join_part_kick_quit():
+    state = joined_state()
+    feed(state, ":other!o@other.host JOIN #chan")
+    assert state.is_on("other", "#chan")
+    assert state.get_user("other").host == "other.host"
+
+    feed(state, ":other!o@other.host PART #chan :bye")
+    assert not state.is_on("other", "#chan")
+    assert state.get_user("other") is None
+
+    feed(state, ":op!o@h KICK #chan plain :out")
+    assert not state.is_on("plain", "#chan")
+
+    feed(state, ":voice!v@h QUIT :gone")
+    assert state.get_user("voice") is None
+    assert not state.is_on("voice", "#chan")
+
+
+def test_join_unknown_channel_ignored():
+    state = joined_state()
+    feed(state, ":other!o@h JOIN #elsewhere")
+    assert state.get_user("other") is None
+
+
+def test_users_in_several_channels():
+    state = joined_state()
+    feed(state,
+         ":CloudBot!bot@bot.host JOIN #two",
+         ":server 353 CloudBot = #two :CloudBot plain",
+         ":server 366 CloudBot #two :End of /NAMES list.")
+    assert state.user_channels("plain") == ["#Chan", "#two"]
+
+    feed(state, ":plain!p@h PART #Chan")
+    assert state.user_channels("plain") == ["#two"]
+
+    # the bot leaving a channel forgets everyone only seen there
+    feed(state, ":CloudBot!bot@bot.host PART #two")
+    assert state.get_channel("#two") is None
+    assert state.get_user("plain") is None
+    assert state.get_user(ME) is not None
+
+
+def test_bot_kicked():
+    state = joined_state()
+    feed(state, ":op!o@h KICK #chan CloudBot :out")
+    assert state.get_channel("#chan") is None
+    assert state.users == {}
+
+
+def test_nick_change():
+    state = joined_state()
+    feed(state, ":op!o@h NICK :Renamed")
+    assert state.get_user("op") is None
+    assert state.get_user("renamed").nick == "Renamed"
+    assert state.status("Renamed", "#chan") == "@"
+
+    # case only changes keep the same key
+    feed(state, ":Renamed!o@h NICK RENAMED")
+    assert state.get_user("renamed").nick == "RENAMED"
+    assert state.status("renamed", "#chan") == "@"
+
+
+def test_modes():
+    state = joined_state()
+    feed(state, ":op!o@h MODE #chan +ov-o+kl plain voice op key 10")
+    assert state.status("plain", "#chan") == "@"
+    assert state.status("voice", "#chan") == "+"
+    assert state.status("op", "#chan") == ""
+
+    # the key param of -k is consumed, -l has none
+    feed(state, ":op!o@h MODE #chan -klv+bo key voice *!*@bad voice")
+    assert state.status("voice", "#chan") == "@"
+
+    # user modes are ignored
+    feed(state, ":CloudBot MODE CloudBot +i")
+
+
+def test_isupport():
+    state = IrcState()
+    feed(state,
+         ":server 001 CloudBot :Welcome",
+         ":server 005 CloudBot PREFIX=(qaohv)~&@%+ CASEMAPPING=ascii CHANMODES=beI,k,l,imnpst :are supported",
+         ":CloudBot!bot@bot.host JOIN #chan",
+         ":server 353 CloudBot = #chan :~&owner %half [user]")
+    assert state.status("owner", "#chan") == "~&"
+    assert state.status("half", "#chan") == "%"
+    # with ascii case mapping, [ and { are different
+    assert state.is_on("[USER]", "#chan")
+    assert not state.is_on("{user}", "#chan")
+
+    feed(state, ":owner!o@h MODE #chan +h-q owner owner")
+    assert state.status("owner", "#chan") == "&%"
+
+
+def test_rfc1459_casemapping():
+    state = joined_state()
+    feed(state, ":[x]!x@h JOIN #chan")
+    assert state.is_on("{X}", "#CHAN")
+
+
+def test_who():
+    state = joined_state()
+    feed(state, ":server 352 CloudBot #chan ident some.host irc.server plain H@ :0 Real Name")
+    assert state.get_user("plain").mask == "plain!ident@some.host"
+    assert state.status("plain", "#chan") == "@"
+
+
+def test_host_learned_from_messages():
+    state = joined_state()
+    feed(state, ":plain!p@plain.host PRIVMSG #chan :hello")
+    assert state.get_user("plain").mask == "plain!p@plain.host"
+
+
+def test_interned():
+    state = IrcState()
+    feed(state,
+         ":CloudBot!bot@bot.host JOIN #chan",
+         ":a!ident@shared.host JOIN #chan",
+         ":b!ident@shared.host JOIN #chan")
+    assert state.get_user("a").host is state.get_user("b").host
+    assert state.get_user("a").user is state.get_user("b").user
+
+
+def test_welcome_clears():
+    state = joined_state()
+    feed(state, ":server 001 CloudBot :Welcome")
+    assert state.stats() == {"channels": 0, "users": 0, "memberships": 0}
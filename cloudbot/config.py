@@ -35,7 +35,8 @@ class Config(dict):
 
         # populate self with config data
         self.load_config()
-        self.reloading_enabled = self.get("reloading", {}).get("config_reloading", True)
+        # when running sharded, the supervisor watches the config and tells each worker to reload it
+        self.reloading_enabled = self.get("reloading", {}).get("config_reloading", True) and bot.shard is None
 
         if self.reloading_enabled:
             # start watcher
@@ -1,7 +1,7 @@
 import asyncio
 import enum
 import logging
-import concurrent.futures
+import operator
 
 logger = logging.getLogger("cloudbot")
 
@@ -18,8 +18,48 @@ class EventType(enum.Enum):
     other = 6
 
 
+class _EventData:
+    """
+    The parsed values of an event, which are shared by every Event created from it with `base_event`.
+
+    Nothing should modify these after the first Event is created.
+    """
+    __slots__ = ("type", "content", "target", "chan", "nick", "user", "host", "mask", "irc_raw", "irc_prefix",
+                 "irc_command", "irc_paramlist", "irc_ctcp_text", "irc_tags", "irc_batch")
+
+    def __init__(self, event_type, content, target, channel, nick, user, host, mask, irc_raw, irc_prefix, irc_command,
+                 irc_paramlist, irc_ctcp_text, irc_tags, irc_batch):
+        self.type = event_type
+        self.content = content
+        self.target = target
+        self.chan = channel
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.mask = mask
+        # clients-specific parameters
+        self.irc_raw = irc_raw
+        self.irc_prefix = irc_prefix
+        self.irc_command = irc_command
+        self.irc_paramlist = irc_paramlist
+        self.irc_ctcp_text = irc_ctcp_text
+        self.irc_tags = irc_tags
+        self.irc_batch = irc_batch
+
+
+def _data_property(name):
+    """
+    Creates a read-only property which gets the given attribute of an event's shared _EventData
+    :type name: str
+    """
+    return property(operator.attrgetter("_data." + name))
+
+
 class Event:
     """
+    Events are created once for each line received, and then once more for each hook run on that line, using the first
+    event as the `base_event`. Derived events only store the per-hook values, and share everything else with the base.
+
     :type bot: cloudbot.bot.CloudBot
     :type conn: cloudbot.client.Client
     :type hook: cloudbot.plugin.Hook
@@ -32,17 +72,37 @@ class Event:
     :type host: str
     :type mask: str
     :type db: sqlalchemy.orm.Session
-    :type db_executor: concurrent.futures.ThreadPoolExecutor
+    :type db_executor: cloudbot.util.dbpool.DatabaseWorker
     :type irc_raw: str
     :type irc_prefix: str
     :type irc_command: str
     :type irc_paramlist: str
     :type irc_ctcp_text: str
+    :type irc_tags: dict[str, str]
+    :type irc_batch: cloudbot.clients.irc_batch.Batch
     """
 
+    __slots__ = ("bot", "conn", "hook", "db", "db_executor", "_data")
+
+    type = _data_property("type")
+    content = _data_property("content")
+    target = _data_property("target")
+    chan = _data_property("chan")
+    nick = _data_property("nick")
+    user = _data_property("user")
+    host = _data_property("host")
+    mask = _data_property("mask")
+    irc_raw = _data_property("irc_raw")
+    irc_prefix = _data_property("irc_prefix")
+    irc_command = _data_property("irc_command")
+    irc_paramlist = _data_property("irc_paramlist")
+    irc_ctcp_text = _data_property("irc_ctcp_text")
+    irc_tags = _data_property("irc_tags")
+    irc_batch = _data_property("irc_batch")
+
     def __init__(self, *, bot=None, hook=None, conn=None, base_event=None, event_type=EventType.other, content=None,
                  target=None, channel=None, nick=None, user=None, host=None, mask=None, irc_raw=None, irc_prefix=None,
-                 irc_command=None, irc_paramlist=None, irc_ctcp_text=None):
+                 irc_command=None, irc_paramlist=None, irc_ctcp_text=None, irc_tags=None, irc_batch=None):
         """
         All of these parameters except for `bot` and `hook` are optional.
         The irc_* parameters should only be specified for IRC events.
@@ -68,6 +128,8 @@ class Event:
         :param irc_paramlist: The list of params for the IRC command. If the last param is a content param, the ':'
                                 should be removed from the front.
         :param irc_ctcp_text: CTCP text if this message is a CTCP command
+        :param irc_tags: The IRCv3 message tags, if the line had any
+        :param irc_batch: The batch of lines, for a BATCH event
         :type bot: cloudbot.bot.CloudBot
         :type conn: cloudbot.client.Client
         :type hook: cloudbot.plugin.Hook
@@ -84,6 +146,8 @@ class Event:
         :type irc_command: str
         :type irc_paramlist: list[str]
         :type irc_ctcp_text: str
+        :type irc_tags: dict[str, str]
+        :type irc_batch: cloudbot.clients.irc_batch.Batch
         """
         self.db = None
         self.db_executor = None
@@ -99,37 +163,20 @@ class Event:
             if self.hook is None and base_event.hook is not None:
                 self.hook = base_event.hook
 
-            # If base_event is provided, don't check these parameters, just inherit
-            self.type = base_event.type
-            self.content = base_event.content
-            self.target = base_event.target
-            self.chan = base_event.chan
-            self.nick = base_event.nick
-            self.user = base_event.user
-            self.host = base_event.host
-            self.mask = base_event.mask
-            # clients-specific parameters
-            self.irc_raw = base_event.irc_raw
-            self.irc_prefix = base_event.irc_prefix
-            self.irc_command = base_event.irc_command
-            self.irc_paramlist = base_event.irc_paramlist
-            self.irc_ctcp_text = base_event.irc_ctcp_text
+            # If base_event is provided, don't check these parameters, just share its values
+            self._data = base_event._data
         else:
             # Since base_event wasn't provided, we can take these parameters
-            self.type = event_type
-            self.content = content
-            self.target = target
-            self.chan = channel
-            self.nick = nick
-            self.user = user
-            self.host = host
-            self.mask = mask
-            # clients-specific parameters
-            self.irc_raw = irc_raw
-            self.irc_prefix = irc_prefix
-            self.irc_command = irc_command
-            self.irc_paramlist = irc_paramlist
-            self.irc_ctcp_text = irc_ctcp_text
+            self._data = _EventData(event_type, content, target, channel, nick, user, host, mask, irc_raw, irc_prefix,
+                                    irc_command, irc_paramlist, irc_ctcp_text, irc_tags, irc_batch)
+
+    @classmethod
+    def valid_args(cls):
+        """
+        Returns the names of all arguments which hooks run with this type of event can ask for
+        :rtype: frozenset[str]
+        """
+        return frozenset(name for name in dir(cls) if not name.startswith("_"))
 
     @asyncio.coroutine
     def prepare(self):
@@ -148,10 +195,13 @@ class Event:
         if "db" in self.hook.required_args:
             #logger.debug("Opening database session for {}:threaded=False".format(self.hook.description))
 
-            # we're running a coroutine hook with a db, so initialise an executor pool
-            self.db_executor = concurrent.futures.ThreadPoolExecutor(1)
+            # we're running a coroutine hook with a db, so lease one of the bot's database workers. All of this
+            # hook's async() calls will run in that worker's thread. Other hooks can lease the same worker, so each
+            # hook gets a session of its own rather than the thread's scoped session, which closing would end for all
+            # of them.
+            self.db_executor = self.bot.db_pool.acquire()
             # be sure to initialize the db in the database executor, so it will be accessible in that thread.
-            self.db = yield from self.async(self.bot.db_session)
+            self.db = yield from self.async(self.bot.db_factory)
 
     def prepare_threaded(self):
         """
@@ -184,11 +234,16 @@ class Event:
         if self.hook is None:
             raise ValueError("event.hook is required to close an event")
 
-        if self.db is not None:
-            #logger.debug("Closing database session for {}:threaded=False".format(self.hook.description))
-            # be sure the close the database in the database executor, as it is only accessable in that one thread
-            yield from self.async(self.db.close)
-            self.db = None
+        try:
+            if self.db is not None:
+                #logger.debug("Closing database session for {}:threaded=False".format(self.hook.description))
+                # be sure the close the database in the database executor, as it is only accessable in that one thread
+                db, self.db = self.db, None
+                yield from self.async(db.close)
+        finally:
+            if self.db_executor is not None:
+                self.bot.db_pool.release(self.db_executor)
+                self.db_executor = None
 
     def close_threaded(self):
         """
@@ -314,9 +369,9 @@ class Event:
         else:
             executor = None
         if kwargs:
-            result = yield from self.loop.run_in_executor(executor, function, *args)
-        else:
             result = yield from self.loop.run_in_executor(executor, lambda: function(*args, **kwargs))
+        else:
+            result = yield from self.loop.run_in_executor(executor, function, *args)
         return result
 
 
@@ -327,6 +382,8 @@ class CommandEvent(Event):
     :type triggered_command: str
     """
 
+    __slots__ = ("text", "doc", "triggered_command")
+
     def __init__(self, *, bot=None, hook, text, triggered_command, conn=None, base_event=None, event_type=None,
                  content=None, target=None, channel=None, nick=None, user=None, host=None, mask=None, irc_raw=None,
                  irc_prefix=None, irc_command=None, irc_paramlist=None):
@@ -370,6 +427,8 @@ class RegexEvent(Event):
     :type match: re.__Match
     """
 
+    __slots__ = ("match",)
+
     def __init__(self, *, bot=None, hook, match, conn=None, base_event=None, event_type=None, content=None, target=None,
                  channel=None, nick=None, user=None, host=None, mask=None, irc_raw=None, irc_prefix=None,
                  irc_command=None, irc_paramlist=None):
@@ -381,3 +440,27 @@ class RegexEvent(Event):
                          target=target, channel=channel, nick=nick, user=user, host=host, mask=mask, irc_raw=irc_raw,
                          irc_prefix=irc_prefix, irc_command=irc_command, irc_paramlist=irc_paramlist)
         self.match = match
+
+
+class CapEvent(Event):
+    """
+    :type cap: str
+    :type cap_value: str | None
+    :type enabled: bool
+    """
+
+    __slots__ = ("cap", "cap_value", "enabled")
+
+    def __init__(self, *, bot=None, hook, conn, cap, cap_value=None, enabled=True):
+        """
+        :param cap: The capability which was enabled or removed
+        :param cap_value: The value the server gave for the capability, eg. the mechanisms of "sasl"
+        :param enabled: True if the capability was enabled, False if it was removed
+        :type cap: str
+        :type cap_value: str | None
+        :type enabled: bool
+        """
+        super().__init__(bot=bot, conn=conn, hook=hook)
+        self.cap = cap
+        self.cap_value = cap_value
+        self.enabled = enabled
@@ -132,6 +132,32 @@ class _RawHook(_Hook):
             self.triggers.update(trigger_param)
 
 
+class _CapHook(_Hook):
+    """
+    :type caps: set[str]
+    """
+
+    def __init__(self, function):
+        """
+        :type function: function
+        """
+        _Hook.__init__(self, function, "irc_cap")
+        self.caps = set()
+
+    def add_hook(self, caps_param, kwargs):
+        """
+        :type caps_param: list[str] | str
+        :type kwargs: dict[str, unknown]
+        """
+        self._add_hook(kwargs)
+
+        if isinstance(caps_param, str):
+            self.caps.add(caps_param)
+        else:
+            # it's a list
+            self.caps.update(caps_param)
+
+
 class _PeriodicHook(_Hook):
     def __init__(self, function):
         """
@@ -232,6 +258,28 @@ def irc_raw(triggers_param, **kwargs):
         return lambda func: _raw_hook(func)
 
 
+def irc_cap(caps_param, **kwargs):
+    """External IRCv3 capability decorator. Must be used as a function to return a decorator.
+    Every capability named by a loaded irc_cap hook is requested when the server offers it, and the hook is run with
+    `cap`, `cap_value` and `enabled` whenever one of them is enabled or removed on a connection.
+    :type caps_param: str | list[str]
+    """
+
+    def _cap_hook(func):
+        hook = _get_hook(func, "irc_cap")
+        if hook is None:
+            hook = _CapHook(func)
+            _add_hook(func, hook)
+
+        hook.add_hook(caps_param, kwargs)
+        return func
+
+    if callable(caps_param):  # this decorator is being used directly, which isn't good
+        raise TypeError("@irc_cap() must be used as a function that returns a decorator")
+    else:  # this decorator is being used as a function, so return a decorator
+        return lambda func: _cap_hook(func)
+
+
 def event(types_param, **kwargs):
     """External event decorator. Must be used as a function to return a decorator
     :type types_param: cloudbot.event.EventType | list[cloudbot.event.EventType]
@@ -274,12 +322,15 @@ def regex(regex_param, **kwargs):
 
 
 def sieve(param=None, **kwargs):
-    """External sieve decorator. Can be used directly as a decorator, or with args to return a decorator
+    """External sieve decorator. Can be used directly as a decorator, or with args to return a decorator.
+
+    Sieves can limit which hooks they are run for with `types` (hook types, eg. ["command", "regex"]) and `plugins`
+    (plugin titles). Non-coroutine sieves declared with `threaded=False` are run directly in the event loop.
     :type param: function | None
     """
 
     def _sieve_hook(func):
-        assert len(inspect.getargspec(func).args) == 3, \
+        assert len(inspect.signature(func).parameters) == 3, \
             "Sieve plugin has incorrect argument count. Needs params: bot, input, plugin"
 
         hook = _get_hook(func, "sieve")
@@ -337,5 +388,26 @@ def on_start(param=None, **kwargs):
         return lambda func: _on_start_hook(func)
 
 
+def on_stop(param=None, **kwargs):
+    """External on_stop decorator. Can be used directly as a decorator, or with args to return a decorator.
+    on_stop hooks are run when their plugin is unloaded or reloaded, and when the bot stops.
+    :type param: function | None
+    """
+
+    def _on_stop_hook(func):
+        hook = _get_hook(func, "on_stop")
+        if hook is None:
+            hook = _Hook(func, "on_stop")
+            _add_hook(func, hook)
+
+        hook._add_hook(kwargs)
+        return func
+
+    if callable(param):
+        return _on_stop_hook(param)
+    else:
+        return lambda func: _on_stop_hook(func)
+
+
 # this is temporary, to ease transition
 onload = on_start
@@ -3,22 +3,44 @@ import glob
 import importlib
 import inspect
 import logging
+import operator
 import os
 import re
+import time
 
 import sqlalchemy
 
-from cloudbot.event import Event
+from cloudbot.event import Event, CommandEvent, RegexEvent, CapEvent
 from cloudbot.util import database
+from cloudbot.util.executors import HookExecutor
+from cloudbot.util.manifest import PluginManifest, build_entry, is_lazy
+from cloudbot.util.metrics import Metrics
+from cloudbot.util.prefixindex import PrefixIndex
+from cloudbot.util.regexset import RegexSet
+from cloudbot.util.scheduler import PeriodicScheduler, FIXED_RATE, FIXED_DELAY
+from cloudbot.util.schema import sync_schema
+from cloudbot.util.startup import StartupProfile, current_rss
 
 logger = logging.getLogger("cloudbot")
 
+# how long hooks can run before they're cancelled or abandoned, unless the hook or the config says otherwise
+DEFAULT_HOOK_TIMEOUT = 60
+# how many threaded hooks from one plugin can run at once
+DEFAULT_PLUGIN_THREADS = 4
+# how long to wait after a plugin is loaded before writing the manifest, so loading several plugins writes it once
+MANIFEST_SAVE_DELAY = 1
+
+
+class HookTimeoutError(Exception):
+    pass
+
 
 def find_hooks(parent, module):
     """
     :type parent: Plugin
     :type module: object
-    :rtype: (list[CommandHook], list[RegexHook], list[RawHook], list[SieveHook], List[EventHook], list[OnStartHook])
+    :rtype: (list[CommandHook], list[RegexHook], list[RawHook], list[SieveHook], List[EventHook], list[PeriodicHook],
+             list[OnStartHook], list[OnStopHook], list[CapHook])
     """
     # set the loaded flag
     module._cloudbot_loaded = True
@@ -29,8 +51,10 @@ def find_hooks(parent, module):
     event = []
     periodic = []
     on_start = []
+    on_stop = []
+    cap = []
     type_lists = {"command": command, "regex": regex, "irc_raw": raw, "sieve": sieve, "event": event,
-                  "periodic": periodic, "on_start": on_start}
+                  "periodic": periodic, "on_start": on_start, "on_stop": on_stop, "irc_cap": cap}
     for name, func in module.__dict__.items():
         if hasattr(func, "_cloudbot_hook"):
             # if it has cloudbot hook
@@ -42,7 +66,7 @@ def find_hooks(parent, module):
             # delete the hook to free memory
             del func._cloudbot_hook
 
-    return command, regex, raw, sieve, event, periodic, on_start
+    return command, regex, raw, sieve, event, periodic, on_start, on_stop, cap
 
 
 def find_tables(code):
@@ -75,12 +99,14 @@ class PluginManager:
 
     :type bot: cloudbot.bot.CloudBot
     :type plugins: dict[str, Plugin]
-    :type commands: dict[str, CommandHook]
+    :type commands: PrefixIndex[str, CommandHook]
     :type raw_triggers: dict[str, list[RawHook]]
     :type catch_all_triggers: list[RawHook]
     :type event_type_hooks: dict[cloudbot.event.EventType, list[EventHook]]
-    :type regex_hooks: list[(re.__Regex, RegexHook)]
+    :type cap_hooks: dict[str, list[CapHook]]
+    :type regex_hooks: RegexSet[(re.__Regex, RegexHook)]
     :type sieves: list[SieveHook]
+    :type _sieve_chains: dict[Hook, tuple[SieveHook]]
     """
 
     def __init__(self, bot):
@@ -91,13 +117,25 @@ class PluginManager:
         self.bot = bot
 
         self.plugins = {}
-        self.commands = {}
+        self.commands = PrefixIndex()
         self.raw_triggers = {}
         self.catch_all_triggers = []
         self.event_type_hooks = {}
-        self.regex_hooks = []
+        self.cap_hooks = {}
+        self.regex_hooks = RegexSet()
         self.sieves = []
+        self._sieve_chains = {}
         self._hook_waiting_queues = {}
+        # call counts and timings of every hook and sieve
+        self.metrics = Metrics()
+        # runs every periodic hook from a single timer
+        self.scheduler = PeriodicScheduler(bot.loop, self._run_periodic)
+        # the hooks each plugin file has, so plugins can be registered without importing them until they're used
+        self.manifest = PluginManifest(os.path.join(bot.data_dir, ".plugin_manifest.json"))
+        self._manifest_save = None
+        self._lazy_loads = {}
+        # how long each step of loading each plugin took
+        self.startup = StartupProfile()
 
     @asyncio.coroutine
     def load_all(self, plugin_dir):
@@ -109,8 +147,77 @@ class PluginManager:
         :type plugin_dir: str
         """
         path_list = glob.iglob(os.path.join(plugin_dir, '*.py'))
-        # Load plugins asynchronously :O
-        yield from asyncio.gather(*[self.load_plugin(path) for path in path_list], loop=self.bot.loop)
+        if self.lazy_loading:
+            self.manifest.load()
+
+        plugins = []
+        for path in path_list:
+            if self.lazy_loading:
+                entry = self.manifest.get(os.path.abspath(path))
+                if entry is not None and is_lazy(entry):
+                    self.register_lazy(path, entry)
+                    continue
+
+            file_name = os.path.basename(path)
+            if not self._can_load(file_name, os.path.splitext(file_name)[0]):
+                continue
+            plugin = self._import_plugin(path)
+            if plugin is not None:
+                plugins.append(plugin)
+
+        # create every plugin's tables together, before any on_start hooks use them
+        yield from self._sync_tables(plugins)
+
+        # Start plugins asynchronously :O
+        yield from asyncio.gather(*[self._start_plugin(plugin) for plugin in plugins], loop=self.bot.loop)
+        if self.lazy_loading:
+            self._save_manifest()
+
+    @property
+    def lazy_loading(self):
+        """
+        :rtype: bool
+        """
+        return self.bot.config.get("plugin_loading", {}).get("lazy_loading", False)
+
+    def _can_load(self, file_name, title):
+        """
+        :type file_name: str
+        :type title: str
+        :return: Whether the plugin is allowed by the whitelist or blacklist
+        :rtype: bool
+        """
+        if "plugin_loading" in self.bot.config:
+            pl = self.bot.config.get("plugin_loading")
+
+            if pl.get("use_whitelist", False):
+                if title not in pl.get("whitelist", []):
+                    logger.info('Not loading plugin module "{}": plugin not whitelisted'.format(file_name))
+                    return False
+            else:
+                if title in pl.get("blacklist", []):
+                    logger.info('Not loading plugin module "{}": plugin blacklisted'.format(file_name))
+                    return False
+        return True
+
+    def register_lazy(self, path, entry):
+        """
+        Registers a plugin's commands and regexes from its manifest entry, without importing it. The plugin is loaded
+        the first time one of them runs.
+
+        :type path: str
+        :type entry: dict
+        """
+        file_path = os.path.abspath(path)
+        file_name = os.path.basename(path)
+        title = os.path.splitext(file_name)[0]
+        if not self._can_load(file_name, title):
+            return
+        if file_name in self.plugins:
+            logger.warning("Not registering {} lazily, it's already loaded".format(file_name))
+            return
+
+        self._register_plugin(LazyPlugin(file_path, file_name, title, entry))
 
     @asyncio.coroutine
     def load_plugin(self, path):
@@ -126,23 +233,35 @@ class PluginManager:
         file_name = os.path.basename(path)
         title = os.path.splitext(file_name)[0]
 
-        if "plugin_loading" in self.bot.config:
-            pl = self.bot.config.get("plugin_loading")
-
-            if pl.get("use_whitelist", False):
-                if title not in pl.get("whitelist", []):
-                    logger.info('Not loading plugin module "{}": plugin not whitelisted'.format(file_name))
-                    return
-            else:
-                if title in pl.get("blacklist", []):
-                    logger.info('Not loading plugin module "{}": plugin blacklisted'.format(file_name))
-                    return
+        if not self._can_load(file_name, title):
+            return
 
         # make sure to unload the previously loaded plugin from this path, if it was loaded.
         if file_name in self.plugins:
             yield from self.unload_plugin(file_path)
 
+        plugin = self._import_plugin(file_path)
+        if plugin is None:
+            return
+
+        yield from self._sync_tables([plugin])
+        yield from self._start_plugin(plugin)
+
+    def _import_plugin(self, path):
+        """
+        Imports a plugin, or reloads it if it's been imported before, and finds its hooks and tables
+
+        :type path: str
+        :rtype: Plugin | None
+        """
+        file_path = os.path.abspath(path)
+        file_name = os.path.basename(path)
+        title = os.path.splitext(file_name)[0]
+
+        self.startup.reset(file_name)
         module_name = "plugins.{}".format(title)
+        rss_before = current_rss()
+        import_start = time.monotonic()
         try:
             plugin_module = importlib.import_module(module_name)
             # if this plugin was loaded before, reload it
@@ -150,33 +269,138 @@ class PluginManager:
                 importlib.reload(plugin_module)
         except Exception:
             logger.exception("Error loading {}:".format(file_name))
-            return
+            # make sure it's imported at the next start, so the error is seen
+            self.manifest.remove(file_path)
+            return None
+        finally:
+            self.startup.record(file_name, "import", time.monotonic() - import_start)
+            self.startup.record_rss(file_name, rss_before, current_rss())
 
         # create the plugin
-        plugin = Plugin(file_path, file_name, title, plugin_module)
+        try:
+            return Plugin(file_path, file_name, title, plugin_module)
+        except ValueError:
+            logger.exception("Error loading hooks from {}:".format(file_name))
+            return None
 
-        # proceed to register hooks
+    @asyncio.coroutine
+    def _sync_tables(self, plugins):
+        """
+        Creates the tables, columns and indexes the given plugins declare which are missing from the database, all in
+        one transaction
 
-        # create database tables
-        yield from plugin.create_tables(self.bot)
+        :type plugins: list[Plugin]
+        """
+        tables = [table for plugin in plugins for table in plugin.tables]
+        if not tables:
+            return
+
+        logger.info("Registering tables for {}".format(", ".join(plugin.title for plugin in plugins if plugin.tables)))
+        try:
+            changes = yield from self.bot.loop.run_in_executor(None, sync_schema, self.bot.db_engine, tables)
+        except Exception:
+            logger.exception("Error creating database tables:")
+            return
+
+        if changes:
+            logger.info("Updated the database schema: {}".format(changes))
+        for name in changes.unmigrated:
+            logger.warning("Column {} is missing from the database, and can't be added to the existing table"
+                           .format(name))
+
+        created = set(changes.tables)
+        for plugin in plugins:
+            for table in plugin.tables:
+                stage = "tables_create" if table.name in created else "tables_check"
+                self.startup.record(plugin.file_name, stage, changes.durations.get(table.name, 0))
+
+    @asyncio.coroutine
+    def _start_plugin(self, plugin):
+        """
+        Runs a plugin's on_start hooks, then registers all of its hooks
+
+        :type plugin: Plugin
+        """
+        file_name = plugin.file_name
 
         # run on_start hooks
         for on_start_hook in plugin.run_on_start:
+            on_start_begin = time.monotonic()
             success = yield from self.launch(on_start_hook, Event(bot=self.bot, hook=on_start_hook))
+            self.startup.record(file_name, "on_start", time.monotonic() - on_start_begin)
             if not success:
                 logger.warning("Not registering hooks from plugin {}: on_start hook errored".format(plugin.title))
 
                 # unregister databases
                 plugin.unregister_tables(self.bot)
+                self._shutdown_executor(plugin)
                 return
 
+        self._register_plugin(plugin)
+
+        if self.lazy_loading:
+            self.manifest.update(plugin.file_path, build_entry(plugin))
+            self._schedule_manifest_save()
+
+        # we don't need this anymore
+        del plugin.run_on_start
+
+        if plugin.cap_hooks:
+            self._start_cap_hooks(plugin)
+
+    def _schedule_manifest_save(self):
+        if self._manifest_save is None:
+            self._manifest_save = self.bot.loop.call_later(MANIFEST_SAVE_DELAY, self._save_manifest)
+
+    def _save_manifest(self):
+        if self._manifest_save is not None:
+            self._manifest_save.cancel()
+            self._manifest_save = None
+        try:
+            self.manifest.save()
+        except OSError:
+            logger.exception("Error writing the plugin manifest to {}:".format(self.manifest.path))
+
+    @asyncio.coroutine
+    def _resolve_lazy(self, hook):
+        """
+        Loads the plugin of a hook registered from the manifest, and finds the hook it was standing in for
+
+        :type hook: LazyHook
+        :rtype: Hook | None
+        """
+        plugin = hook.plugin
+        future = self._lazy_loads.get(plugin.file_name)
+        if future is None and self.plugins.get(plugin.file_name) is plugin:
+            logger.info("Loading {} on first use".format(plugin.file_name))
+            future = asyncio.async(self.load_plugin(plugin.file_path), loop=self.bot.loop)
+            self._lazy_loads[plugin.file_name] = future
+            future.add_done_callback(lambda _: self._lazy_loads.pop(plugin.file_name, None))
+        if future is not None:
+            yield from future
+
+        loaded = self.plugins.get(plugin.file_name)
+        if loaded is not None and not loaded.lazy:
+            for real_hook in (loaded.commands if hook.type == "command" else loaded.regexes):
+                if real_hook.function_name == hook.function_name:
+                    return real_hook
+        logger.warning("Not running {}: its plugin didn't load, or no longer has it".format(hook.description))
+        return None
+
+    def _register_plugin(self, plugin):
+        """
+        Registers all hooks from a plugin whose on_start hooks have run
+
+        :type plugin: Plugin
+        """
         self.plugins[plugin.file_name] = plugin
 
         for periodic_hook in plugin.periodic:
-            asyncio.async(self._start_periodic(periodic_hook))
+            self.scheduler.add(periodic_hook, periodic_hook.interval, initial_delay=periodic_hook.initial_interval,
+                               mode=periodic_hook.mode, jitter=periodic_hook.jitter,
+                               skip_if_running=periodic_hook.skip_if_running)
             self._log_hook(periodic_hook)
 
-
         # register commands
         for command_hook in plugin.commands:
             for alias in command_hook.aliases:
@@ -209,10 +433,19 @@ class PluginManager:
                     self.event_type_hooks[event_type] = [event_hook]
             self._log_hook(event_hook)
 
+        # register capability hooks
+        for cap_hook in plugin.cap_hooks:
+            for cap in cap_hook.caps:
+                if cap in self.cap_hooks:
+                    self.cap_hooks[cap].append(cap_hook)
+                else:
+                    self.cap_hooks[cap] = [cap_hook]
+            self._log_hook(cap_hook)
+
         # register regexps
         for regex_hook in plugin.regexes:
             for regex_match in regex_hook.regexes:
-                self.regex_hooks.append((regex_match, regex_hook))
+                self.regex_hooks.add(regex_match, regex_hook)
             self._log_hook(regex_hook)
 
         # register sieves
@@ -223,8 +456,16 @@ class PluginManager:
         # sort sieve hooks by priority
         self.sieves.sort(key=lambda x: x.priority)
 
-        # we don't need this anymore
-        del plugin.run_on_start
+        # the sieves which apply to each hook will be recalculated the next time each hook is launched
+        self._sieve_chains.clear()
+
+    @asyncio.coroutine
+    def unload_all(self):
+        """
+        Unloads every loaded plugin, running their on_stop hooks
+        """
+        yield from asyncio.gather(*[self.unload_plugin(plugin.file_path) for plugin in list(self.plugins.values())],
+                                  loop=self.bot.loop)
 
     @asyncio.coroutine
     def unload_plugin(self, path):
@@ -249,6 +490,10 @@ class PluginManager:
         # get the loaded plugin
         plugin = self.plugins[file_name]
 
+        # stop periodic hooks, runs which have already started are left to finish
+        for periodic_hook in plugin.periodic:
+            self.scheduler.cancel(periodic_hook)
+
         # unregister commands
         for command_hook in plugin.commands:
             for alias in command_hook.aliases:
@@ -275,18 +520,35 @@ class PluginManager:
                 if not self.event_type_hooks[event_type]:  # if that was the last hook for this event type
                     del self.event_type_hooks[event_type]
 
+        # unregister capability hooks
+        for cap_hook in plugin.cap_hooks:
+            for cap in cap_hook.caps:
+                assert cap in self.cap_hooks  # this can't be not true
+                self.cap_hooks[cap].remove(cap_hook)
+                if not self.cap_hooks[cap]:  # if that was the last hook for this capability
+                    del self.cap_hooks[cap]
+
         # unregister regexps
         for regex_hook in plugin.regexes:
             for regex_match in regex_hook.regexes:
-                self.regex_hooks.remove((regex_match, regex_hook))
+                self.regex_hooks.remove(regex_match, regex_hook)
 
         # unregister sieves
         for sieve_hook in plugin.sieves:
             self.sieves.remove(sieve_hook)
 
+        self._sieve_chains.clear()
+
+        # run on_stop hooks, now that nothing else from this plugin will be started
+        for on_stop_hook in plugin.run_on_stop:
+            yield from self.launch(on_stop_hook, Event(bot=self.bot, hook=on_stop_hook))
+
         # unregister databases
         plugin.unregister_tables(self.bot)
 
+        # hooks still running in the plugin's threads are left to finish
+        self._shutdown_executor(plugin)
+
         # remove last reference to plugin
         del self.plugins[plugin.file_name]
 
@@ -295,6 +557,41 @@ class PluginManager:
 
         return True
 
+    def _start_cap_hooks(self, plugin):
+        """
+        Requests the capabilities a newly loaded plugin wants on every connection, and runs its hooks for the
+        capabilities which are already enabled
+
+        :type plugin: Plugin
+        """
+        for conn in self.bot.connections.values():
+            caps = getattr(conn, "caps", None)
+            if caps is None or not conn.connected:
+                continue
+            conn.request_caps()
+            for cap_hook in plugin.cap_hooks:
+                for cap in cap_hook.caps:
+                    if cap in caps.enabled:
+                        asyncio.async(self.cap_changed(conn, cap, caps.enabled[cap], True, hooks=[cap_hook]),
+                                      loop=self.bot.loop)
+
+    @asyncio.coroutine
+    def cap_changed(self, conn, cap, value, enabled, *, hooks=None):
+        """
+        Runs the irc_cap hooks for a capability which was enabled or removed on a connection
+
+        :type conn: cloudbot.client.Client
+        :type cap: str
+        :type value: str | None
+        :type enabled: bool
+        :type hooks: list[CapHook]
+        """
+        if hooks is None:
+            hooks = self.cap_hooks.get(cap, ())
+        yield from asyncio.gather(*[self.launch(cap_hook, CapEvent(bot=self.bot, conn=conn, hook=cap_hook, cap=cap,
+                                                                   cap_value=value, enabled=enabled))
+                                    for cap_hook in hooks], loop=self.bot.loop)
+
     def _log_hook(self, hook):
         """
         Logs registering a given hook
@@ -305,39 +602,21 @@ class PluginManager:
             logger.info("Loaded {}".format(hook))
             logger.debug("Loaded {}".format(repr(hook)))
 
-    def _prepare_parameters(self, hook, event):
-        """
-        Prepares arguments for the given hook
-
-        :type hook: cloudbot.plugin.Hook
-        :type event: cloudbot.event.Event
-        :rtype: list
-        """
-        parameters = []
-        for required_arg in hook.required_args:
-            if hasattr(event, required_arg):
-                value = getattr(event, required_arg)
-                parameters.append(value)
-            else:
-                logger.error("Plugin {} asked for invalid argument '{}', cancelling execution!"
-                             .format(hook.description, required_arg))
-                logger.debug("Valid arguments are: {} ({})".format(dir(event), event))
-                return None
-        return parameters
-
-    def _execute_hook_threaded(self, hook, event):
+    def _execute_hook_threaded(self, hook, event, started=None):
         """
+        :param started: If given, the time the hook started running in its thread is appended to this list
         :type hook: Hook
         :type event: cloudbot.event.Event
+        :type started: list[float]
         """
-        event.prepare_threaded()
-
-        parameters = self._prepare_parameters(hook, event)
-        if parameters is None:
-            return None
+        if started is not None:
+            started.append(time.monotonic())
+        if not hook.needs_db:
+            return hook.function(*hook.binder(event))
 
         try:
-            return hook.function(*parameters)
+            event.prepare_threaded()
+            return hook.function(*hook.binder(event))
         finally:
             event.close_threaded()
 
@@ -347,39 +626,52 @@ class PluginManager:
         :type hook: Hook
         :type event: cloudbot.event.Event
         """
-        yield from event.prepare()
-
-        parameters = self._prepare_parameters(hook, event)
-        if parameters is None:
-            return None
+        if not hook.needs_db:
+            return (yield from hook.function(*hook.binder(event)))
 
         try:
-            return (yield from hook.function(*parameters))
+            yield from event.prepare()
+            return (yield from hook.function(*hook.binder(event)))
         finally:
             yield from event.close()
 
     @asyncio.coroutine
-    def _execute_hook(self, hook, event):
+    def _execute_hook(self, hook, event, abandoned=None):
         """
         Runs the specific hook with the given bot and event.
 
         Returns False if the hook errored, True otherwise.
 
+        :param abandoned: If given, and the hook's thread is abandoned after timing out, a future which is done once the
+                          thread returns is appended to this list
         :type hook: cloudbot.plugin.Hook
         :type event: cloudbot.event.Event
+        :type abandoned: list[asyncio.Future]
         :rtype: bool
         """
+        submitted = time.monotonic()
+        started = []
+        running = None
         try:
             # _internal_run_threaded and _internal_run_coroutine prepare the database, and run the hook.
             # _internal_run_* will prepare parameters and the database session, but won't do any error catching.
             if hook.threaded:
-                out = yield from self.bot.loop.run_in_executor(None, self._execute_hook_threaded, hook, event)
+                running = self._get_executor(hook.plugin).submit(self._execute_hook_threaded, hook, event, started)
+                out = yield from self._wait_hook(hook, asyncio.wrap_future(running, loop=self.bot.loop))
             else:
-                out = yield from self._execute_hook_sync(hook, event)
+                out = yield from self._wait_hook(hook, self._execute_hook_sync(hook, event))
+        except HookTimeoutError:
+            self._record_hook(hook, submitted, started, error=True)
+            if abandoned is not None and running is not None and not running.done():
+                abandoned.append(asyncio.wrap_future(running, loop=self.bot.loop))
+            return False
         except Exception:
+            self._record_hook(hook, submitted, started, error=True)
             logger.exception("Error in hook {}".format(hook.description))
             return False
 
+        self._record_hook(hook, submitted, started)
+
         if out is not None:
             if isinstance(out, (list, tuple)):
                 # if there are multiple items in the response, return them on multiple lines
@@ -388,6 +680,118 @@ class PluginManager:
                 event.reply(*str(out).split('\n'))
         return True
 
+    def _get_timeout(self, hook):
+        """
+        :type hook: Hook
+        :return: How long the hook can run for, or None if it can run forever
+        :rtype: float | None
+        """
+        if hook.timeout is not None:
+            return hook.timeout or None
+        if hook.type in ("on_start", "on_stop"):
+            # these run once, and may take a while to load or save their data
+            return None
+        return self.bot.config.get("hook_timeout", DEFAULT_HOOK_TIMEOUT) or None
+
+    def _get_executor(self, plugin):
+        """
+        :type plugin: Plugin
+        :rtype: HookExecutor
+        """
+        if plugin.executor is None:
+            plugin.executor = HookExecutor(self.bot.config.get("plugin_threads", DEFAULT_PLUGIN_THREADS))
+        return plugin.executor
+
+    def _shutdown_executor(self, plugin):
+        """
+        :type plugin: Plugin
+        """
+        if plugin.executor is not None:
+            plugin.executor.shutdown(wait=False)
+            plugin.executor = None
+
+    @asyncio.coroutine
+    def _wait_hook(self, hook, future):
+        """
+        Waits for a run of a hook, giving up on it once it takes longer than its timeout. Coroutine hooks are
+        cancelled, threads can't be, so the plugin's thread pool is replaced and the hung thread left behind. A
+        singlethread hook's next run still waits for the abandoned thread to return, see launch().
+
+        :type hook: Hook
+        :type future: asyncio.Future | collections.Iterable
+        :raises HookTimeoutError: If the hook timed out
+        """
+        timeout = self._get_timeout(hook)
+        if timeout is None:
+            return (yield from future)
+
+        future = asyncio.async(future, loop=self.bot.loop)
+        done, pending = yield from asyncio.wait([future], timeout=timeout, loop=self.bot.loop)
+        if not pending:
+            return future.result()
+
+        future.cancel()
+        self.metrics.count("timeouts", hook.description)
+        if hook.threaded:
+            self._get_executor(hook.plugin).replace()
+            logger.error("Hook {} timed out after {} seconds, abandoning its thread".format(hook.description, timeout))
+        else:
+            logger.error("Hook {} timed out after {} seconds, cancelled it".format(hook.description, timeout))
+        raise HookTimeoutError(hook.description)
+
+    def _record_hook(self, hook, submitted, started, error=False):
+        """
+        Records a run of a hook in the metrics
+
+        :param submitted: When the hook was submitted to run
+        :param started: The time the hook started running in its thread, if it was threaded and got that far
+        :type hook: Hook
+        :type submitted: float
+        :type started: list[float] | None
+        :type error: bool
+        """
+        finished = time.monotonic()
+        start = started[0] if started else submitted
+        self.metrics.record(hook.description, start - submitted, finished - start, error)
+
+    def _get_sieves(self, hook):
+        """
+        Returns the sieves which should be run before the given hook, in priority order
+
+        :type hook: cloudbot.plugin.Hook
+        :rtype: tuple[SieveHook]
+        """
+        try:
+            return self._sieve_chains[hook]
+        except KeyError:
+            pass
+
+        if hook.type in ("on_start", "on_stop", "periodic", "irc_cap"):  # we don't need sieves on on_start hooks.
+            sieves = ()
+        else:
+            sieves = tuple(sieve for sieve in self.sieves if sieve.applies_to(hook))
+        self._sieve_chains[hook] = sieves
+        return sieves
+
+    def _sieve_inline(self, sieve, event, hook):
+        """
+        Runs a sieve which is neither threaded nor a coroutine, directly in the event loop
+
+        :type sieve: SieveHook
+        :type event: cloudbot.event.Event
+        :type hook: cloudbot.plugin.Hook
+        :rtype: cloudbot.event.Event
+        """
+        submitted = time.monotonic()
+        try:
+            result = sieve.function(self.bot, event, hook)
+        except Exception:
+            self._record_hook(sieve, submitted, None, error=True)
+            logger.exception("Error running sieve {} on {}:".format(sieve.description, hook.description))
+            return None
+        self._record_hook(sieve, submitted, None)
+        return result
+
     @asyncio.coroutine
     def _sieve(self, sieve, event, hook):
         """
@@ -396,27 +800,44 @@ class PluginManager:
         :type hook: cloudbot.plugin.Hook
         :rtype: cloudbot.event.Event
         """
+        submitted = time.monotonic()
+        started = []
         try:
             if sieve.threaded:
-                result = yield from self.bot.loop.run_in_executor(None, sieve.function, self.bot, event, hook)
+                result = yield from self._wait_hook(sieve, self.bot.loop.run_in_executor(
+                    self._get_executor(sieve.plugin), self._run_sieve_threaded, sieve, event, hook, started))
             else:
-                result = yield from sieve.function(self.bot, event, hook)
+                result = yield from self._wait_hook(sieve, sieve.function(self.bot, event, hook))
+        except HookTimeoutError:
+            self._record_hook(sieve, submitted, started, error=True)
+            return None
         except Exception:
+            self._record_hook(sieve, submitted, started, error=True)
             logger.exception("Error running sieve {} on {}:".format(sieve.description, hook.description))
             return None
         else:
+            self._record_hook(sieve, submitted, started)
             return result
 
-    @asyncio.coroutine
-    def _start_periodic(self, hook):
-        interval = hook.interval
-        initial_interval = hook.initial_interval
-        yield from asyncio.sleep(initial_interval)
+    def _run_sieve_threaded(self, sieve, event, hook, started):
+        """
+        :type sieve: SieveHook
+        :type event: cloudbot.event.Event
+        :type hook: cloudbot.plugin.Hook
+        :type started: list[float]
+        :rtype: cloudbot.event.Event
+        """
+        started.append(time.monotonic())
+        return sieve.function(self.bot, event, hook)
 
-        while True:
-            event = Event(bot=self.bot, hook=hook)
-            yield from self.launch(hook, event)
-            yield from asyncio.sleep(interval)
+    def _run_periodic(self, hook):
+        """
+        Starts a run of a periodic hook, called by the scheduler when it's due
+
+        :type hook: PeriodicHook
+        :rtype: asyncio.Future
+        """
+        return asyncio.async(self.launch(hook, Event(bot=self.bot, hook=hook)), loop=self.bot.loop)
 
     @asyncio.coroutine
     def launch(self, hook, event):
@@ -430,11 +851,21 @@ class PluginManager:
         :rtype: bool
         """
 
-        if hook.type not in ("on_start", "periodic"):  # we don't need sieves on on_start hooks.
-            for sieve in self.bot.plugin_manager.sieves:
+        if hook.lazy:
+            # registered from the manifest, the plugin has to be imported first
+            hook = yield from self._resolve_lazy(hook)
+            if hook is None:
+                return False
+            event.hook = hook
+
+        for sieve in self._get_sieves(hook):
+            if sieve.inline:
+                event = self._sieve_inline(sieve, event, hook)
+            else:
                 event = yield from self._sieve(sieve, event, hook)
-                if event is None:
-                    return False
+            if event is None:
+                self.metrics.sieve_rejected(sieve.description)
+                return False
 
         if hook.type == "command" and hook.auto_help and not event.text and hook.doc is not None:
             event.notice_doc()
@@ -463,16 +894,14 @@ class PluginManager:
                 self._hook_waiting_queues[key] = None
 
             # Run the plugin with the message, and wait for it to finish
-            result = yield from self._execute_hook(hook, event)
+            abandoned = []
+            result = yield from self._execute_hook(hook, event, abandoned)
 
-            queue = self._hook_waiting_queues[key]
-            if queue is None or queue.empty():
-                # We're the last task in the queue, we can delete it now.
-                del self._hook_waiting_queues[key]
+            if abandoned:
+                # the hook timed out, but its thread is still running, so the next run has to wait for it to return
+                abandoned[0].add_done_callback(lambda _: self._next_single_thread(key))
             else:
-                # set the result for the next task's future, so they can execute
-                next_future = yield from queue.get()
-                next_future.set_result(None)
+                self._next_single_thread(key)
         else:
             # Run the plugin with the message, and wait for it to finish
             result = yield from self._execute_hook(hook, event)
@@ -480,6 +909,19 @@ class PluginManager:
         # Return the result
         return result
 
+    def _next_single_thread(self, key):
+        """
+        Starts the next waiting run of a singlethread hook, once the last one has finished
+        :type key: (str, str)
+        """
+        queue = self._hook_waiting_queues[key]
+        if queue is None or queue.empty():
+            # We're the last task in the queue, we can delete it now.
+            del self._hook_waiting_queues[key]
+        else:
+            # set the result for the next task's future, so they can execute
+            queue.get_nowait().set_result(None)
+
 
 class Plugin:
     """
@@ -493,7 +935,10 @@ class Plugin:
     :type raw_hooks: list[RawHook]
     :type sieves: list[SieveHook]
     :type events: list[EventHook]
+    :type cap_hooks: list[CapHook]
     :type tables: list[sqlalchemy.Table]
+    :type executor: HookExecutor
+    :type lazy: bool
     """
 
     def __init__(self, filepath, filename, title, code):
@@ -505,26 +950,14 @@ class Plugin:
         self.file_path = filepath
         self.file_name = filename
         self.title = title
-        self.commands, self.regexes, self.raw_hooks, self.sieves, self.events, self.periodic, self.run_on_start = find_hooks(self, code)
+        self.lazy = False
+        self.commands, self.regexes, self.raw_hooks, self.sieves, self.events, self.periodic, self.run_on_start, \
+            self.run_on_stop, self.cap_hooks = find_hooks(self, code)
         # we need to find tables for each plugin so that they can be unloaded from the global metadata when the
         # plugin is reloaded
         self.tables = find_tables(code)
-
-    @asyncio.coroutine
-    def create_tables(self, bot):
-        """
-        Creates all sqlalchemy Tables that are registered in this plugin
-
-        :type bot: cloudbot.bot.CloudBot
-        """
-        if self.tables:
-            # if there are any tables
-
-            logger.info("Registering tables for {}".format(self.title))
-
-            for table in self.tables:
-                if not (yield from bot.loop.run_in_executor(None, table.exists, bot.db_engine)):
-                    yield from bot.loop.run_in_executor(None, table.create, bot.db_engine)
+        # the thread pool this plugin's threaded hooks run in, created when one first runs
+        self.executor = None
 
     def unregister_tables(self, bot):
         """
@@ -539,6 +972,106 @@ class Plugin:
                 bot.db_metadata.remove(table)
 
 
+class LazyPlugin(Plugin):
+    """
+    A plugin registered from its manifest entry, which hasn't been imported yet. It only has commands and regexes,
+    which load the real plugin the first time they run.
+    """
+
+    def __init__(self, filepath, filename, title, entry):
+        """
+        :type filepath: str
+        :type filename: str
+        :type title: str
+        :type entry: dict
+        """
+        self.file_path = filepath
+        self.file_name = filename
+        self.title = title
+        self.lazy = True
+        self.commands = [LazyCommandHook(self, command) for command in entry["commands"]]
+        self.regexes = [LazyRegexHook(self, regex) for regex in entry["regexes"]]
+        self.raw_hooks = []
+        self.sieves = []
+        self.events = []
+        self.periodic = []
+        self.run_on_start = []
+        self.run_on_stop = []
+        self.cap_hooks = []
+        self.tables = []
+        self.executor = None
+
+
+class LazyHook:
+    """
+    Stands in for a hook of a plugin which hasn't been imported yet, with just enough of the hook to register it and
+    list it in help.
+
+    :type type: str
+    :type plugin: LazyPlugin
+    :type function_name: str
+    :type permissions: list[str]
+    """
+
+    def __init__(self, _type, plugin, entry):
+        """
+        :type _type: str
+        :type plugin: LazyPlugin
+        :type entry: dict
+        """
+        self.type = _type
+        self.plugin = plugin
+        self.lazy = True
+        self.function_name = entry["function"]
+        self.permissions = entry["permissions"]
+
+    @property
+    def description(self):
+        return "{}:{}".format(self.plugin.title, self.function_name)
+
+
+class LazyCommandHook(LazyHook):
+    """
+    :type name: str
+    :type aliases: list[str]
+    :type doc: str
+    :type auto_help: bool
+    """
+
+    def __init__(self, plugin, entry):
+        """
+        :type plugin: LazyPlugin
+        :type entry: dict
+        """
+        super().__init__("command", plugin, entry)
+        self.aliases = entry["aliases"]
+        self.name = self.aliases[0]
+        self.doc = entry["doc"]
+        self.auto_help = entry["auto_help"]
+
+    def __str__(self):
+        return "command {} from {} (imported on first use)".format("/".join(self.aliases), self.plugin.file_name)
+
+
+class LazyRegexHook(LazyHook):
+    """
+    :type regexes: set[re.__Regex]
+    :type run_on_cmd: bool
+    """
+
+    def __init__(self, plugin, entry):
+        """
+        :type plugin: LazyPlugin
+        :type entry: dict
+        """
+        super().__init__("regex", plugin, entry)
+        self.regexes = {re.compile(pattern, flags) for pattern, flags in entry["patterns"]}
+        self.run_on_cmd = entry["run_on_cmd"]
+
+    def __str__(self):
+        return "regex {} from {} (imported on first use)".format(self.function_name, self.plugin.file_name)
+
+
 class Hook:
     """
     Each hook is specific to one function. This class is never used by itself, rather extended.
@@ -548,9 +1081,13 @@ class Hook:
     :type function: callable
     :type function_name: str
     :type required_args: list[str]
+    :type binder: (cloudbot.event.Event) -> tuple
+    :type needs_db: bool
     :type threaded: bool
     :type permissions: list[str]
     :type single_thread: bool
+    :type timeout: float | None
+    :type lazy: bool
     """
 
     def __init__(self, _type, plugin, func_hook):
@@ -561,15 +1098,28 @@ class Hook:
         """
         self.type = _type
         self.plugin = plugin
+        self.lazy = False
         self.function = func_hook.function
         self.function_name = self.function.__name__
 
-        self.required_args = inspect.getargspec(self.function)[0]
-        if self.required_args is None:
-            self.required_args = []
-
+        parameters = inspect.signature(self.function).parameters.values()
         # don't process args starting with "_"
-        self.required_args = [arg for arg in self.required_args if not arg.startswith("_")]
+        self.required_args = [param.name for param in parameters
+                              if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD)
+                              and not param.name.startswith("_")]
+
+        if _type != "sieve":
+            # sieves are called with (bot, event, hook) positionally, every other hook gets its arguments by name
+            valid_args = _hook_name_to_event.get(_type, Event).valid_args()
+            invalid_args = [arg for arg in self.required_args if arg not in valid_args]
+            if invalid_args:
+                raise ValueError("Hook {} asked for invalid argument(s): {}".format(
+                    self.description, ", ".join(invalid_args)))
+
+        # fetches the arguments from an event, in order
+        self.binder = _compile_binder(self.required_args)
+        # the database session is only created for hooks which ask for it
+        self.needs_db = "db" in self.required_args
 
         if asyncio.iscoroutine(self.function) or asyncio.iscoroutinefunction(self.function):
             self.threaded = False
@@ -578,6 +1128,11 @@ class Hook:
 
         self.permissions = func_hook.kwargs.pop("permissions", [])
         self.single_thread = func_hook.kwargs.pop("singlethread", False)
+        # seconds the hook can run for, None to use the configured default, 0 for no limit
+        self.timeout = func_hook.kwargs.pop("timeout", None)
+        if self.timeout is not None and (not isinstance(self.timeout, (int, float)) or self.timeout < 0):
+            logger.warning("Ignoring invalid timeout {!r} from {}".format(self.timeout, self.description))
+            self.timeout = None
 
         if func_hook.kwargs:
             # we should have popped all the args, so warn if there are any left
@@ -650,6 +1205,10 @@ class RegexHook(Hook):
 class PeriodicHook(Hook):
     """
     :type interval: int
+    :type initial_interval: int
+    :type mode: str
+    :type jitter: float
+    :type skip_if_running: bool
     """
 
     def __init__(self, plugin, periodic_hook):
@@ -660,11 +1219,21 @@ class PeriodicHook(Hook):
 
         self.interval = periodic_hook.interval
         self.initial_interval = periodic_hook.kwargs.pop("initial_interval", self.interval)
+        # "rate" runs every interval seconds however long each run takes, "delay" waits interval seconds after each run
+        self.mode = periodic_hook.kwargs.pop("mode", FIXED_RATE)
+        if self.mode not in (FIXED_RATE, FIXED_DELAY):
+            logger.warning("Unknown mode {!r} on periodic hook {}, using {!r}".format(
+                self.mode, periodic_hook.function.__name__, FIXED_RATE))
+            self.mode = FIXED_RATE
+        # up to this many seconds are randomly added to each run's start, so hooks with the same interval spread out
+        self.jitter = periodic_hook.kwargs.pop("jitter", 0)
+        # whether a run is skipped if the last one is still running, rather than running both at once
+        self.skip_if_running = periodic_hook.kwargs.pop("skip_if_running", True)
 
         super().__init__("periodic", plugin, periodic_hook)
 
     def __repr__(self):
-        return "Periodic[interval: [{}], {}]".format(self.interval, Hook.__repr__(self))
+        return "Periodic[interval: [{}], mode: {}, {}]".format(self.interval, self.mode, Hook.__repr__(self))
 
     def __str__(self):
         return "periodic hook ({} seconds) {} from {}".format(self.interval, self.function_name, self.plugin.file_name)
@@ -694,7 +1263,35 @@ class RawHook(Hook):
         return "irc raw {} ({}) from {}".format(self.function_name, ",".join(self.triggers), self.plugin.file_name)
 
 
+class CapHook(Hook):
+    """
+    :type caps: set[str]
+    """
+
+    def __init__(self, plugin, cap_hook):
+        """
+        :type plugin: Plugin
+        :type cap_hook: cloudbot.util.hook._CapHook
+        """
+        super().__init__("irc_cap", plugin, cap_hook)
+
+        self.caps = cap_hook.caps
+
+    def __repr__(self):
+        return "Cap[caps: {}, {}]".format(list(self.caps), Hook.__repr__(self))
+
+    def __str__(self):
+        return "irc cap {} ({}) from {}".format(self.function_name, ",".join(self.caps), self.plugin.file_name)
+
+
 class SieveHook(Hook):
+    """
+    :type priority: int
+    :type types: frozenset[str] | None
+    :type plugins: frozenset[str] | None
+    :type inline: bool
+    """
+
     def __init__(self, plugin, sieve_hook):
         """
         :type plugin: Plugin
@@ -702,11 +1299,33 @@ class SieveHook(Hook):
         """
 
         self.priority = sieve_hook.kwargs.pop("priority", 100)
+        # the hook types and plugin titles this sieve applies to, None meaning all of them
+        self.types = _to_frozenset(sieve_hook.kwargs.pop("types", None))
+        self.plugins = _to_frozenset(sieve_hook.kwargs.pop("plugins", None))
+        threaded = sieve_hook.kwargs.pop("threaded", True)
         # We don't want to thread sieves by default - this is retaining old behavior for compatibility
         super().__init__("sieve", plugin, sieve_hook)
 
+        # non-coroutine sieves declared with threaded=False are called directly in the event loop
+        self.inline = self.threaded and not threaded
+        if self.inline:
+            self.threaded = False
+
+    def applies_to(self, hook):
+        """
+        :type hook: Hook
+        :rtype: bool
+        """
+        if self.types is not None and hook.type not in self.types:
+            return False
+        if self.plugins is not None and hook.plugin.title not in self.plugins:
+            return False
+        return True
+
     def __repr__(self):
-        return "Sieve[{}]".format(Hook.__repr__(self))
+        return "Sieve[types: {}, plugins: {}, inline: {}, {}]".format(
+            None if self.types is None else sorted(self.types),
+            None if self.plugins is None else sorted(self.plugins), self.inline, Hook.__repr__(self))
 
     def __str__(self):
         return "sieve {} from {}".format(self.function_name, self.plugin.file_name)
@@ -749,6 +1368,48 @@ class OnStartHook(Hook):
         return "on_start {} from {}".format(self.function_name, self.plugin.file_name)
 
 
+def _compile_binder(args):
+    """
+    Creates a function which returns a tuple of the given attributes of an object
+    :type args: list[str]
+    :rtype: (object) -> tuple
+    """
+    if not args:
+        return lambda event: ()
+    if len(args) == 1:
+        # attrgetter returns the value itself instead of a tuple when given one attribute
+        getter = operator.attrgetter(args[0])
+        return lambda event: (getter(event),)
+    return operator.attrgetter(*args)
+
+
+def _to_frozenset(param):
+    """
+    :type param: str | list[str] | None
+    :rtype: frozenset[str] | None
+    """
+    if param is None:
+        return None
+    if isinstance(param, str):
+        return frozenset([param])
+    return frozenset(param)
+
+
+class OnStopHook(Hook):
+    def __init__(self, plugin, on_stop_hook):
+        """
+        :type plugin: Plugin
+        :type on_stop_hook: cloudbot.util.hook._Hook
+        """
+        super().__init__("on_stop", plugin, on_stop_hook)
+
+    def __repr__(self):
+        return "On_stop[{}]".format(Hook.__repr__(self))
+
+    def __str__(self):
+        return "on_stop {} from {}".format(self.function_name, self.plugin.file_name)
+
+
 _hook_name_to_plugin = {
     "command": CommandHook,
     "regex": RegexHook,
@@ -756,5 +1417,14 @@ _hook_name_to_plugin = {
     "sieve": SieveHook,
     "event": EventHook,
     "periodic": PeriodicHook,
-    "on_start": OnStartHook
+    "on_start": OnStartHook,
+    "on_stop": OnStopHook,
+    "irc_cap": CapHook
+}
+
+# the event class each hook type is launched with, used to check the arguments hooks ask for. Defaults to Event
+_hook_name_to_event = {
+    "command": CommandEvent,
+    "regex": RegexEvent,
+    "irc_cap": CapEvent
 }
@@ -0,0 +1,479 @@
+"""
+supervisor.py
+
+Runs CloudBot sharded: one worker process for each connection, or for each configured group of connections. Every
+worker has its own event loop, executor and database engine, and loads the whole plugin set itself, so a busy network
+only slows down the workers it's on.
+
+The supervisor doesn't connect to anything. It watches the config and plugin files, restarts workers which die, and
+passes stop, restart and reload requests to every worker over a pipe to each one. Workers send their CPU use and event
+loop latency back over the same pipe.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+from watchdog.observers import Observer
+from watchdog.events import PatternMatchingEventHandler
+
+from cloudbot.reloader import PluginEventHandler
+from cloudbot.util.sharding import plan_shards, WorkerStats
+
+logger = logging.getLogger("cloudbot")
+
+# sent to workers
+STOP = "stop"
+RELOAD_CONFIG = "reload_config"
+RELOAD_PLUGIN = "reload_plugin"
+UNLOAD_PLUGIN = "unload_plugin"
+ALL_STATS = "all_stats"
+# sent by workers
+REQUEST_STOP = "request_stop"
+STATS = "stats"
+GET_STATS = "get_stats"
+
+# how often a worker checks how late its event loop is running callbacks
+LAG_PROBE_INTERVAL = 1.0
+# how long workers have to quit their networks and unload plugins before they're killed
+STOP_TIMEOUT = 30
+
+
+def sharding_enabled(path="config.json"):
+    """
+    Checks the config file for whether to run sharded, without loading the rest of the bot
+    :type path: str
+    :rtype: bool
+    """
+    if not os.path.exists(path):
+        # let Config report the missing file
+        return False
+    with open(path) as f:
+        return json.load(f).get("sharding", {}).get("enabled", False)
+
+
+class WorkerLink:
+    """
+    The worker end of the pipe to the supervisor, read from the worker's event loop.
+
+    :type bot: cloudbot.bot.CloudBot
+    :type index: int
+    :type stats_interval: float
+    :type stopping: bool
+    :type stats: WorkerStats
+    """
+
+    def __init__(self, bot, pipe, index, stats_interval=60):
+        """
+        :type bot: cloudbot.bot.CloudBot
+        :type pipe: multiprocessing.connection.Connection
+        :type index: int
+        :type stats_interval: float
+        """
+        self.bot = bot
+        self.index = index
+        self.stats_interval = stats_interval
+        # set once the supervisor has told this worker to stop, so CloudBot.stop() actually stops it
+        self.stopping = False
+        self.stats = WorkerStats()
+
+        self._pipe = pipe
+        self._stats_waiters = []
+        self._probe_handle = None
+        self._report_handle = None
+
+    def start(self):
+        loop = self.bot.loop
+        loop.add_reader(self._pipe.fileno(), self._receive)
+        self._schedule_probe()
+        self._report_handle = loop.call_later(self.stats_interval, self._report)
+
+    def stop(self):
+        if self._probe_handle is not None:
+            self._probe_handle.cancel()
+        if self._report_handle is not None:
+            self._report_handle.cancel()
+        self.bot.loop.remove_reader(self._pipe.fileno())
+        for waiter in self._stats_waiters:
+            waiter.cancel()
+        self._stats_waiters = []
+
+    def send(self, *message):
+        try:
+            self._pipe.send(message)
+        except (OSError, EOFError):
+            logger.warning("[worker {}] Couldn't reach the supervisor".format(self.index))
+
+    def request_stop(self, reason=None, restart=False):
+        """
+        Asks the supervisor to stop or restart every worker, including this one
+        :type reason: str
+        :type restart: bool
+        """
+        self.send(REQUEST_STOP, reason, restart)
+
+    @asyncio.coroutine
+    def get_stats(self, timeout=5):
+        """
+        Gets the last stats reported by every worker
+        :rtype: dict[int, dict]
+        """
+        waiter = asyncio.Future(loop=self.bot.loop)
+        self._stats_waiters.append(waiter)
+        self.send(GET_STATS)
+        return (yield from asyncio.wait_for(waiter, timeout, loop=self.bot.loop))
+
+    def _receive(self):
+        try:
+            while self._pipe.poll():
+                message = self._pipe.recv()
+                self._handle(message[0], *message[1:])
+        except (OSError, EOFError):
+            # the supervisor is gone, so nothing will tell us to stop
+            self.bot.loop.remove_reader(self._pipe.fileno())
+            if not self.stopping:
+                logger.error("[worker {}] Lost the supervisor, stopping.".format(self.index))
+                self._stop_bot("Supervisor exited")
+
+    def _handle(self, kind, *args):
+        if kind == STOP:
+            self._stop_bot(*args)
+        elif kind == RELOAD_CONFIG:
+            self.bot.config.load_config()
+        elif kind in (RELOAD_PLUGIN, UNLOAD_PLUGIN):
+            reloader = getattr(self.bot, "reloader", None)
+            if reloader is not None:
+                if kind == RELOAD_PLUGIN:
+                    reloader.reload(*args)
+                else:
+                    reloader.unload(*args)
+        elif kind == ALL_STATS:
+            waiters, self._stats_waiters = self._stats_waiters, []
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(*args)
+
+    def _stop_bot(self, reason=None):
+        if self.stopping:
+            return
+        self.stopping = True
+        asyncio.async(self.bot.stop(reason), loop=self.bot.loop)
+
+    def _schedule_probe(self):
+        loop = self.bot.loop
+        expected = loop.time() + LAG_PROBE_INTERVAL
+        self._probe_handle = loop.call_at(expected, self._probe, expected)
+
+    def _probe(self, expected):
+        self.stats.record_lag(self.bot.loop.time() - expected)
+        self._schedule_probe()
+
+    def _report(self):
+        stats = self.stats.report()
+        stats["pid"] = os.getpid()
+        self.send(STATS, stats)
+        self._report_handle = self.bot.loop.call_later(self.stats_interval, self._report)
+
+
+def _run_worker(index, names, pipe, stats_interval):
+    """
+    The entry point of a worker process
+    :type index: int
+    :type names: list[str]
+    :type pipe: multiprocessing.connection.Connection
+    :type stats_interval: float
+    """
+    # ^C is sent to the whole process group, but only the supervisor should act on it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the supervisor's own handler was copied too
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    from cloudbot.bot import CloudBot
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bot = CloudBot(loop, shard=names)
+    bot.shard_link = WorkerLink(bot, pipe, index, stats_interval)
+    bot.shard_link.start()
+    logger.info("[worker {}] Started for {}.".format(index, ", ".join(names)))
+    bot.run()
+
+
+class Worker:
+    """
+    The supervisor's view of one worker process.
+
+    :type index: int
+    :type names: list[str]
+    :type process: multiprocessing.Process | None
+    :type pipe: multiprocessing.connection.Connection | None
+    :type start_at: float | None
+    :type starts: int
+    :type stats: dict
+    """
+
+    def __init__(self, index, names):
+        self.index = index
+        self.names = names
+        self.process = None
+        self.pipe = None
+        # when to start the process again, if it isn't running
+        self.start_at = time.time()
+        self.starts = 0
+        self.stats = {}
+
+    @property
+    def alive(self):
+        return self.process is not None
+
+
+class Supervisor:
+    """
+    :type config: dict
+    :type workers: list[Worker]
+    :type restart_delay: float
+    :type stats_interval: float
+    :type stopping: bool
+    :type restart: bool
+    """
+
+    def __init__(self, config_path="config.json"):
+        """
+        :type config_path: str
+        """
+        from cloudbot.bot import clean_name
+
+        with open(config_path) as f:
+            self.config = json.load(f)
+        sharding = self.config.get("sharding", {})
+        names = [clean_name(conn['name']) for conn in self.config['connections']]
+        groups = [[clean_name(name) for name in group] for group in sharding.get("groups", [])]
+
+        self.workers = [Worker(index, shard) for index, shard in enumerate(plan_shards(names, groups))]
+        self.restart_delay = sharding.get("restart_delay", 10)
+        self.stats_interval = sharding.get("stats_interval", 60)
+
+        self.stopping = False
+        self.restart = False
+        self._stop_deadline = None
+        # messages from watchdog threads, sent from the main thread as pipes aren't thread safe
+        self._outgoing = deque()
+        self._signalled = None
+        self._observers = []
+        # workers are forked from a fork server, a fresh single-threaded process, rather than from the supervisor.
+        # The supervisor runs watchdog threads, and forking it could leave a worker holding a lock one of them held,
+        # like a logging handler's. Workers only get the pipe to the supervisor passed to them, not any others.
+        self._context = multiprocessing.get_context("forkserver")
+
+    def run(self):
+        """
+        Runs the workers until they've all stopped
+        :return: True if CloudBot should be restarted, False otherwise
+        :rtype: bool
+        """
+        handlers = {signum: signal.signal(signum, self._on_signal) for signum in (signal.SIGINT, signal.SIGTERM)}
+        logger.info("Running {} connections in {} workers.".format(
+            sum(len(worker.names) for worker in self.workers), len(self.workers)))
+
+        self._start_workers()
+        self._start_watchers()
+        try:
+            while not self.stopping or any(worker.alive for worker in self.workers):
+                self._step()
+        finally:
+            for observer in self._observers:
+                observer.stop()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        return self.restart
+
+    def stop(self, reason=None, restart=False):
+        """
+        Tells every worker to stop
+        :type reason: str
+        :type restart: bool
+        """
+        if self.stopping:
+            return
+        logger.info("Stopping all workers.")
+        self.stopping = True
+        self.restart = restart
+        self._stop_deadline = time.time() + STOP_TIMEOUT
+        self.broadcast(STOP, reason)
+
+    def broadcast(self, *message):
+        """
+        Sends a message to every running worker. Only call this from the main thread.
+        """
+        for worker in self.workers:
+            if worker.alive:
+                try:
+                    worker.pipe.send(message)
+                except (OSError, EOFError):
+                    # it's exiting, and will be noticed by _step()
+                    pass
+
+    def reload(self, path):
+        """
+        Called by the plugin file watcher, in its own thread
+        :type path: str
+        """
+        self._outgoing.append((RELOAD_PLUGIN, path))
+
+    def unload(self, path):
+        """
+        Called by the plugin file watcher, in its own thread
+        :type path: str
+        """
+        self._outgoing.append((UNLOAD_PLUGIN, path))
+
+    def reload_config(self):
+        """
+        Called by the config file watcher, in its own thread
+        """
+        self._outgoing.append((RELOAD_CONFIG,))
+
+    def _on_signal(self, signum, frame):
+        self._signalled = signum
+
+    def _start_watchers(self):
+        reloading = self.config.get("reloading", {})
+        if reloading.get("config_reloading", True):
+            observer = Observer()
+            observer.schedule(ConfigWatcher(self, patterns=["*config.json"]), path='.', recursive=False)
+            self._observers.append(observer)
+        if reloading.get("plugin_reloading", False):
+            observer = Observer()
+            observer.schedule(PluginEventHandler(self, patterns=["*.py"]), os.path.abspath("plugins"), recursive=False)
+            self._observers.append(observer)
+        for observer in self._observers:
+            observer.start()
+
+    def _start_workers(self):
+        now = time.time()
+        for worker in self.workers:
+            if not worker.alive and worker.start_at is not None and worker.start_at <= now:
+                self._start_worker(worker)
+
+    def _start_worker(self, worker):
+        """
+        :type worker: Worker
+        """
+        parent_end, child_end = self._context.Pipe()
+        worker.process = self._context.Process(target=_run_worker, name="cloudbot-worker-{}".format(worker.index),
+                                               args=(worker.index, worker.names, child_end, self.stats_interval))
+        worker.process.start()
+        child_end.close()
+        worker.pipe = parent_end
+        worker.start_at = None
+        worker.starts += 1
+        logger.debug("Started worker {} (pid {}) for {}.".format(worker.index, worker.process.pid,
+                                                                 ", ".join(worker.names)))
+
+    def _step(self):
+        alive = [worker for worker in self.workers if worker.alive]
+        waitables = {}
+        for worker in alive:
+            waitables[worker.pipe] = worker
+            waitables[worker.process.sentinel] = worker
+
+        for ready in wait(list(waitables), timeout=0.5):
+            worker = waitables[ready]
+            if not worker.alive:
+                # both the pipe and the sentinel were ready, and it was already cleaned up
+                continue
+            if ready is worker.pipe:
+                self._receive(worker)
+            else:
+                self._exited(worker)
+
+        while self._outgoing:
+            self.broadcast(*self._outgoing.popleft())
+
+        if self._signalled is not None:
+            signum, self._signalled = self._signalled, None
+            logger.warning("Supervisor received signal {}".format(signum))
+            self.stop("Killed (Received signal {})".format(signum))
+
+        if self.stopping:
+            if time.time() > self._stop_deadline:
+                for worker in self.workers:
+                    if worker.alive:
+                        logger.warning("Worker {} didn't stop in time, killing it.".format(worker.index))
+                        worker.process.terminate()
+                self._stop_deadline += STOP_TIMEOUT
+        else:
+            self._start_workers()
+
+    def _receive(self, worker):
+        """
+        :type worker: Worker
+        """
+        try:
+            while worker.pipe.poll():
+                message = worker.pipe.recv()
+                self._handle(worker, message[0], *message[1:])
+        except (OSError, EOFError):
+            # it's exiting, and its sentinel will be ready soon
+            pass
+
+    def _handle(self, worker, kind, *args):
+        if kind == REQUEST_STOP:
+            self.stop(*args)
+        elif kind == STATS:
+            worker.stats = args[0]
+            logger.debug("Worker {index}: cpu {cpu_percent:.1f}%, loop lag avg {avg_lag:.3f}s max {max_lag:.3f}s"
+                         .format(index=worker.index, **worker.stats))
+        elif kind == GET_STATS:
+            try:
+                worker.pipe.send((ALL_STATS, self.stats()))
+            except (OSError, EOFError):
+                pass
+
+    def _exited(self, worker):
+        """
+        :type worker: Worker
+        """
+        worker.process.join()
+        exit_code = worker.process.exitcode
+        worker.pipe.close()
+        worker.process = None
+        worker.pipe = None
+        if self.stopping:
+            logger.debug("Worker {} stopped.".format(worker.index))
+        else:
+            logger.error("Worker {} exited unexpectedly with code {}, restarting it in {} seconds.".format(
+                worker.index, exit_code, self.restart_delay))
+            worker.start_at = time.time() + self.restart_delay
+
+    def stats(self):
+        """
+        :return: The last stats reported by each worker
+        :rtype: dict[int, dict]
+        """
+        return {worker.index: dict(worker.stats, names=worker.names, alive=worker.alive, starts=worker.starts)
+                for worker in self.workers}
+
+
+class ConfigWatcher(PatternMatchingEventHandler):
+    """
+    :type supervisor: Supervisor
+    """
+
+    def __init__(self, supervisor, *args, **kwargs):
+        """
+        :type supervisor: Supervisor
+        """
+        self.supervisor = supervisor
+        PatternMatchingEventHandler.__init__(self, *args, **kwargs)
+
+    def on_any_event(self, event):
+        if not self.supervisor.stopping:
+            logger.info("Config changed, telling workers to reload.")
+            self.supervisor.reload_config()
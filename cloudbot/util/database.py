@@ -5,3 +5,57 @@ database - contains variables set by cloudbot to be easily access
 # this is assigned in the CloudBot so that its recreated when the bot restarts
 metadata = None
 base = None
+
+# queries plugins run often, by name, so .dbcheck can check the database has indexes for them
+queries = {}
+
+
+def index(table, *columns, name=None, unique=False):
+    """
+    Declares a secondary index on a plugin's table. It's created along with the table, or added to the table when the
+    bot starts if the table already exists.
+    :type table: sqlalchemy.Table
+    :param columns: The names of the indexed columns, in order
+    :type columns: str
+    :param name: The index's name, by default the table name and column names joined by underscores
+    :type name: str
+    :type unique: bool
+    :rtype: sqlalchemy.Index
+    """
+    from sqlalchemy import Index
+
+    if not columns:
+        raise ValueError("An index needs at least one column")
+    if name is None:
+        name = "{}_{}".format(table.name, "_".join(columns))
+    return Index(name, *[table.c[column] for column in columns], unique=unique)
+
+
+def register_query(name, query):
+    """
+    Registers a query a plugin runs often, so .dbcheck can check it doesn't read a whole table
+    :param name: Usually the plugin's name and the function running the query, eg. "tell.get_unread"
+    :type name: str
+    :param query: A sqlalchemy query, or SQL text with :named parameters
+    :type query: sqlalchemy.sql.expression.Executable | str
+    """
+    queries[name] = query
+
+
+def full_scans(plan):
+    """
+    :param plan: The detail of each step from SQLite's EXPLAIN QUERY PLAN
+    :type plan: list[str]
+    :return: The steps which read every row of a table, or every entry of an index
+    :rtype: list[str]
+    """
+    scans = []
+    for detail in plan:
+        words = detail.split()
+        if len(words) < 2 or words[0] != "SCAN":
+            continue
+        # subqueries and constant rows are scanned, but they're not tables
+        if words[1] in ("CONSTANT", "SUBQUERY") or words[1].startswith("("):
+            continue
+        scans.append(detail)
+    return scans
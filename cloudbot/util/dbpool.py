@@ -0,0 +1,111 @@
+"""
+dbpool.py
+
+A fixed pool of single-threaded executors, used to run database calls for coroutine hooks.
+
+A coroutine hook asking for `db` leases one worker for its whole run, so all of its `async()` calls run in the same
+thread. Leases are shared when there are more hooks than workers, so each hook opens its own session in the worker
+rather than using the thread's scoped session.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DatabaseWorker(ThreadPoolExecutor):
+    """
+    A single-threaded executor which records how long calls wait before they start.
+
+    :type index: int
+    :type leases: int
+    :type pending: int
+    :type completed: int
+    :type total_wait: float
+    :type max_wait: float
+    """
+
+    def __init__(self, index):
+        """
+        :type index: int
+        """
+        super().__init__(max_workers=1)
+        self.index = index
+        # number of hooks currently using this worker, only changed from the event loop
+        self.leases = 0
+
+        self._stats_lock = threading.Lock()
+        # calls which have been submitted, but haven't started yet
+        self.pending = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        with self._stats_lock:
+            self.pending += 1
+        return super().submit(self._run, time.monotonic(), fn, args, kwargs)
+
+    def _run(self, submitted, fn, args, kwargs):
+        wait = time.monotonic() - submitted
+        with self._stats_lock:
+            self.pending -= 1
+            self.completed += 1
+            self.total_wait += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+        return fn(*args, **kwargs)
+
+    def stats(self):
+        """
+        :rtype: dict[str, int | float]
+        """
+        with self._stats_lock:
+            return {
+                "worker": self.index,
+                "leases": self.leases,
+                "pending": self.pending,
+                "completed": self.completed,
+                "avg_wait": self.total_wait / self.completed if self.completed else 0.0,
+                "max_wait": self.max_wait
+            }
+
+
+class DatabasePool:
+    """
+    :type workers: list[DatabaseWorker]
+    """
+
+    def __init__(self, size):
+        """
+        :type size: int
+        """
+        if size < 1:
+            raise ValueError("Database pool needs at least one worker")
+        self.workers = [DatabaseWorker(i) for i in range(size)]
+
+    def acquire(self):
+        """
+        Leases the least busy worker. This is not thread safe, and should only be called from the event loop.
+        :rtype: DatabaseWorker
+        """
+        worker = min(self.workers, key=lambda w: (w.leases, w.pending))
+        worker.leases += 1
+        return worker
+
+    def release(self, worker):
+        """
+        Returns a worker leased with acquire(). This is not thread safe, and should only be called from the event loop.
+        :type worker: DatabaseWorker
+        """
+        worker.leases -= 1
+
+    def shutdown(self, wait=True):
+        for worker in self.workers:
+            worker.shutdown(wait=wait)
+
+    def stats(self):
+        """
+        :rtype: list[dict[str, int | float]]
+        """
+        return [worker.stats() for worker in self.workers]
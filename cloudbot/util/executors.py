@@ -0,0 +1,73 @@
+"""
+executors.py
+
+The thread pool a plugin's threaded hooks run in. A hook which hangs, eg. on a network call without a timeout, can't be
+stopped, so when one times out its plugin's pool is replaced by a new one and the hung thread is left to finish, or not,
+on its own. Threads which were still running when their pool was replaced are counted as stuck until they return.
+"""
+
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+
+class HookExecutor(Executor):
+    """
+    :type max_workers: int
+    :type replaced: int
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        :type max_workers: int
+        """
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers)
+        # each pool gets a new generation, calls are counted by the generation of the pool running them
+        self._generation = 0
+        self._active = {}
+        self.replaced = 0
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            generation = self._generation
+            self._active[generation] = self._active.get(generation, 0) + 1
+            return self._executor.submit(self._run, generation, fn, args, kwargs)
+
+    def _run(self, generation, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active[generation] -= 1
+                if not self._active[generation] and generation != self._generation:
+                    del self._active[generation]
+
+    def replace(self):
+        """
+        Moves on to a new pool, leaving any calls running in the old one to finish in their own time. Calls which were
+        submitted but haven't started yet still run in the old pool.
+        """
+        with self._lock:
+            old = self._executor
+            if not self._active.get(self._generation):
+                self._active.pop(self._generation, None)
+            self._generation += 1
+            self._executor = ThreadPoolExecutor(self.max_workers)
+            self.replaced += 1
+        old.shutdown(wait=False)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        """
+        :return: The number of calls running or queued in the current pool, and in replaced pools
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {
+                "active": self._active.get(self._generation, 0),
+                "stuck": sum(count for generation, count in self._active.items() if generation != self._generation),
+                "replaced": self.replaced
+            }
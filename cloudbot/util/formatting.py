@@ -57,6 +57,12 @@ from cloudbot.util.colors import strip_irc
 
 IRC_COLOR_RE = re.compile(r"(\x03(\d+,\d+|\d)|[\x0f\x02\x16\x1f])")
 
+# every formatting code, used to keep track of the formatting state when splitting a message
+IRC_FORMAT_CODE_RE = re.compile(r"\x03(?:(\d{1,2})(?:,(\d{1,2}))?)?|[\x02\x0f\x16\x1d\x1f]")
+# the longest formatting code, \x03NN,NN
+IRC_FORMAT_CODE_MAX = 6
+IRC_TOGGLE_CODES = "\x02\x1d\x1f\x16"
+
 REPLACEMENTS = {
     'a': 'ä',
     'b': 'Б',
@@ -238,6 +244,103 @@ def chunk_str(content, length=420):
     return list(chunk(content, length))
 
 
+def _format_state(text, state):
+    """
+    Updates a formatting state with the formatting codes in some text.
+    :param state: The active toggles (bold, italic, underline, reverse), and the active colour code or None
+    :type text: str
+    :type state: (frozenset[str], str | None)
+    :rtype: (frozenset[str], str | None)
+    """
+    toggles, colour = state
+    for match in IRC_FORMAT_CODE_RE.finditer(text):
+        code = match.group()
+        if code == "\x0f":
+            toggles, colour = frozenset(), None
+        elif code[0] == "\x03":
+            # a bare \x03 resets the colour. Colours are kept with two digits, so a digit after them when they're
+            # restored isn't read as part of the colour
+            foreground, background = match.groups()
+            if foreground is None:
+                colour = None
+            elif background is None:
+                colour = "\x03{:02d}".format(int(foreground))
+            else:
+                colour = "\x03{:02d},{:02d}".format(int(foreground), int(background))
+        else:
+            toggles = toggles ^ {code}
+    return toggles, colour
+
+
+def _restore_format(state):
+    """
+    :type state: (frozenset[str], str | None)
+    :rtype: str
+    """
+    toggles, colour = state
+    codes = "".join(code for code in IRC_TOGGLE_CODES if code in toggles)
+    if colour is not None:
+        codes += colour
+    return codes
+
+
+def chunk_bytes(content, max_bytes=420, encoding="utf-8"):
+    """
+    Chunks a string into smaller strings which are at most max_bytes long when encoded. Chunks are split on word
+    boundaries where possible, and never in the middle of a character or formatting code. Any bold, italic,
+    underline, reverse or colour formatting active at the end of a chunk is restored at the start of the next one.
+    An empty string gives one empty chunk.
+    :type content: str
+    :type max_bytes: int
+    :type encoding: str
+    :rtype: list[str]
+    """
+    if not content:
+        return [content]
+    chunks = []
+    state = (frozenset(), None)
+    prefix = ""
+    while content:
+        budget = max_bytes - len(prefix.encode(encoding))
+        if budget < max_bytes // 2:
+            # the restored formatting would take up most of the chunk, so go without it
+            prefix = ""
+            budget = max_bytes
+        encoded = content.encode(encoding)
+        if len(encoded) <= budget:
+            chunks.append(prefix + content)
+            break
+
+        # the number of characters which fit in the budget, without splitting a multibyte character
+        cut = len(encoded[:budget].decode(encoding, errors="ignore"))
+        # don't split a formatting code
+        code_start = content.rfind("\x03", max(cut - IRC_FORMAT_CODE_MAX, 0), cut)
+        if code_start != -1:
+            code = IRC_FORMAT_CODE_RE.match(content, code_start)
+            if code.end() > cut:
+                # if the code is at the start, it has to go in this chunk even if it doesn't fit
+                cut = code_start or code.end()
+        # prefer splitting on a space, if it doesn't waste more than half of the line
+        space = content.rfind(" ", 0, cut + 1)
+        if space > cut // 2:
+            chunk = content[:space]
+            content = content[space + 1:]
+        else:
+            if cut <= 0:
+                # the budget is too small for even one character, send it anyway rather than looping forever
+                cut = 1
+            chunk = content[:cut]
+            content = content[cut:]
+
+        chunks.append(prefix + chunk)
+        state = _format_state(chunk, state)
+        prefix = _restore_format(state)
+        if state[1] is not None and content[:1] == ",":
+            # a restored colour followed by a comma would be read as a background colour, so separate them
+            prefix += "\x02\x02"
+    return chunks
+
+
 def pluralize(num=0, text=''):
     """
     Takes a number and a string, and pluralizes that string using the number and combines the results.
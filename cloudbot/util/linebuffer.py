@@ -0,0 +1,108 @@
+"""
+linebuffer.py
+
+Splits a stream of bytes into lines, without copying the rest of the buffer for every line.
+
+Incoming data is appended to a bytearray, and complete lines are found with find() from a read offset. Consumed data
+is only removed from the front of the buffer once it makes up most of the buffer, so a burst of thousands of lines
+arriving in one read is split in linear time.
+"""
+
+# RFC 1459 allows 512 bytes including the line ending, and IRCv3 message tags allow another 8191 bytes before that
+DEFAULT_MAX_LINE_LENGTH = 8191 + 512
+
+# consumed bytes are removed once there are at least this many, or once they're over half of the buffer
+COMPACT_SIZE = 64 * 1024
+
+
+class LineBuffer:
+    """
+    :type max_line_length: int
+    :type dropped: int
+    :type _buffer: bytearray
+    :type _start: int
+    :type _scan: int
+    :type _discarding: bool
+    """
+
+    def __init__(self, max_line_length=DEFAULT_MAX_LINE_LENGTH):
+        """
+        :type max_line_length: int
+        """
+        self.max_line_length = max_line_length
+        # the number of lines thrown away for being longer than max_line_length
+        self.dropped = 0
+
+        self._buffer = bytearray()
+        # start of the first unread line
+        self._start = 0
+        # where to start looking for the next line ending, so a partial line isn't searched again on every read
+        self._scan = 0
+        # set while skipping the rest of a line which was already too long
+        self._discarding = False
+
+    def feed(self, data):
+        """
+        Adds data to the buffer and returns every complete line in it, without their line endings.
+        Lines may end with either "\\r\\n" or "\\n". Lines longer than max_line_length are dropped.
+        :type data: bytes
+        :rtype: list[bytes]
+        """
+        buffer = self._buffer
+        buffer += data
+        lines = []
+        start = self._start
+        scan = self._scan
+        max_line_length = self.max_line_length
+
+        while True:
+            end = buffer.find(b"\n", scan)
+            if end == -1:
+                break
+            line_end = end
+            if line_end > start and buffer[line_end - 1] == 0x0D:  # \r
+                line_end -= 1
+
+            if self._discarding:
+                self._discarding = False
+            elif line_end - start > max_line_length:
+                self.dropped += 1
+            else:
+                lines.append(bytes(buffer[start:line_end]))
+            start = scan = end + 1
+
+        if len(buffer) - start > max_line_length:
+            # the current line is already too long, so throw it away now rather than letting it grow
+            if not self._discarding:
+                self._discarding = True
+                self.dropped += 1
+            start = scan = len(buffer)
+        else:
+            scan = len(buffer)
+
+        if start == len(buffer):
+            buffer.clear()
+            start = scan = 0
+        elif start >= COMPACT_SIZE or start * 2 >= len(buffer):
+            del buffer[:start]
+            scan -= start
+            start = 0
+
+        self._start = start
+        self._scan = scan
+        return lines
+
+    def clear(self):
+        """
+        Throws away any partial line, eg. after reconnecting.
+        """
+        self._buffer.clear()
+        self._start = 0
+        self._scan = 0
+        self._discarding = False
+
+    def __len__(self):
+        """
+        :return: The number of unread bytes in the buffer
+        """
+        return len(self._buffer) - self._start
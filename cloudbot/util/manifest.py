@@ -0,0 +1,145 @@
+"""
+manifest.py
+
+A cache of what hooks each plugin file has, so plugins which only have commands and regexes can be registered at startup
+without importing them. Entries are keyed by the plugin's path, and only used while the file's modification time and
+size are unchanged.
+"""
+
+import json
+import os
+
+# entries written with another version are ignored
+MANIFEST_VERSION = 1
+
+# hook types which have to be registered by importing the plugin, rather than from its manifest entry
+EAGER_KEYS = ("raw", "events", "sieves", "periodic", "on_start", "on_stop", "caps", "tables")
+
+
+def build_entry(plugin):
+    """
+    Describes a loaded plugin's hooks
+    :type plugin: cloudbot.plugin.Plugin
+    :rtype: dict
+    """
+    return {
+        "commands": [{
+            "function": hook.function_name,
+            "aliases": list(hook.aliases),
+            "doc": hook.doc,
+            "permissions": list(hook.permissions),
+            "auto_help": hook.auto_help
+        } for hook in plugin.commands],
+        "regexes": [{
+            "function": hook.function_name,
+            "patterns": [[regex.pattern, regex.flags] for regex in hook.regexes],
+            "run_on_cmd": hook.run_on_cmd,
+            "permissions": list(hook.permissions)
+        } for hook in plugin.regexes],
+        "raw": sorted(trigger for hook in plugin.raw_hooks for trigger in hook.triggers),
+        "events": sorted(event_type.name for hook in plugin.events for event_type in hook.types),
+        "sieves": len(plugin.sieves),
+        "periodic": len(plugin.periodic),
+        "on_start": len(plugin.run_on_start),
+        "on_stop": len(plugin.run_on_stop),
+        "caps": sorted(cap for hook in plugin.cap_hooks for cap in hook.caps),
+        "tables": [table.name for table in plugin.tables]
+    }
+
+
+def is_lazy(entry):
+    """
+    :type entry: dict
+    :return: Whether the plugin can be registered from its entry, and imported the first time one of its hooks runs
+    :rtype: bool
+    """
+    if any(entry.get(key, True) for key in EAGER_KEYS):
+        return False
+    return bool(entry.get("commands") or entry.get("regexes"))
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class PluginManifest:
+    """
+    :type path: str
+    :type plugins: dict[str, dict]
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The file the manifest is kept in
+        :type path: str
+        """
+        self.path = path
+        self.plugins = {}
+        self.changed = False
+
+    def load(self):
+        """
+        Reads the manifest file, starting empty if it's missing, unreadable or from another version
+        """
+        self.plugins = {}
+        self.changed = False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            return
+        self.plugins = data.get("plugins", {})
+
+    def save(self):
+        """
+        Writes the manifest, if it changed since it was last read or written
+        """
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp = self.path + ".tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "plugins": self.plugins}, f, sort_keys=True)
+        os.replace(temp, self.path)
+        self.changed = False
+
+    def get(self, file_path):
+        """
+        :type file_path: str
+        :return: The entry for a plugin file, or None if there's none or the file has changed since it was made
+        :rtype: dict | None
+        """
+        entry = self.plugins.get(file_path)
+        if entry is None:
+            return None
+        stamp = _file_stamp(file_path)
+        if stamp is None or [entry.get("mtime"), entry.get("size")] != list(stamp):
+            return None
+        return entry
+
+    def update(self, file_path, entry):
+        """
+        Stores the entry for a plugin file, stamped with the file's current modification time and size
+        :type file_path: str
+        :type entry: dict
+        """
+        stamp = _file_stamp(file_path)
+        if stamp is None:
+            return
+        entry["mtime"], entry["size"] = stamp
+        if self.plugins.get(file_path) != entry:
+            self.plugins[file_path] = entry
+            self.changed = True
+
+    def remove(self, file_path):
+        """
+        :type file_path: str
+        """
+        if self.plugins.pop(file_path, None) is not None:
+            self.changed = True
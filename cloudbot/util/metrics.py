@@ -0,0 +1,256 @@
+"""
+metrics.py
+
+Counts and times hook runs. Every hook gets a call and error count, and histograms of how long it waited for a thread
+to run in and how long it ran. Histograms have fixed, logarithmically spaced buckets, so recording a time is a bisect
+and an increment, and percentiles are accurate to within a bucket's width (about 19%).
+
+The metrics can be dumped as plain text in the Prometheus exposition format, and served over HTTP.
+"""
+
+import asyncio
+import os
+from bisect import bisect_left
+
+# bucket bounds from 0.1ms to about 105s, four buckets for every doubling
+BUCKET_BOUNDS = tuple(0.0001 * 2 ** (i / 4) for i in range(81))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    :type counts: list[int]
+    :type count: int
+    :type sum: float
+    :type max: float
+    """
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        # one count for each bucket, and one for values past the last bound
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """
+        :type value: float
+        """
+        self.counts[bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        :param q: The quantile, from 0 to 1
+        :type q: float
+        :return: The upper bound of the bucket the quantile falls in, or the largest value seen if that's lower
+        :rtype: float
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index < len(BUCKET_BOUNDS):
+                    return min(BUCKET_BOUNDS[index], self.max)
+                break
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class HookStats:
+    """
+    :type calls: int
+    :type errors: int
+    :type queued: Histogram
+    :type run: Histogram
+    """
+    __slots__ = ("calls", "errors", "queued", "run")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        # how long threaded hooks waited for an executor thread, and how long hooks ran
+        self.queued = Histogram()
+        self.run = Histogram()
+
+    def record(self, queued, run, error=False):
+        """
+        :type queued: float
+        :type run: float
+        :type error: bool
+        """
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.queued.observe(queued)
+        self.run.observe(run)
+
+
+class Metrics:
+    """
+    :type hooks: dict[str, HookStats]
+    :type sieve_rejections: dict[str, int]
+    :type counters: dict[str, dict[str, int]]
+    """
+
+    def __init__(self):
+        self.hooks = {}
+        self.sieve_rejections = {}
+        # other counters, by name and then by the hook they were counted for
+        self.counters = {}
+
+    def hook(self, name):
+        """
+        :type name: str
+        :rtype: HookStats
+        """
+        try:
+            return self.hooks[name]
+        except KeyError:
+            stats = self.hooks[name] = HookStats()
+            return stats
+
+    def record(self, name, queued, run, error=False):
+        """
+        Records a run of a hook
+        :param name: The hook's description
+        :param queued: How long the hook waited before it started running, in seconds
+        :param run: How long the hook ran, in seconds
+        :param error: Whether the hook raised an exception
+        :type name: str
+        :type queued: float
+        :type run: float
+        :type error: bool
+        """
+        self.hook(name).record(queued, run, error)
+
+    def sieve_rejected(self, name):
+        """
+        Counts a sieve blocking an event
+        :type name: str
+        """
+        self.sieve_rejections[name] = self.sieve_rejections.get(name, 0) + 1
+
+    def count(self, counter, name):
+        """
+        Increments a counter for a hook
+        :type counter: str
+        :type name: str
+        """
+        counts = self.counters.setdefault(counter, {})
+        counts[name] = counts.get(name, 0) + 1
+
+    def clear(self):
+        self.hooks.clear()
+        self.sieve_rejections.clear()
+        self.counters.clear()
+
+    def dump(self):
+        """
+        :return: Every metric, in the Prometheus text exposition format
+        :rtype: str
+        """
+        lines = []
+        hooks = sorted(self.hooks.items())
+
+        lines.append("# TYPE cloudbot_hook_calls_total counter")
+        for name, stats in hooks:
+            lines.append('cloudbot_hook_calls_total{{hook="{}"}} {}'.format(_escape(name), stats.calls))
+        lines.append("# TYPE cloudbot_hook_errors_total counter")
+        for name, stats in hooks:
+            lines.append('cloudbot_hook_errors_total{{hook="{}"}} {}'.format(_escape(name), stats.errors))
+
+        for metric, attr in (("cloudbot_hook_queued_seconds", "queued"), ("cloudbot_hook_run_seconds", "run")):
+            lines.append("# TYPE {} summary".format(metric))
+            for name, stats in hooks:
+                histogram = getattr(stats, attr)
+                label = _escape(name)
+                for q in QUANTILES:
+                    lines.append('{}{{hook="{}",quantile="{}"}} {:.6f}'.format(metric, label, q, histogram.quantile(q)))
+                lines.append('{}_sum{{hook="{}"}} {:.6f}'.format(metric, label, histogram.sum))
+                lines.append('{}_count{{hook="{}"}} {}'.format(metric, label, histogram.count))
+
+        lines.append("# TYPE cloudbot_sieve_rejections_total counter")
+        for name, count in sorted(self.sieve_rejections.items()):
+            lines.append('cloudbot_sieve_rejections_total{{sieve="{}"}} {}'.format(_escape(name), count))
+
+        for counter, counts in sorted(self.counters.items()):
+            metric = "cloudbot_hook_{}_total".format(counter)
+            lines.append("# TYPE {} counter".format(metric))
+            for name, count in sorted(counts.items()):
+                lines.append('{}{{hook="{}"}} {}'.format(metric, _escape(name), count))
+
+        return "\n".join(lines) + "\n"
+
+
+def write_dump(path, dump):
+    """
+    Writes a dump to a file, replacing it in one step so readers never see half of it
+    :type path: str
+    :type dump: str
+    """
+    temp = path + ".tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(dump)
+    os.replace(temp, path)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsProtocol(asyncio.Protocol):
+    """
+    Answers every HTTP request with the metrics dump, then closes the connection. Create a server for it with
+    loop.create_server(lambda: MetricsProtocol(metrics), host, port).
+    """
+
+    # the most we read of a request before giving up on it
+    MAX_REQUEST = 8192
+
+    def __init__(self, metrics):
+        """
+        :type metrics: Metrics
+        """
+        self.metrics = metrics
+        self.transport = None
+        self.buffer = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if self.buffer is None:
+            # already answered
+            return
+        self.buffer += data
+        if b"\r\n\r\n" not in self.buffer and b"\n\n" not in self.buffer:
+            if len(self.buffer) > self.MAX_REQUEST:
+                self._respond("413 Request Entity Too Large", "")
+            return
+        request = self.buffer.split(b"\n", 1)[0].decode("latin-1").split()
+        if len(request) < 2 or request[0] not in ("GET", "HEAD"):
+            self._respond("405 Method Not Allowed", "")
+        elif request[1].split("?", 1)[0] not in ("/", "/metrics"):
+            self._respond("404 Not Found", "")
+        else:
+            self._respond("200 OK", self.metrics.dump(), head=request[0] == "HEAD")
+
+    def _respond(self, status, body, head=False):
+        body = body.encode("utf-8")
+        header = ("HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {}\r\n"
+                  "Connection: close\r\n\r\n".format(status, len(body))).encode("ascii")
+        self.buffer = None
+        self.transport.write(header if head else header + body)
+        self.transport.close()
@@ -0,0 +1,95 @@
+"""
+prefixindex.py
+
+A dict which keeps a sorted index of its keys, allowing prefix lookups without scanning every key.
+
+Used by the plugin manager to resolve partial command names, eg ".wea" to ".weather".
+"""
+
+import bisect
+
+
+class PrefixIndex(dict):
+    """
+    A dict with string keys which can efficiently find all keys starting with a given prefix.
+
+    Only item assignment, deletion, pop() and clear() keep the index up to date, so don't use update() or setdefault().
+
+    :type _keys: list[str]
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            bisect.insort(self._keys, key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super().pop(key, *default)
+
+    def clear(self):
+        super().clear()
+        self._keys = []
+
+    def _prefix_range(self, prefix):
+        """
+        :type prefix: str
+        :rtype: (int, int)
+        """
+        start = bisect.bisect_left(self._keys, prefix)
+        end = start
+        # the matching keys are contiguous in the sorted list, so just walk forward until one doesn't match
+        while end < len(self._keys) and self._keys[end].startswith(prefix):
+            end += 1
+        return start, end
+
+    def prefix_keys(self, prefix):
+        """
+        Returns all keys starting with the given prefix, in sorted order
+        :type prefix: str
+        :rtype: list[str]
+        """
+        start, end = self._prefix_range(prefix)
+        return self._keys[start:end]
+
+    def prefix_items(self, prefix):
+        """
+        Returns (key, value) for all keys starting with the given prefix, in sorted order
+        :type prefix: str
+        :rtype: list[(str, unknown)]
+        """
+        return [(key, self[key]) for key in self.prefix_keys(prefix)]
+
+    def lookup(self, prefix):
+        """
+        Resolves a key from either an exact match or a unique prefix.
+
+        Returns (key, value) if there was an exact match or only one key starting with the prefix, otherwise
+        returns None and the list of potential matching keys (which will be empty if nothing matched).
+
+        :type prefix: str
+        :rtype: ((str, unknown) | None, list[str])
+        """
+        if prefix in self:
+            return (prefix, self[prefix]), []
+
+        start = bisect.bisect_left(self._keys, prefix)
+        if start < len(self._keys) and self._keys[start].startswith(prefix):
+            # only check whether there is a second match before building the full list
+            if start + 1 >= len(self._keys) or not self._keys[start + 1].startswith(prefix):
+                key = self._keys[start]
+                return (key, self[key]), []
+            return None, self.prefix_keys(prefix)
+
+        return None, []
@@ -0,0 +1,168 @@
+"""
+regexset.py
+
+A set of regexes which can be matched against a line in one pass, by first checking for literal strings which each
+regex needs in order to match.
+
+Most regex hooks only ever match lines containing something like "youtu" or "http", so checking for those substrings
+is much cheaper than running every regex on every line.
+"""
+
+import re
+
+try:
+    # Python 3.11 renamed these modules
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+# characters which re.IGNORECASE matches against characters which aren't their lower() or upper() equivalent,
+# eg. "s" also matches "ſ". Literal runs are broken at these, so a prefilter never rejects a line that matches.
+_unsafe_ignorecase_chars = frozenset("iks")
+
+
+def _literal_runs(parsed, ignorecase):
+    """
+    Finds the sets of strings in a parsed regex, at least one of which is required for the regex to match.
+    :type parsed: sre_parse.SubPattern | list
+    :type ignorecase: bool
+    :rtype: list[frozenset[str]]
+    """
+    candidates = []
+    run = []
+
+    def end_run():
+        if run:
+            candidates.append(frozenset(["".join(run)]))
+            del run[:]
+
+    for op, av in parsed:
+        if op == sre_constants.LITERAL:
+            char = chr(av).lower()
+            if ignorecase and (char in _unsafe_ignorecase_chars or ord(char) > 127):
+                end_run()
+            else:
+                run.append(char)
+        elif op == sre_constants.AT:
+            # zero-width, so the literals on either side are still adjacent
+            continue
+        elif op == sre_constants.SUBPATTERN:
+            end_run()
+            # (group, add_flags, del_flags, pattern) on Python 3.6+, (group, pattern) before then
+            sub_ignorecase = ignorecase
+            if len(av) == 4:
+                sub_ignorecase = (ignorecase or av[1] & re.IGNORECASE) and not av[2] & re.IGNORECASE
+            best = _best_candidate(_literal_runs(av[-1], sub_ignorecase))
+            if best is not None:
+                candidates.append(best)
+        elif op == sre_constants.BRANCH:
+            end_run()
+            alternatives = set()
+            for branch in av[1]:
+                best = _best_candidate(_literal_runs(branch, ignorecase))
+                if best is None:
+                    # this branch could match without any literal, so the whole branch could
+                    alternatives = None
+                    break
+                alternatives.update(best)
+            if alternatives:
+                candidates.append(frozenset(alternatives))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            end_run()
+            min_count, max_count, item = av
+            if min_count >= 1:
+                best = _best_candidate(_literal_runs(item, ignorecase))
+                if best is not None:
+                    candidates.append(best)
+        else:
+            # anything else (character sets, lookarounds, group references...) matches something we can't predict
+            end_run()
+
+    end_run()
+    return candidates
+
+
+def _best_candidate(candidates):
+    """
+    Picks the most selective set of required strings: the one with the longest shortest-string, then the fewest strings
+    :type candidates: list[frozenset[str]]
+    :rtype: frozenset[str] | None
+    """
+    if not candidates:
+        return None
+    return max(candidates, key=lambda strings: (min(len(s) for s in strings), -len(strings)))
+
+
+def required_literals(regex):
+    """
+    Returns a set of lowercase strings, one of which must be in the lowercased text for the regex to match it,
+    or None if no such strings could be found.
+    :type regex: re.__Regex
+    :rtype: frozenset[str] | None
+    """
+    if not isinstance(regex.pattern, str):
+        return None
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return None
+    return _best_candidate(_literal_runs(parsed, bool(regex.flags & re.IGNORECASE)))
+
+
+class RegexSet:
+    """
+    An ordered collection of (regex, value) pairs, which can quickly find the regexes that may match a line.
+
+    :type _entries: list[(re.__Regex, unknown, frozenset[str] | None)]
+    :type _literals: dict[str, int]
+    """
+
+    def __init__(self):
+        self._entries = []
+        # the number of entries that require each literal
+        self._literals = {}
+
+    def add(self, regex, value):
+        """
+        :type regex: re.__Regex
+        """
+        literals = required_literals(regex) if hasattr(regex, "pattern") else None
+        self._entries.append((regex, value, literals))
+        if literals is not None:
+            for literal in literals:
+                self._literals[literal] = self._literals.get(literal, 0) + 1
+
+    def remove(self, regex, value):
+        """
+        :type regex: re.__Regex
+        """
+        for i, (_regex, _value, literals) in enumerate(self._entries):
+            if _regex == regex and _value == value:
+                del self._entries[i]
+                if literals is not None:
+                    for literal in literals:
+                        self._literals[literal] -= 1
+                        if not self._literals[literal]:
+                            del self._literals[literal]
+                return
+        raise ValueError("{!r} is not in the set".format((regex, value)))
+
+    def candidates(self, text):
+        """
+        Returns the (regex, value) pairs which could match the given text, in the order they were added.
+        Regexes which don't require any literal are always returned.
+        :type text: str
+        :rtype: list[(re.__Regex, unknown)]
+        """
+        lowered = text.lower()
+        present = {literal for literal in self._literals if literal in lowered}
+        return [(regex, value) for regex, value, literals in self._entries
+                if literals is None or not literals.isdisjoint(present)]
+
+    def __iter__(self):
+        return ((regex, value) for regex, value, literals in self._entries)
+
+    def __len__(self):
+        return len(self._entries)
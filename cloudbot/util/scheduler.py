@@ -0,0 +1,237 @@
+"""
+scheduler.py
+
+Runs periodic jobs from a single timer. Jobs are kept in a heap ordered by when they're next due, and one
+loop.call_at() handle is armed for the earliest of them, rather than every job sleeping in its own coroutine.
+
+Jobs run either at a fixed rate, where runs are due every interval seconds after the first no matter how long each takes,
+so they don't drift, or with a fixed delay, where the next run is due interval seconds after the last one finished.
+A fixed rate job which is still running when its next run is due overruns, and that run is skipped unless the job allows
+runs to overlap.
+"""
+
+import heapq
+import random
+
+FIXED_RATE = "rate"
+FIXED_DELAY = "delay"
+
+MODES = (FIXED_RATE, FIXED_DELAY)
+
+
+class PeriodicJob:
+    """
+    :type key: object
+    :type interval: float
+    :type mode: str
+    :type jitter: float
+    :type skip_if_running: bool
+    :type slot: float
+    :type due: float
+    :type running: int
+    :type cancelled: bool
+    :type runs: int
+    :type overruns: int
+    :type missed: int
+    :type last_duration: float | None
+    :type max_duration: float
+    :type total_duration: float
+    """
+    __slots__ = ("key", "interval", "mode", "jitter", "skip_if_running", "slot", "due", "running", "cancelled",
+                 "runs", "overruns", "missed", "last_duration", "max_duration", "total_duration")
+
+    def __init__(self, key, interval, mode=FIXED_RATE, jitter=0.0, skip_if_running=True):
+        if mode not in MODES:
+            raise ValueError("Unknown periodic mode {!r}, expected one of {}".format(mode, ", ".join(MODES)))
+        if interval <= 0:
+            raise ValueError("Periodic interval must be positive, not {!r}".format(interval))
+        self.key = key
+        self.interval = interval
+        self.mode = mode
+        self.jitter = max(jitter, 0.0)
+        self.skip_if_running = skip_if_running
+        # when the job is nominally due, without jitter, and when it's actually due
+        self.slot = 0.0
+        self.due = 0.0
+        self.running = 0
+        self.cancelled = False
+
+        self.runs = 0
+        # runs which came due while the last one was still running
+        self.overruns = 0
+        # fixed rate runs which were passed over because the event loop fell behind by more than an interval
+        self.missed = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+
+    def __repr__(self):
+        return "PeriodicJob({!r}, {}s {})".format(self.key, self.interval, self.mode)
+
+    def stats(self, now):
+        """
+        :type now: float
+        :rtype: dict[str, object]
+        """
+        finished = self.runs - self.running
+        return {
+            "key": self.key,
+            "interval": self.interval,
+            "mode": self.mode,
+            "running": self.running,
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "missed": self.missed,
+            "last_duration": self.last_duration,
+            "avg_duration": self.total_duration / finished if finished > 0 else None,
+            "max_duration": self.max_duration,
+            "next_in": max(self.due - now, 0.0) if self.due and not self.cancelled else None
+        }
+
+
+class PeriodicScheduler:
+    """
+    :type jobs: dict[object, PeriodicJob]
+    """
+
+    def __init__(self, loop, run, *, rand=random.random):
+        """
+        :param loop: The event loop the timer is armed on
+        :param run: Starts a run of a job, given its key, returning a future which is done once the run finishes
+        :param rand: Returns a random float in [0, 1), used for jitter
+        :type loop: asyncio.events.AbstractEventLoop
+        :type run: (object) -> asyncio.Future
+        :type rand: () -> float
+        """
+        self.loop = loop
+        self.run = run
+        self.rand = rand
+        self.jobs = {}
+        # (due, sequence, job), the sequence keeps jobs due at the same time in the order they were scheduled
+        self._heap = []
+        self._sequence = 0
+        self._handle = None
+        self._handle_when = None
+        self._ticking = False
+
+    def add(self, key, interval, *, initial_delay=None, mode=FIXED_RATE, jitter=0.0, skip_if_running=True):
+        """
+        Starts running a job periodically, replacing any job with the same key
+        :param initial_delay: How long until the first run, the interval by default
+        :type key: object
+        :type interval: float
+        :type initial_delay: float | None
+        :type mode: str
+        :type jitter: float
+        :type skip_if_running: bool
+        :rtype: PeriodicJob
+        """
+        self.cancel(key)
+        job = PeriodicJob(key, interval, mode, jitter, skip_if_running)
+        self.jobs[key] = job
+        self._schedule(job, self.loop.time() + (interval if initial_delay is None else initial_delay))
+        return job
+
+    def cancel(self, key):
+        """
+        Stops running a job. A run which has already started isn't interrupted, but the job won't run again.
+        :type key: object
+        :return: Whether there was a job to cancel
+        :rtype: bool
+        """
+        job = self.jobs.pop(key, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        self._arm()
+        return True
+
+    def cancel_all(self):
+        for key in list(self.jobs):
+            self.cancel(key)
+
+    def _schedule(self, job, slot):
+        job.slot = slot
+        job.due = slot + job.jitter * self.rand() if job.jitter else slot
+        self._sequence += 1
+        heapq.heappush(self._heap, (job.due, self._sequence, job))
+        self._arm()
+
+    def _arm(self):
+        if self._ticking:
+            # _tick() arms the timer once it's done
+            return
+        heap = self._heap
+        # cancelled jobs are left in the heap until they reach the top
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+            return
+        due = heap[0][0]
+        if self._handle is not None:
+            if self._handle_when == due:
+                return
+            self._handle.cancel()
+        self._handle_when = due
+        self._handle = self.loop.call_at(due, self._tick)
+
+    def _tick(self):
+        # the loop may run a timer slightly before it's due, so everything due by the armed time runs now
+        deadline = max(self.loop.time(), self._handle_when)
+        self._handle = None
+        heap = self._heap
+        self._ticking = True
+        try:
+            while heap and heap[0][0] <= deadline:
+                job = heapq.heappop(heap)[2]
+                if not job.cancelled:
+                    self._fire(job, deadline)
+        finally:
+            self._ticking = False
+        self._arm()
+
+    def _fire(self, job, now):
+        if job.running:
+            job.overruns += 1
+            if job.skip_if_running:
+                self._reschedule(job, now)
+                return
+
+        job.runs += 1
+        job.running += 1
+        started = self.loop.time()
+        self.run(job.key).add_done_callback(lambda future: self._finished(job, started))
+        self._reschedule(job, now)
+
+    def _reschedule(self, job, now):
+        if job.mode != FIXED_RATE:
+            # fixed delay jobs are rescheduled once they finish
+            return
+        slot = job.slot + job.interval
+        if slot <= now:
+            missed = int((now - slot) // job.interval) + 1
+            job.missed += missed
+            slot += missed * job.interval
+        self._schedule(job, slot)
+
+    def _finished(self, job, started):
+        now = self.loop.time()
+        duration = now - started
+        job.running -= 1
+        job.last_duration = duration
+        job.total_duration += duration
+        if duration > job.max_duration:
+            job.max_duration = duration
+        if job.mode == FIXED_DELAY and not job.cancelled and not job.running:
+            self._schedule(job, now + job.interval)
+
+    def stats(self):
+        """
+        :return: The stats of every job, in the order they're next due
+        :rtype: list[dict[str, object]]
+        """
+        now = self.loop.time()
+        return [job.stats(now) for job in sorted(self.jobs.values(), key=lambda job: job.due)]
@@ -0,0 +1,119 @@
+"""
+schema.py
+
+Brings the database up to date with the tables plugins declare. The database is reflected once, then every missing
+table, column and index is created in a single transaction, rather than checking and creating each table separately.
+
+Existing tables are only ever added to: columns which can't be added to an existing table, like primary keys and
+columns which can't be null, are reported rather than added, and nothing is dropped or changed.
+"""
+
+import time
+from collections import OrderedDict
+
+import sqlalchemy
+from sqlalchemy.schema import CreateColumn
+
+
+class SchemaChanges:
+    """
+    :type tables: list[str]
+    :type columns: list[str]
+    :type indexes: list[str]
+    :type unmigrated: list[str]
+    :type durations: dict[str, float]
+    """
+
+    def __init__(self):
+        self.tables = []
+        # "table.column"
+        self.columns = []
+        self.indexes = []
+        # "table.column" for each declared column which is missing, but couldn't be added
+        self.unmigrated = []
+        # how long checking and changing each table took, in seconds
+        self.durations = {}
+
+    def __bool__(self):
+        return bool(self.tables or self.columns or self.indexes)
+
+    def __str__(self):
+        parts = []
+        for name, changed in (("tables", self.tables), ("columns", self.columns), ("indexes", self.indexes)):
+            if changed:
+                parts.append("created {} {}: {}".format(len(changed), name, ", ".join(changed)))
+        return "; ".join(parts) or "no changes"
+
+
+def _unique_tables(tables):
+    """
+    :type tables: list[sqlalchemy.Table]
+    :rtype: list[sqlalchemy.Table]
+    """
+    unique = OrderedDict()
+    for table in tables:
+        unique.setdefault(table.key, table)
+    return list(unique.values())
+
+
+def _can_add(column):
+    """
+    :type column: sqlalchemy.Column
+    :return: Whether the column can be added to a table which already has rows
+    :rtype: bool
+    """
+    if column.primary_key:
+        return False
+    return column.nullable or column.server_default is not None
+
+
+def _add_column(connection, table, column):
+    """
+    :type connection: sqlalchemy.engine.Connection
+    :type table: sqlalchemy.Table
+    :type column: sqlalchemy.Column
+    """
+    preparer = connection.dialect.identifier_preparer
+    definition = CreateColumn(column).compile(dialect=connection.dialect)
+    connection.execute("ALTER TABLE {} ADD COLUMN {}".format(preparer.format_table(table), definition))
+
+
+def sync_schema(bind, tables):
+    """
+    Creates the tables, columns and indexes which are declared but missing from the database
+    :param bind: The engine to connect with
+    :type bind: sqlalchemy.engine.Engine
+    :type tables: list[sqlalchemy.Table]
+    :rtype: SchemaChanges
+    """
+    changes = SchemaChanges()
+    with bind.begin() as connection:
+        inspector = sqlalchemy.inspect(connection)
+        existing = set(inspector.get_table_names())
+
+        for table in _unique_tables(tables):
+            start = time.monotonic()
+            if table.name not in existing:
+                # creates the table's indexes along with it
+                table.create(connection)
+                existing.add(table.name)
+                changes.tables.append(table.name)
+            else:
+                columns = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in columns:
+                        continue
+                    name = "{}.{}".format(table.name, column.name)
+                    if _can_add(column):
+                        _add_column(connection, table, column)
+                        changes.columns.append(name)
+                    else:
+                        changes.unmigrated.append(name)
+
+                indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+                for index in sorted(table.indexes, key=lambda index: index.name):
+                    if index.name not in indexes:
+                        index.create(connection)
+                        changes.indexes.append(index.name)
+            changes.durations[table.name] = changes.durations.get(table.name, 0) + time.monotonic() - start
+    return changes
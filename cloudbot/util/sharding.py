@@ -0,0 +1,124 @@
+"""
+sharding.py
+
+Helpers for running connections in separate worker processes: deciding which connections share a worker, and
+measuring the CPU use and event loop latency of a worker so it can be reported to the supervisor.
+"""
+
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+def plan_shards(names, groups=()):
+    """
+    Splits connections between worker processes. Connections listed in the same group share a worker, and every other
+    connection gets a worker of its own. Unknown names, and names already in an earlier group, are ignored.
+    :param names: The names of every connection, in the order they're configured
+    :param groups: Lists of connection names which should share a worker
+    :type names: list[str]
+    :type groups: list[list[str]]
+    :rtype: list[list[str]]
+    """
+    known = set(names)
+    assigned = set()
+    shards = []
+    for group in groups:
+        shard = []
+        for name in group:
+            if name in known and name not in assigned:
+                assigned.add(name)
+                shard.append(name)
+        if shard:
+            shards.append(shard)
+    for name in names:
+        if name not in assigned:
+            assigned.add(name)
+            shards.append([name])
+    return shards
+
+
+def cpu_time():
+    """
+    :return: The user and system CPU time used by this process, in seconds
+    :rtype: float
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+
+def max_rss():
+    """
+    :return: The peak resident set size of this process in KiB, or 0 if it can't be found
+    :rtype: int
+    """
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class WorkerStats:
+    """
+    Collects the stats of one worker between two reports.
+
+    :type lag_samples: int
+    :type total_lag: float
+    :type max_lag: float
+    """
+
+    def __init__(self, clock=time.monotonic, cpu_clock=cpu_time):
+        """
+        :param clock: Returns the current time in seconds
+        :param cpu_clock: Returns the CPU time used so far in seconds
+        :type clock: () -> float
+        :type cpu_clock: () -> float
+        """
+        self._clock = clock
+        self._cpu_clock = cpu_clock
+        self._last_time = clock()
+        self._last_cpu = cpu_clock()
+
+        self.lag_samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def record_lag(self, lag):
+        """
+        Records how late a callback scheduled on the event loop ran
+        :type lag: float
+        """
+        lag = max(lag, 0.0)
+        self.lag_samples += 1
+        self.total_lag += lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+    def report(self):
+        """
+        Returns the stats since the last report, and starts collecting again
+        :rtype: dict[str, float | int]
+        """
+        now = self._clock()
+        cpu = self._cpu_clock()
+        elapsed = now - self._last_time
+        used = cpu - self._last_cpu
+
+        stats = {
+            "cpu_percent": used * 100 / elapsed if elapsed > 0 else 0.0,
+            "cpu_time": cpu,
+            "avg_lag": self.total_lag / self.lag_samples if self.lag_samples else 0.0,
+            "max_lag": self.max_lag,
+            "max_rss": max_rss()
+        }
+
+        self._last_time = now
+        self._last_cpu = cpu
+        self.lag_samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        return stats
@@ -0,0 +1,148 @@
+"""
+startup.py
+
+Timings of each step of loading every plugin - importing it, checking and creating its tables, and running its on_start
+hooks - so a slow start can be pinned on the plugins causing it. Imports run one at a time. Tables are checked and
+created in one batch for every plugin loaded together, with the time spent on each table counted against the plugin
+declaring it. The on_start hooks of different plugins overlap, so their times can include waiting on each other.
+"""
+
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+STAGES = ("import", "tables_check", "tables_create", "on_start")
+
+STAGE_NAMES = {
+    "import": "import",
+    "tables_check": "table checks",
+    "tables_create": "table creation",
+    "on_start": "on_start"
+}
+
+
+def current_rss():
+    """
+    :return: The memory this process is using in bytes, or the most it has used if that's all that can be found, or
+             None if neither can be
+    :rtype: int | None
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on OS X, kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PluginTimings:
+    """
+    :type stages: dict[str, float]
+    :type rss_delta: int | None
+    """
+
+    def __init__(self):
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        # how much the process grew while importing the plugin, including any modules it was the first to import
+        self.rss_delta = None
+
+    @property
+    def total(self):
+        """
+        :rtype: float
+        """
+        return sum(self.stages.values())
+
+
+class StartupProfile:
+    """
+    :type plugins: dict[str, PluginTimings]
+    :type load_time: float | None
+    """
+
+    def __init__(self):
+        self.plugins = {}
+        # how long loading every plugin took, set once they all have
+        self.load_time = None
+
+    def reset(self, name):
+        """
+        Forgets a plugin's timings, when it's loaded again
+        :type name: str
+        """
+        self.plugins.pop(name, None)
+
+    def record(self, name, stage, seconds):
+        """
+        Adds to the time spent in one step of loading a plugin
+        :type name: str
+        :type stage: str
+        :type seconds: float
+        """
+        if stage not in STAGES:
+            raise ValueError("Unknown startup stage: {}".format(stage))
+        self._timings(name).stages[stage] += seconds
+
+    def record_rss(self, name, before, after):
+        """
+        :type name: str
+        :type before: int | None
+        :type after: int | None
+        """
+        if before is not None and after is not None:
+            self._timings(name).rss_delta = after - before
+
+    def _timings(self, name):
+        timings = self.plugins.get(name)
+        if timings is None:
+            timings = self.plugins[name] = PluginTimings()
+        return timings
+
+    def slowest(self, limit=None):
+        """
+        :return: (name, timings) for each plugin, slowest first
+        :rtype: list[(str, PluginTimings)]
+        """
+        ordered = sorted(self.plugins.items(), key=lambda item: (-item[1].total, item[0]))
+        return ordered if limit is None else ordered[:limit]
+
+    def totals(self):
+        """
+        :return: The time spent in each step, added up over every plugin
+        :rtype: dict[str, float]
+        """
+        return {stage: sum(timings.stages[stage] for timings in self.plugins.values()) for stage in STAGES}
+
+    def report(self, limit=None):
+        """
+        :param limit: How many plugins to list, or None for all of them
+        :type limit: int | None
+        :return: A summary line, followed by a line for each plugin, slowest first
+        :rtype: list[str]
+        """
+        totals = self.totals()
+        summary = "{} plugins".format(len(self.plugins))
+        if self.load_time is not None:
+            summary += " loaded in {:.3f}s".format(self.load_time)
+        summary += ": " + ", ".join("{} {:.3f}s".format(STAGE_NAMES[stage], totals[stage]) for stage in STAGES)
+
+        lines = [summary]
+        for name, timings in self.slowest(limit):
+            stages = ", ".join("{} {:.3f}s".format(STAGE_NAMES[stage], timings.stages[stage]) for stage in STAGES
+                               if timings.stages[stage])
+            line = "{}: {:.3f}s".format(name, timings.total)
+            if stages:
+                line += " ({})".format(stages)
+            if timings.rss_delta is not None:
+                line += ", {:+.1f} MB".format(timings.rss_delta / (1024 * 1024))
+            lines.append(line)
+        return lines
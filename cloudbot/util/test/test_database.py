@@ -1,6 +1,35 @@
-from cloudbot.util.database import metadata, base
+import sqlite3
+
+from cloudbot.util.database import metadata, base, queries, full_scans, register_query
 
 
 def test_database():
     assert metadata is None
     assert base is None
+
+
+def test_full_scans():
+    assert full_scans(["SCAN TABLE karma", "SEARCH TABLE tells USING INDEX tells_connection_target_is_read (connection=? "
+                       "AND target=? AND is_read=?)", "USE TEMP B-TREE FOR ORDER BY"]) == ["SCAN TABLE karma"]
+    # newer versions of SQLite leave out "TABLE"
+    assert full_scans(["SCAN karma USING COVERING INDEX karma_chan", "SCAN CONSTANT ROW", "SCAN SUBQUERY 1",
+                       "SCAN (subquery-1)"]) == ["SCAN karma USING COVERING INDEX karma_chan"]
+
+
+def test_full_scans_sqlite():
+    db = sqlite3.connect(":memory:")
+    db.execute("create table karma(name, chan, thing, score INTEGER, primary key(name, chan, thing))")
+
+    def plan(sql):
+        return [row[-1] for row in db.execute("explain query plan " + sql, ("thing",))]
+
+    query = "select score from karma where thing = ?"
+    assert len(full_scans(plan(query))) == 1
+    db.execute("create index karma_thing_chan on karma(thing, chan)")
+    assert full_scans(plan(query)) == []
+
+
+def test_register_query():
+    register_query("karma.points", "select score from karma where thing = :thing")
+    assert queries["karma.points"] == "select score from karma where thing = :thing"
+    del queries["karma.points"]
@@ -0,0 +1,38 @@
+import threading
+
+from cloudbot.util.dbpool import DatabasePool
+
+
+def test_pool_acquire():
+    pool = DatabasePool(2)
+    try:
+        first = pool.acquire()
+        second = pool.acquire()
+        # the least busy worker is picked each time
+        assert first is not second
+        pool.release(first)
+        assert pool.acquire() is first
+        assert first.leases == 1
+        assert second.leases == 1
+    finally:
+        pool.shutdown()
+
+
+def test_worker_thread_affinity():
+    pool = DatabasePool(1)
+    try:
+        worker = pool.acquire()
+        thread_ids = {worker.submit(threading.get_ident).result() for _ in range(5)}
+        # every call on a worker runs in the same thread
+        assert len(thread_ids) == 1
+        assert threading.get_ident() not in thread_ids
+
+        assert worker.submit(lambda a, b=0: a + b, 1, b=2).result() == 3
+
+        stats = pool.stats()[0]
+        assert stats["completed"] == 6
+        assert stats["pending"] == 0
+        assert stats["leases"] == 1
+        assert stats["max_wait"] >= stats["avg_wait"] >= 0
+    finally:
+        pool.shutdown()
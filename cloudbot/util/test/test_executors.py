@@ -0,0 +1,39 @@
+import threading
+
+from cloudbot.util.executors import HookExecutor
+
+
+def test_submit():
+    executor = HookExecutor(2)
+    assert executor.submit(lambda x: x * 2, 21).result(timeout=5) == 42
+    assert executor.stats() == {"active": 0, "stuck": 0, "replaced": 0}
+    executor.shutdown()
+
+
+def test_replace_leaves_hung_calls():
+    executor = HookExecutor(1)
+    release = threading.Event()
+    hung = executor.submit(release.wait, 5)
+    assert executor.stats()["active"] == 1
+
+    # the only thread is hung, so nothing else could run until the pool is replaced
+    executor.replace()
+    assert executor.stats() == {"active": 0, "stuck": 1, "replaced": 1}
+    assert executor.submit(lambda: "ran").result(timeout=5) == "ran"
+
+    release.set()
+    assert hung.result(timeout=5) is True
+    assert executor.stats() == {"active": 0, "stuck": 0, "replaced": 1}
+    executor.shutdown()
+
+
+def test_errors_are_counted_done():
+    executor = HookExecutor(1)
+
+    def fail():
+        raise ValueError("oops")
+
+    future = executor.submit(fail)
+    assert isinstance(future.exception(timeout=5), ValueError)
+    assert executor.stats()["active"] == 0
+    executor.shutdown()
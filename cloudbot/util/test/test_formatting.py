@@ -1,5 +1,6 @@
 from cloudbot.util.formatting import munge, dict_format, pluralize, strip_colors, truncate, truncate_str, \
-    strip_html, multi_replace, multiword_replace, truncate_words, smart_split, get_text_list, ireplace, chunk_str
+    strip_html, multi_replace, multiword_replace, truncate_words, smart_split, get_text_list, ireplace, chunk_str, \
+    chunk_bytes
 
 test_munge_input = "The quick brown fox jumps over the lazy dog"
 test_munge_count = 3
@@ -43,6 +44,10 @@ test_ireplace_input = "The quick brown FOX fox FOX jumped over the lazy dog"
 test_chunk_str_input = "The quick brown fox jumped over the lazy dog"
 test_chunk_str_result = ['The quick', 'brown fox', 'jumped', 'over the', 'lazy dog']
 
+test_chunk_bytes_unicode_input = "Příliš žluťoučký kůň úpěl ďábelské ódy"
+test_chunk_bytes_format_input = "\x02bold \x034red text\x0f plain"
+test_chunk_bytes_format_result = ["\x02bold \x034red", "\x02\x0304text\x0f", "plain"]
+
 
 def test_munge():
     assert munge(test_munge_input) == test_munge_result_a
@@ -106,6 +111,28 @@ def test_chunk_str():
     assert chunk_str(test_chunk_str_input, 10) == test_chunk_str_result
 
 
+def test_chunk_bytes():
+    # the same as chunk_str for ascii
+    assert chunk_bytes(test_chunk_str_input, 10) == test_chunk_str_result
+    assert chunk_bytes("", 10) == [""]
+
+    chunks = chunk_bytes(test_chunk_bytes_unicode_input, 30)
+    assert chunks == ["Příliš žluťoučký kůň", "úpěl ďábelské ódy"]
+    assert all(len(chunk.encode("utf-8")) <= 30 for chunk in chunks)
+    assert " ".join(chunks) == test_chunk_bytes_unicode_input
+
+    # no spaces, so it has to split words, but never in the middle of a character
+    chunks = chunk_bytes("ééééé", 5)
+    assert chunks == ["éé", "éé", "é"]
+
+    # formatting is carried over to the next chunk
+    assert chunk_bytes(test_chunk_bytes_format_input, 12) == test_chunk_bytes_format_result
+
+    # formatting codes aren't split
+    assert chunk_bytes("abcdefghij\x0304,05xyz", 12) == ["abcdefghij", "\x0304,05xyz"]
+    assert chunk_bytes("abc\x0304,05defghijkl", 12) == ["abc\x0304,05def", "\x0304,05ghijkl"]
+
+
 def test_get_text_list():
     assert get_text_list(['a', 'b', 'c', 'd']) == 'a, b, c or d'
     assert get_text_list(['a', 'b', 'c'], 'and') == 'a, b and c'
@@ -0,0 +1,55 @@
+from cloudbot.util.linebuffer import LineBuffer
+
+
+def test_split_lines():
+    buffer = LineBuffer()
+    assert buffer.feed(b"PING :a\r\nPING :b\r\n") == [b"PING :a", b"PING :b"]
+    assert len(buffer) == 0
+    # bare \n endings are accepted too
+    assert buffer.feed(b"one\ntwo\r\n\n") == [b"one", b"two", b""]
+
+
+def test_partial_lines():
+    buffer = LineBuffer()
+    assert buffer.feed(b"PRIVMSG #chan :hel") == []
+    assert len(buffer) == 18
+    assert buffer.feed(b"lo\r") == []
+    assert buffer.feed(b"\nNOTICE") == [b"PRIVMSG #chan :hello"]
+    assert buffer.feed(b" x :y\r\n") == [b"NOTICE x :y"]
+
+    buffer.feed(b"partial")
+    buffer.clear()
+    assert buffer.feed(b"line\r\n") == [b"line"]
+
+
+def test_byte_at_a_time():
+    data = b"".join(b"line " + str(i).encode() + b"\r\n" for i in range(100))
+    buffer = LineBuffer()
+    lines = []
+    for i in range(len(data)):
+        lines.extend(buffer.feed(data[i:i + 1]))
+    assert lines == [b"line " + str(i).encode() for i in range(100)]
+
+
+def test_large_burst():
+    data = b"".join(b":server 353 bot = #chan :nick" + str(i).encode() + b"\r\n" for i in range(10000))
+    buffer = LineBuffer()
+    lines = []
+    for i in range(0, len(data), 4096):
+        lines.extend(buffer.feed(data[i:i + 4096]))
+    assert len(lines) == 10000
+    assert lines[-1] == b":server 353 bot = #chan :nick9999"
+    assert len(buffer) == 0
+
+
+def test_max_line_length():
+    buffer = LineBuffer(max_line_length=10)
+    assert buffer.feed(b"0123456789\r\n01234567890\r\nok\r\n") == [b"0123456789", b"ok"]
+    assert buffer.dropped == 1
+
+    # a line is thrown away as soon as it's too long, along with the rest of it when it arrives
+    assert buffer.feed(b"x" * 11) == []
+    assert len(buffer) == 0
+    assert buffer.feed(b"x" * 100) == []
+    assert buffer.feed(b"xxx\r\nafter\r\n") == [b"after"]
+    assert buffer.dropped == 2
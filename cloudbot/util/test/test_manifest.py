@@ -0,0 +1,118 @@
+import json
+import os
+import re
+from enum import Enum
+
+from cloudbot.util.manifest import PluginManifest, build_entry, is_lazy, MANIFEST_VERSION
+
+
+class EventType(Enum):
+    message = 0
+    join = 1
+
+
+class Hook:
+    def __init__(self, **kwargs):
+        self.permissions = []
+        self.__dict__.update(kwargs)
+
+
+class Table:
+    def __init__(self, name):
+        self.name = name
+
+
+class Plugin:
+    def __init__(self, **kwargs):
+        self.commands = []
+        self.regexes = []
+        self.raw_hooks = []
+        self.events = []
+        self.sieves = []
+        self.periodic = []
+        self.run_on_start = []
+        self.run_on_stop = []
+        self.cap_hooks = []
+        self.tables = []
+        self.__dict__.update(kwargs)
+
+
+def command_plugin():
+    return Plugin(
+        commands=[Hook(function_name="weather", aliases=["weather", "we"], doc="<location> - gets the weather",
+                       permissions=["weather"], auto_help=True)],
+        regexes=[Hook(function_name="youtube_url", regexes={re.compile("youtube\\.com/watch", re.I)}, run_on_cmd=False)])
+
+
+def test_build_entry():
+    entry = build_entry(command_plugin())
+    assert entry["commands"] == [{"function": "weather", "aliases": ["weather", "we"],
+                                  "doc": "<location> - gets the weather", "permissions": ["weather"],
+                                  "auto_help": True}]
+    assert entry["regexes"] == [{"function": "youtube_url", "patterns": [["youtube\\.com/watch", re.I | re.U]],
+                                 "run_on_cmd": False, "permissions": []}]
+    assert is_lazy(entry)
+    # entries survive being written as JSON
+    assert is_lazy(json.loads(json.dumps(entry)))
+
+
+def test_eager_plugins():
+    assert not is_lazy(build_entry(Plugin()))
+    assert not is_lazy(build_entry(Plugin(commands=command_plugin().commands, run_on_start=[Hook()])))
+    assert not is_lazy(build_entry(Plugin(commands=command_plugin().commands, tables=[Table("seen")])))
+    entry = build_entry(Plugin(events=[Hook(types={EventType.join, EventType.message})]))
+    assert entry["events"] == ["join", "message"]
+    assert not is_lazy(entry)
+    # entries missing a key are never lazy
+    assert not is_lazy({"commands": [{}]})
+
+
+def test_manifest_round_trip(tmpdir):
+    plugin_file = tmpdir.join("weather.py")
+    plugin_file.write("# weather plugin")
+    path = str(plugin_file)
+    manifest = PluginManifest(str(tmpdir.join("data", ".plugin_manifest.json")))
+    manifest.load()
+    assert manifest.get(path) is None
+
+    manifest.update(path, build_entry(command_plugin()))
+    assert manifest.changed
+    manifest.save()
+    assert not manifest.changed
+
+    loaded = PluginManifest(manifest.path)
+    loaded.load()
+    assert loaded.get(path)["commands"][0]["aliases"] == ["weather", "we"]
+
+    # the same entry again doesn't need saving
+    loaded.update(path, build_entry(command_plugin()))
+    assert not loaded.changed
+
+
+def test_manifest_stale(tmpdir):
+    plugin_file = tmpdir.join("weather.py")
+    plugin_file.write("# weather plugin")
+    path = str(plugin_file)
+    manifest = PluginManifest(str(tmpdir.join(".plugin_manifest.json")))
+    manifest.update(path, build_entry(command_plugin()))
+
+    plugin_file.write("# weather plugin, changed")
+    assert manifest.get(path) is None
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert manifest.get(path) is None
+
+    manifest.remove(path)
+    assert path not in manifest.plugins
+
+
+def test_manifest_other_version(tmpdir):
+    path = tmpdir.join(".plugin_manifest.json")
+    path.write(json.dumps({"version": MANIFEST_VERSION + 1, "plugins": {"x.py": {}}}))
+    manifest = PluginManifest(str(path))
+    manifest.load()
+    assert manifest.plugins == {}
+
+    path.write("not json")
+    manifest.load()
+    assert manifest.plugins == {}
@@ -0,0 +1,101 @@
+from cloudbot.util.metrics import Histogram, Metrics, MetricsProtocol, write_dump
+
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for i in range(1, 101):
+        histogram.observe(i / 1000)
+    assert histogram.count == 100
+    assert histogram.max == 0.1
+    assert abs(histogram.mean - 0.0505) < 1e-9
+    # percentiles are within a bucket of the real value
+    assert 0.050 <= histogram.quantile(0.5) <= 0.050 * 1.19
+    assert 0.095 <= histogram.quantile(0.95) <= 0.1
+    assert 0.099 <= histogram.quantile(0.99) <= 0.1
+
+
+def test_histogram_edges():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) == 0.0
+    histogram.observe(0)
+    histogram.observe(500)
+    assert histogram.quantile(0.5) == 0.0001
+    assert histogram.quantile(1) == 500
+
+
+def test_record():
+    metrics = Metrics()
+    metrics.record("plugin:hook", 0.01, 0.5)
+    metrics.record("plugin:hook", 0.02, 0.25, error=True)
+    stats = metrics.hooks["plugin:hook"]
+    assert stats.calls == 2
+    assert stats.errors == 1
+    assert stats.queued.count == 2
+    assert abs(stats.run.sum - 0.75) < 1e-9
+
+
+def test_dump():
+    metrics = Metrics()
+    metrics.record("plugin:hook", 0.0, 0.5)
+    metrics.sieve_rejected("ignore:ignore_sieve")
+    metrics.sieve_rejected("ignore:ignore_sieve")
+    metrics.count("timeouts", "plugin:hook")
+    dump = metrics.dump()
+    assert 'cloudbot_hook_calls_total{hook="plugin:hook"} 1\n' in dump
+    assert 'cloudbot_hook_errors_total{hook="plugin:hook"} 0\n' in dump
+    assert 'cloudbot_hook_run_seconds_count{hook="plugin:hook"} 1\n' in dump
+    assert 'cloudbot_hook_run_seconds{hook="plugin:hook",quantile="0.99"} 0.500000\n' in dump
+    assert 'cloudbot_sieve_rejections_total{sieve="ignore:ignore_sieve"} 2\n' in dump
+    assert 'cloudbot_hook_timeouts_total{hook="plugin:hook"} 1\n' in dump
+
+
+def test_dump_escapes():
+    metrics = Metrics()
+    metrics.record('odd"name', 0, 0)
+    assert 'hook="odd\\"name"' in metrics.dump()
+
+
+def test_write(tmpdir):
+    metrics = Metrics()
+    metrics.record("plugin:hook", 0, 0)
+    path = str(tmpdir.join("metrics.txt"))
+    write_dump(path, metrics.dump())
+    with open(path) as f:
+        assert f.read() == metrics.dump()
+
+
+class Transport:
+    def __init__(self):
+        self.written = b""
+        self.closed = False
+
+    def write(self, data):
+        self.written += data
+
+    def close(self):
+        self.closed = True
+
+
+def request(data):
+    metrics = Metrics()
+    metrics.record("plugin:hook", 0, 0)
+    protocol = MetricsProtocol(metrics)
+    transport = Transport()
+    protocol.connection_made(transport)
+    for chunk in data:
+        protocol.data_received(chunk)
+    return transport
+
+
+def test_http():
+    transport = request([b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n", b"\r\n"])
+    assert transport.closed
+    header, body = transport.written.split(b"\r\n\r\n", 1)
+    assert header.startswith(b"HTTP/1.0 200 OK")
+    assert b"cloudbot_hook_calls_total" in body
+
+
+def test_http_errors():
+    assert request([b"GET /other HTTP/1.1\r\n\r\n"]).written.startswith(b"HTTP/1.0 404")
+    assert request([b"POST / HTTP/1.1\r\n\r\n"]).written.startswith(b"HTTP/1.0 405")
+    assert not request([b"GET / HTTP/1.1\r\n"]).closed
@@ -0,0 +1,42 @@
+from cloudbot.util.prefixindex import PrefixIndex
+
+
+def test_prefix_index():
+    index = PrefixIndex()
+    index["weather"] = 1
+    index["wea"] = 2
+    index["wiki"] = 3
+    index["google"] = 4
+
+    assert index.prefix_keys("w") == ["wea", "weather", "wiki"]
+    assert index.prefix_keys("we") == ["wea", "weather"]
+    assert index.prefix_keys("x") == []
+    assert index.prefix_items("g") == [("google", 4)]
+
+    del index["wea"]
+    assert index.prefix_keys("we") == ["weather"]
+    assert index.pop("wiki") == 3
+    assert index.pop("wiki", None) is None
+    assert index.prefix_keys("w") == ["weather"]
+
+    # overwriting a key shouldn't duplicate it in the index
+    index["google"] = 5
+    assert index.prefix_items("g") == [("google", 5)]
+
+    index.clear()
+    assert index.prefix_keys("") == []
+
+
+def test_prefix_lookup():
+    index = PrefixIndex()
+    index["weather"] = 1
+    index["wea"] = 2
+    index["wiki"] = 3
+
+    # exact matches win, even if they're a prefix of another key
+    assert index.lookup("wea") == (("wea", 2), [])
+    assert index.lookup("wi") == (("wiki", 3), [])
+    assert index.lookup("weat") == (("weather", 1), [])
+    assert index.lookup("w") == (None, ["wea", "weather", "wiki"])
+    assert index.lookup("x") == (None, [])
+    assert index.lookup("wikipedia") == (None, [])
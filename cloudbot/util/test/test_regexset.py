@@ -0,0 +1,71 @@
+import re
+
+from cloudbot.util.regexset import RegexSet, required_literals
+
+
+def test_required_literals():
+    assert required_literals(re.compile(r'vimeo.com/([0-9]+)')) == {"vimeo"}
+    assert required_literals(re.compile(r'^.*\+\+$')) == {"++"}
+    assert required_literals(re.compile(r'(?:foo|bar)\d+')) == {"foo", "bar"}
+    assert required_literals(re.compile(r'(?:www\.)?youtube')) == {"youtube"}
+    # required because it's repeated at least once
+    assert required_literals(re.compile(r'(?:abc)+\d')) == {"abc"}
+    # case is ignored, the text is lowercased before it's checked
+    assert required_literals(re.compile(r'HTTP://', re.I)) == {"http://"}
+    assert required_literals(re.compile(r'HTTP://')) == {"http://"}
+
+
+def test_required_literals_none():
+    assert required_literals(re.compile(r'.*')) is None
+    assert required_literals(re.compile(r'[a-z]+\d')) is None
+    # one of the alternatives doesn't need a literal
+    assert required_literals(re.compile(r'(?:foo|\d+)x?')) is None
+    # optional
+    assert required_literals(re.compile(r'(?:foo)?\d')) is None
+
+
+def test_required_literals_ignorecase():
+    # with re.IGNORECASE, "s" matches "ſ", so "s" can't be part of a required literal
+    regex = re.compile(r'soundcloud', re.I)
+    assert required_literals(regex) == {"oundcloud"}
+    assert regex.search("ſoundcloud")
+
+
+def test_regex_set():
+    youtube = re.compile(r'youtu\.?be')
+    karma = re.compile(r'^(\w+)\+\+$')
+    anything = re.compile(r'\w+')
+
+    regexes = RegexSet()
+    regexes.add(youtube, "youtube")
+    regexes.add(karma, "karma")
+    regexes.add(anything, "anything")
+    assert len(regexes) == 3
+    assert list(regexes) == [(youtube, "youtube"), (karma, "karma"), (anything, "anything")]
+
+    assert regexes.candidates("hello there") == [(anything, "anything")]
+    assert regexes.candidates("look at YOUTUBE") == [(youtube, "youtube"), (anything, "anything")]
+    assert regexes.candidates("cloudbot++") == [(karma, "karma"), (anything, "anything")]
+
+    regexes.remove(karma, "karma")
+    assert regexes.candidates("cloudbot++") == [(anything, "anything")]
+    assert len(regexes) == 2
+
+
+def test_regex_set_no_false_negatives():
+    patterns = [r'(?:youtube.*?(?:v=|/v/)|youtu\.be/|yooouuutuuube.*?id=)([-_a-zA-Z0-9]+)',
+                r"(?:(?:www.twitter.com|twitter.com)/(?:[-_a-zA-Z0-9]+)/status/)([0-9]+)",
+                r'.*(((www\.)?reddit\.com/r|redd\.it)[^ ]+)',
+                r'(.*:)//(www.)?(soundcloud.com|snd.sc)(.*)']
+    lines = ["https://www.YouTube.com/watch?v=dQw4w9WgXcQ", "http://youtu.be/dQw4w9WgXcQ",
+             "twitter.com/cloudbot/status/1234", "see REDD.IT/abcd", "https://snd.sc/abc", "nothing here"]
+
+    regexes = RegexSet()
+    for pattern in patterns:
+        regexes.add(re.compile(pattern, re.I), pattern)
+
+    for line in lines:
+        candidates = {value for regex, value in regexes.candidates(line)}
+        for regex, value in regexes:
+            if regex.search(line):
+                assert value in candidates
@@ -0,0 +1,203 @@
+import pytest
+
+from cloudbot.util.scheduler import PeriodicScheduler, FIXED_RATE, FIXED_DELAY
+
+
+class MockHandle:
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class MockLoop:
+    def __init__(self):
+        self.now = 0.0
+        self.handles = []
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback):
+        handle = MockHandle(when, callback)
+        self.handles.append(handle)
+        return handle
+
+    def advance(self, seconds):
+        end = self.now + seconds
+        while True:
+            pending = [handle for handle in self.handles if not handle.cancelled and handle.when <= end]
+            if not pending:
+                break
+            handle = min(pending, key=lambda handle: handle.when)
+            self.handles.remove(handle)
+            self.now = max(self.now, handle.when)
+            handle.callback()
+        self.now = end
+
+    def armed(self):
+        return [handle for handle in self.handles if not handle.cancelled]
+
+
+class MockFuture:
+    def __init__(self, key):
+        self.key = key
+        self.done = False
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def finish(self):
+        self.done = True
+        for callback in self.callbacks:
+            callback(self)
+
+
+def make_scheduler(finish=True):
+    loop = MockLoop()
+    started = []
+
+    def run(key):
+        future = MockFuture(key)
+        started.append((loop.now, future))
+        if finish:
+            future.finish()
+        return future
+
+    return loop, PeriodicScheduler(loop, run, rand=lambda: 0.5), started
+
+
+def test_fixed_rate():
+    loop, scheduler, started = make_scheduler()
+    scheduler.add("job", 10, initial_delay=1)
+    loop.advance(35)
+    assert [when for when, _ in started] == [1, 11, 21, 31]
+    assert scheduler.jobs["job"].runs == 4
+
+
+def test_single_timer():
+    loop, scheduler, started = make_scheduler()
+    for i in range(50):
+        scheduler.add(i, 1 + i)
+    assert len(loop.armed()) == 1
+    loop.advance(100)
+    assert len(loop.armed()) == 1
+    assert len(started) == sum(100 // (1 + i) for i in range(50))
+
+
+def test_fixed_rate_skips_overruns():
+    loop, scheduler, started = make_scheduler(finish=False)
+    job = scheduler.add("job", 1, initial_delay=1)
+    loop.advance(1)
+    assert len(started) == 1
+    loop.advance(2.5)
+    # still running, so the runs due at 2 and 3 are skipped
+    assert len(started) == 1
+    assert job.overruns == 2
+
+    started[0][1].finish()
+    assert job.last_duration == 2.5
+    loop.advance(1)
+    # back on the original schedule
+    assert [when for when, _ in started] == [1, 4]
+
+
+def test_fixed_rate_overlap():
+    loop, scheduler, started = make_scheduler(finish=False)
+    job = scheduler.add("job", 1, skip_if_running=False)
+    loop.advance(3)
+    assert len(started) == 3
+    assert job.running == 3
+    assert job.overruns == 2
+
+
+def test_fixed_rate_missed():
+    loop, scheduler, started = make_scheduler()
+    job = scheduler.add("job", 1)
+    handle = loop.armed()[0]
+    # the event loop was blocked for a while
+    loop.handles.remove(handle)
+    loop.now = 4.5
+    handle.callback()
+    assert len(started) == 1
+    assert job.missed == 3
+    loop.advance(1)
+    assert [when for when, _ in started] == [4.5, 5]
+
+
+def test_fixed_delay():
+    loop, scheduler, started = make_scheduler(finish=False)
+    job = scheduler.add("job", 10, initial_delay=1, mode=FIXED_DELAY)
+    loop.advance(5)
+    assert len(started) == 1
+    loop.advance(20)
+    # not rescheduled until it finishes
+    assert len(started) == 1
+    assert job.overruns == 0
+
+    started[0][1].finish()
+    loop.advance(10)
+    assert [when for when, _ in started] == [1, 35]
+
+
+def test_jitter():
+    loop, scheduler, started = make_scheduler()
+    scheduler.add("job", 10, jitter=2, mode=FIXED_RATE)
+    loop.advance(30)
+    # jitter delays each run without moving the runs after it
+    assert [when for when, _ in started] == [11, 21]
+
+
+def test_cancel():
+    loop, scheduler, started = make_scheduler(finish=False)
+    job = scheduler.add("job", 1)
+    scheduler.add("other", 5)
+    loop.advance(1)
+    assert scheduler.cancel("job")
+    assert not scheduler.cancel("job")
+    assert job.cancelled
+    # the running run can still finish, but nothing is started again
+    started[0][1].finish()
+    loop.advance(4)
+    assert [future.key for _, future in started] == ["job", "other"]
+
+    scheduler.cancel_all()
+    assert scheduler.jobs == {}
+    assert loop.armed() == []
+
+
+def test_add_replaces():
+    loop, scheduler, started = make_scheduler()
+    scheduler.add("job", 1)
+    scheduler.add("job", 2)
+    loop.advance(4)
+    assert len(started) == 2
+
+
+def test_bad_args():
+    loop, scheduler, started = make_scheduler()
+    with pytest.raises(ValueError):
+        scheduler.add("job", 1, mode="sometimes")
+    with pytest.raises(ValueError):
+        scheduler.add("job", 0)
+
+
+def test_stats():
+    loop, scheduler, started = make_scheduler(finish=False)
+    scheduler.add("job", 2)
+    loop.advance(2)
+    loop.now = 3.5
+    started[0][1].finish()
+    stats = scheduler.stats()[0]
+    assert stats["key"] == "job"
+    assert stats["runs"] == 1
+    assert stats["last_duration"] == 1.5
+    assert stats["avg_duration"] == 1.5
+    assert stats["next_in"] == 0.5
@@ -0,0 +1,83 @@
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import Table, Column, String, Integer, Index, MetaData, PrimaryKeyConstraint, create_engine
+
+from cloudbot.util import database
+from cloudbot.util.schema import sync_schema
+
+
+def karma_table(metadata, *extra):
+    return Table(
+        "karma",
+        metadata,
+        Column("name", String),
+        Column("chan", String),
+        Column("thing", String),
+        Column("score", Integer),
+        PrimaryKeyConstraint("name", "chan", "thing"),
+        *extra
+    )
+
+
+def test_create():
+    engine = create_engine("sqlite://")
+    metadata = MetaData()
+    karma = karma_table(metadata, Index("karma_thing", "thing"))
+    herald = Table("herald", metadata, Column("name", String, primary_key=True), Column("quote", String))
+
+    changes = sync_schema(engine, [karma, herald, karma])
+    assert changes.tables == ["karma", "herald"]
+    assert changes.indexes == []
+    assert set(changes.durations) == {"karma", "herald"}
+    inspector = sqlalchemy.inspect(engine)
+    assert set(inspector.get_table_names()) == {"karma", "herald"}
+    assert [index["name"] for index in inspector.get_indexes("karma")] == ["karma_thing"]
+
+    # everything exists now
+    assert not sync_schema(engine, [karma, herald])
+    assert str(sync_schema(engine, [karma, herald])) == "no changes"
+
+
+def test_migrate_existing():
+    engine = create_engine("sqlite://")
+    # an old table, made with raw sql
+    engine.execute("create table karma(name, chan, thing, score INTEGER, primary key(name, chan, thing))")
+    engine.execute("insert into karma values ('nick', '#chan', 'thing', 2)")
+
+    metadata = MetaData()
+    karma = karma_table(metadata, Column("note", String), Column("required", String, nullable=False),
+                        Index("karma_thing", "thing"))
+    changes = sync_schema(engine, [karma])
+    assert changes.tables == []
+    assert changes.columns == ["karma.note"]
+    assert changes.indexes == ["karma_thing"]
+    assert changes.unmigrated == ["karma.required"]
+    assert str(changes) == "created 1 columns: karma.note; created 1 indexes: karma_thing"
+
+    # the old rows are still there
+    assert engine.execute("select thing, score, note from karma").fetchall() == [("thing", 2, None)]
+
+
+def test_declared_index():
+    engine = create_engine("sqlite://")
+    engine.execute("create table karma(name, chan, thing, score INTEGER, primary key(name, chan, thing))")
+    metadata = MetaData()
+    karma = karma_table(metadata)
+    index = database.index(karma, "thing", "chan")
+    assert index.name == "karma_thing_chan"
+    assert index in karma.indexes
+    assert database.index(karma, "chan", name="karma_by_chan", unique=True).unique
+
+    changes = sync_schema(engine, [karma])
+    assert changes.indexes == ["karma_by_chan", "karma_thing_chan"]
+    # older versions of sqlalchemy can't read the plan's rows, so it's read with the DBAPI cursor
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("explain query plan select score from karma where thing = 'x'")
+        plan = [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+    assert database.full_scans(plan) == []
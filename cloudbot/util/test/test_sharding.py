@@ -0,0 +1,58 @@
+from cloudbot.util.sharding import plan_shards, WorkerStats
+
+
+def test_plan_shards_one_per_connection():
+    assert plan_shards(["esper", "snoonet", "freenode"]) == [["esper"], ["snoonet"], ["freenode"]]
+
+
+def test_plan_shards_groups():
+    shards = plan_shards(["esper", "snoonet", "freenode", "rizon"], [["snoonet", "rizon"]])
+    assert shards == [["snoonet", "rizon"], ["esper"], ["freenode"]]
+
+
+def test_plan_shards_ignores_unknown_and_repeated():
+    shards = plan_shards(["esper", "snoonet"], [["esper", "missing", "esper"], ["esper"], ["missing"]])
+    assert shards == [["esper"], ["snoonet"]]
+
+
+def test_plan_shards_empty():
+    assert plan_shards([]) == []
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_worker_stats():
+    clock = FakeClock()
+    cpu = FakeClock()
+    stats = WorkerStats(clock, cpu)
+
+    clock.now = 10.0
+    cpu.now = 2.5
+    stats.record_lag(0.1)
+    stats.record_lag(0.3)
+    stats.record_lag(-0.01)  # ran early
+    report = stats.report()
+    assert report["cpu_percent"] == 25.0
+    assert report["cpu_time"] == 2.5
+    assert abs(report["avg_lag"] - 0.4 / 3) < 1e-9
+    assert report["max_lag"] == 0.3
+
+    # each report only covers the time since the last one
+    clock.now = 20.0
+    cpu.now = 3.5
+    report = stats.report()
+    assert report["cpu_percent"] == 10.0
+    assert report["avg_lag"] == 0.0
+    assert report["max_lag"] == 0.0
+
+
+def test_worker_stats_no_time_passed():
+    clock = FakeClock()
+    stats = WorkerStats(clock, clock)
+    assert stats.report()["cpu_percent"] == 0.0
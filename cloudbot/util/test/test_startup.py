@@ -0,0 +1,44 @@
+import pytest
+
+from cloudbot.util.startup import StartupProfile, current_rss
+
+
+def test_report_order():
+    profile = StartupProfile()
+    profile.record("fast.py", "import", 0.01)
+    profile.record("slow.py", "import", 0.5)
+    profile.record("slow.py", "on_start", 1.0)
+    profile.record("tables.py", "tables_check", 0.1)
+    profile.record("tables.py", "tables_check", 0.1)
+    profile.record("tables.py", "tables_create", 0.3)
+    profile.record_rss("slow.py", 10 * 1024 * 1024, 22 * 1024 * 1024)
+    profile.load_time = 2.0
+
+    assert [name for name, timings in profile.slowest()] == ["slow.py", "tables.py", "fast.py"]
+    report = profile.report()
+    assert report[0] == ("3 plugins loaded in 2.000s: import 0.510s, table checks 0.200s, table creation 0.300s, "
+                         "on_start 1.000s")
+    assert report[1] == "slow.py: 1.500s (import 0.500s, on_start 1.000s), +12.0 MB"
+    assert report[2] == "tables.py: 0.500s (table checks 0.200s, table creation 0.300s)"
+    assert len(profile.report(limit=1)) == 2
+
+
+def test_reset():
+    profile = StartupProfile()
+    profile.record("plugin.py", "import", 1.0)
+    profile.reset("plugin.py")
+    profile.record("plugin.py", "import", 0.25)
+    assert profile.plugins["plugin.py"].total == 0.25
+    # a missing measurement isn't recorded
+    profile.record_rss("plugin.py", None, 100)
+    assert profile.plugins["plugin.py"].rss_delta is None
+
+
+def test_unknown_stage():
+    with pytest.raises(ValueError):
+        StartupProfile().record("plugin.py", "compile", 1.0)
+
+
+def test_current_rss():
+    rss = current_rss()
+    assert rss is None or rss > 0
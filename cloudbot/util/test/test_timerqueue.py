@@ -0,0 +1,172 @@
+import random
+
+from cloudbot.util.timerqueue import TimerQueue
+
+
+class MockHandle:
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class MockLoop:
+    """
+    An event loop whose monotonic time and wall clock move together
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.handles = []
+
+    def time(self):
+        return self.now
+
+    def clock(self):
+        return self.now
+
+    def call_at(self, when, callback):
+        handle = MockHandle(when, callback)
+        self.handles.append(handle)
+        return handle
+
+    def armed(self):
+        self.handles = [handle for handle in self.handles if not handle.cancelled]
+        return self.handles
+
+    def advance(self, seconds):
+        end = self.now + seconds
+        while True:
+            pending = [handle for handle in self.armed() if handle.when <= end]
+            if not pending:
+                break
+            handle = min(pending, key=lambda handle: handle.when)
+            self.handles.remove(handle)
+            self.now = max(self.now, handle.when)
+            handle.callback()
+        self.now = end
+
+
+def make_queue(**kwargs):
+    loop = MockLoop()
+    fired = []
+    queue = TimerQueue(loop, lambda key, item: fired.append((loop.now, key, item)), clock=loop.clock, **kwargs)
+    return loop, queue, fired
+
+
+def test_fires_on_time():
+    loop, queue, fired = make_queue()
+    queue.add("b", 1020, "second")
+    queue.add("a", 1010, "first")
+    assert len(loop.armed()) == 1
+    loop.advance(30)
+    assert fired == [(1010, "a", "first"), (1020, "b", "second")]
+    assert len(queue) == 0
+    assert loop.armed() == []
+
+
+def test_past_due_fires_immediately():
+    loop, queue, fired = make_queue()
+    queue.add("late", 900, "item")
+    loop.advance(0)
+    assert fired == [(1000, "late", "item")]
+
+
+def test_remove():
+    loop, queue, fired = make_queue()
+    queue.add("a", 1010, "first")
+    queue.add("b", 1020, "second")
+    assert queue.remove("a") == "first"
+    assert queue.remove("a") is None
+    # the timer moves to the next item
+    assert [handle.when for handle in loop.armed()] == [1020]
+    loop.advance(30)
+    assert [key for _, key, _ in fired] == ["b"]
+
+
+def test_replace():
+    loop, queue, fired = make_queue()
+    queue.add("a", 1010, "old", group="user")
+    queue.add("a", 1020, "new", group="user")
+    assert queue.count("user") == 1
+    loop.advance(30)
+    assert fired == [(1020, "a", "new")]
+
+
+def test_groups():
+    loop, queue, fired = make_queue()
+    for i in range(5):
+        queue.add(("user", i), 1010 + i, i, group="user")
+    queue.add("other", 1012, "other", group="other")
+    assert queue.count("user") == 5
+    assert queue.count("nobody") == 0
+
+    queue.remove(("user", 0))
+    assert queue.count("user") == 4
+    assert queue.remove_group("user") == 4
+    assert queue.count("user") == 0
+    assert len(queue) == 1
+    loop.advance(30)
+    assert [key for _, key, _ in fired] == ["other"]
+
+
+def test_max_wait():
+    loop, queue, fired = make_queue(max_wait=60)
+    queue.add("a", 1200, "item")
+    assert [handle.when for handle in loop.armed()] == [1060]
+    loop.advance(60)
+    assert fired == []
+    loop.advance(140)
+    assert fired == [(1200, "a", "item")]
+
+
+def test_clock_change():
+    loop, queue, fired = make_queue(max_wait=60)
+    queue.add("a", 1100, "item")
+    # the wall clock is set back, so the item is due later than the timer was armed for
+    offset = -30
+    queue.clock = lambda: loop.now + offset
+    loop.advance(100)
+    assert fired == []
+    loop.advance(30)
+    assert [key for _, key, _ in fired] == ["a"]
+
+
+def test_close():
+    loop, queue, fired = make_queue()
+    queue.add("a", 1010, "item")
+    queue.close()
+    assert loop.armed() == []
+    queue.add("b", 1005, "item")
+    loop.advance(30)
+    assert fired == []
+
+
+def test_many_reminders():
+    loop, queue, fired = make_queue()
+    rand = random.Random(19)
+    due = {}
+    for i in range(100000):
+        key = ("network", "user{}".format(i % 1000), i)
+        due[key] = 1000 + rand.uniform(60, 86400)
+        queue.add(key, due[key], i, group=key[:2])
+    assert len(queue) == 100000
+    assert queue.count(("network", "user7")) == 100
+    assert len(loop.armed()) == 1
+
+    for i in range(0, 100000, 2):
+        queue.remove(("network", "user{}".format(i % 1000), i))
+    assert queue.remove_group(("network", "user1")) == 100
+    assert len(queue) == 49900
+    # removed entries don't pile up in the heap
+    assert len(queue._heap) <= 2 * len(queue) + 64
+
+    loop.advance(86400)
+    assert len(fired) == 49900
+    assert len(queue) == 0
+    times = [when for when, _, _ in fired]
+    assert times == sorted(times)
+    assert all(abs(when - due[key]) < 1e-6 for when, key, _ in fired)
@@ -0,0 +1,196 @@
+"""
+timerqueue.py
+
+Fires items at wall clock times, such as reminders. Items are kept in a min-heap ordered by when they're due, and a
+single loop.call_at() handle is armed for the earliest, so each item fires when it's due rather than on the next poll.
+Items can be added and removed one at a time, and are grouped, eg. by user, so a group can be counted or removed
+without scanning everything.
+"""
+
+import heapq
+import time
+
+# the longest the timer sleeps before checking the wall clock again, in case it was changed
+MAX_WAIT = 3600
+
+
+class _Entry:
+    __slots__ = ("due", "key", "group", "item", "removed")
+
+    def __init__(self, due, key, group, item):
+        self.due = due
+        self.key = key
+        self.group = group
+        self.item = item
+        self.removed = False
+
+
+class TimerQueue:
+    """
+    :type fired: int
+    """
+
+    def __init__(self, loop, fire, *, clock=time.time, max_wait=MAX_WAIT):
+        """
+        :param loop: The event loop the timer is armed on
+        :param fire: Called with the key and item of each item once it's due, after it has been removed
+        :param clock: Returns the current wall clock time, which due times are compared to
+        :param max_wait: The longest the timer sleeps before checking the clock again
+        :type loop: asyncio.events.AbstractEventLoop
+        :type fire: (object, object) -> None
+        :type clock: () -> float
+        :type max_wait: float
+        """
+        self.loop = loop
+        self.fire = fire
+        self.clock = clock
+        self.max_wait = max_wait
+        # (due, sequence, entry), the sequence keeps items due at the same time in the order they were added
+        self._heap = []
+        self._sequence = 0
+        self._entries = {}
+        self._groups = {}
+        self._handle = None
+        self._handle_due = None
+        self._closed = False
+        self.fired = 0
+
+    def add(self, key, due, item, group=None):
+        """
+        Adds an item, replacing any item with the same key
+        :param due: When to fire the item, as a timestamp from the clock
+        :param group: The group to count the item in
+        :type key: object
+        :type due: float
+        :type item: object
+        :type group: object
+        """
+        self._discard(key)
+        entry = _Entry(due, key, group, item)
+        self._entries[key] = entry
+        self._groups.setdefault(group, set()).add(key)
+        self._sequence += 1
+        heapq.heappush(self._heap, (due, self._sequence, entry))
+        self._arm()
+
+    def remove(self, key):
+        """
+        Removes an item before it fires
+        :type key: object
+        :return: The item, or None if there was no item with that key
+        :rtype: object
+        """
+        entry = self._discard(key)
+        if entry is None:
+            return None
+        self._arm()
+        return entry.item
+
+    def remove_group(self, group):
+        """
+        Removes every item in a group
+        :type group: object
+        :return: The number of items removed
+        :rtype: int
+        """
+        keys = self._groups.get(group)
+        if not keys:
+            return 0
+        count = len(keys)
+        for key in list(keys):
+            self._discard(key)
+        self._arm()
+        return count
+
+    def count(self, group):
+        """
+        :type group: object
+        :return: The number of items in a group
+        :rtype: int
+        """
+        return len(self._groups.get(group, ()))
+
+    def get(self, key):
+        """
+        :type key: object
+        :rtype: object
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else entry.item
+
+    def next_due(self):
+        """
+        :return: When the next item is due, or None if there are none
+        :rtype: float | None
+        """
+        self._drop_removed()
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def close(self):
+        """
+        Stops the timer. Items can still be added and removed, but none fire.
+        """
+        self._closed = True
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        # removed entries are left in the heap until they reach the top
+        entry.removed = True
+        keys = self._groups[entry.group]
+        keys.discard(key)
+        if not keys:
+            del self._groups[entry.group]
+        return entry
+
+    def _drop_removed(self):
+        heap = self._heap
+        while heap and heap[0][2].removed:
+            heapq.heappop(heap)
+        # don't let removed entries pile up if items are removed long before they're due
+        if len(heap) > 2 * len(self._entries) + 64:
+            self._heap = [item for item in heap if not item[2].removed]
+            heapq.heapify(self._heap)
+
+    def _arm(self):
+        if self._closed:
+            return
+        self._drop_removed()
+        if not self._heap:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+            return
+        due = self._heap[0][0]
+        if self._handle is not None:
+            if self._handle_due == due:
+                return
+            self._handle.cancel()
+        wait = min(max(due - self.clock(), 0), self.max_wait)
+        self._handle_due = due
+        self._handle = self.loop.call_at(self.loop.time() + wait, self._fire_due)
+
+    def _fire_due(self):
+        self._handle = None
+        now = self.clock()
+        heap = self._heap
+        due = []
+        while heap and (heap[0][2].removed or heap[0][0] <= now):
+            entry = heapq.heappop(heap)[2]
+            if not entry.removed:
+                self._discard(entry.key)
+                due.append(entry)
+        self._arm()
+        for entry in due:
+            self.fired += 1
+            self.fire(entry.key, entry.item)
@@ -1,8 +1,11 @@
 import re
 import random
 
+from sqlalchemy import Table, Column, String, PrimaryKeyConstraint
+
 from cloudbot.event import EventType
 from cloudbot import hook
+from cloudbot.util import database
 
 
 cheers = [
@@ -17,17 +20,15 @@ cheers = [
     "HUAH!",
     "♪  ┏(°.°)┛  ┗(°.°)┓ ♬"
     ]
-db_ready = []
-
 
-def db_init(db, conn_name):
-    """Make sure that the badwords table exists. Connection name is for caching the result per connection."""
-    global db_ready
-    if db_ready.count(conn_name) < 1:
-        db.execute(
-            "create table if not exists badwords(word, nick, chan, PRIMARY KEY(word, chan))")
-        db.commit()
-        db_ready.append(conn_name)
+table = Table(
+    'badwords',
+    database.metadata,
+    Column('word', String),
+    Column('nick', String),
+    Column('chan', String),
+    PrimaryKeyConstraint('word', 'chan')
+)
 
 
 @hook.on_start()
@@ -35,7 +36,6 @@ def db_init(db, conn_name):
 def load_bad(db, conn):
     """Should run on start of bot to load the existing words into the regex"""
     global badword_re, blacklist, black_re
-    db_init(db, conn)
     words = db.execute("select word from badwords").fetchall()
     out = ""
     for word in words:
@@ -49,7 +49,6 @@ def load_bad(db, conn):
 def add_bad(text, nick, db, conn):
     """adds a bad word to the auto kick list must specify a channel with each word"""
     global blacklist, black_re, blacklist
-    db_init(db, conn.name)
     word = text.split(' ')[0].lower()
     channel = text.split(' ')[1].lower()
     if not channel.startswith('#'):
@@ -81,7 +80,6 @@ def add_bad(text, nick, db, conn):
 def del_bad(text, nick, db, conn):
     """removes the specified word from the specified channels bad word list"""
     global blacklist, black_re, blacklist
-    db_init(db, conn.name)
     word = text.split(' ')[0].lower()
     if not (text.split(' ')[1] or text.split(' ')[1]('#')):
         return "please specify a valid channel name"
@@ -101,7 +99,6 @@ def del_bad(text, nick, db, conn):
 @hook.command("listbad", permissions=["badwords"], autohelp=False)
 def list_bad(text, db, conn):
     """Returns a list of bad words specify a channel to see words for a particular channel"""
-    db_init(db, conn)
     text = text.split(' ')[0].lower()
     out = ""
     if not text.startswith('#'):
@@ -32,11 +32,14 @@ def init_tasks(loop, conn):
     ready = True
 
 
-@asyncio.coroutine
-@hook.sieve(priority=100)
+@hook.sieve(priority=100, types=["command", "regex", "event", "irc_raw"], threaded=False)
 def sieve_suite(bot, event, _hook):
     global buckets
 
+    # catch-all raw hooks, like logging, see every line and are never restricted
+    if _hook.type == "irc_raw" and _hook.is_catch_all():
+        return event
+
     conn = event.conn
 
     # check acls
@@ -5,7 +5,7 @@ import operator
 from time import time
 from collections import defaultdict
 from sqlalchemy import Table, Column, String, Integer, PrimaryKeyConstraint, desc
-from sqlalchemy.sql import select
+from sqlalchemy.sql import select, bindparam
 from cloudbot import hook
 from cloudbot.event import EventType
 from cloudbot.util import database
@@ -24,6 +24,27 @@ table = Table(
     Column('chan', String),
     PrimaryKeyConstraint('name', 'chan','network')
     )
+# the scoreboards are read by network and channel, the primary key starts with the nick
+database.index(table, 'network', 'chan')
+
+friends_query = select([table.c.name, table.c.befriend]) \
+    .where(table.c.network == bindparam('network')) \
+    .where(table.c.chan == bindparam('chan')) \
+    .order_by(desc(table.c.befriend))
+global_friends_query = select([table.c.name, table.c.befriend]) \
+    .where(table.c.network == bindparam('network')) \
+    .order_by(desc(table.c.befriend))
+killers_query = select([table.c.name, table.c.shot]) \
+    .where(table.c.network == bindparam('network')) \
+    .where(table.c.chan == bindparam('chan')) \
+    .order_by(desc(table.c.shot))
+global_killers_query = select([table.c.name, table.c.shot]) \
+    .where(table.c.network == bindparam('network')) \
+    .order_by(desc(table.c.shot))
+database.register_query("duckhunt.friends", friends_query)
+database.register_query("duckhunt.friends_global", global_friends_query)
+database.register_query("duckhunt.killers", killers_query)
+database.register_query("duckhunt.killers_global", global_killers_query)
 
 optout = Table(
     'nohunt',
@@ -356,9 +377,7 @@ def friends(text, chan, conn, db):
     out = ""
     if text.lower() == 'global' or text.lower() == 'average':
         out = "Duck friend scores across the network: "
-        scores = db.execute(select([table.c.name, table.c.befriend]) \
-            .where(table.c.network == conn.name) \
-            .order_by(desc(table.c.befriend)))
+        scores = db.execute(global_friends_query, {'network': conn.name})
         if scores:    
             for row in scores:
                 if row[1] == 0:
@@ -372,10 +391,7 @@ def friends(text, chan, conn, db):
             return "it appears no on has friended any ducks yet."
     else:
         out = "Duck friend scores in {}: ".format(chan)
-        scores = db.execute(select([table.c.name, table.c.befriend]) \
-            .where(table.c.network == conn.name) \
-            .where(table.c.chan == chan.lower()) \
-            .order_by(desc(table.c.befriend)))
+        scores = db.execute(friends_query, {'network': conn.name, 'chan': chan.lower()})
         if scores:
             for row in scores:
                 if row[1] == 0:
@@ -399,9 +415,7 @@ def killers(text, chan, conn, db):
     out = ""
     if text.lower() == 'global' or text.lower() == 'average':
         out = "Duck killer scores across the network: "
-        scores = db.execute(select([table.c.name, table.c.shot]) \
-            .where(table.c.network == conn.name) \
-            .order_by(desc(table.c.shot)))
+        scores = db.execute(global_killers_query, {'network': conn.name})
         if scores:
             for row in scores:
                 if row[1] == 0:
@@ -415,10 +429,7 @@ def killers(text, chan, conn, db):
             return "it appears no on has killed any ducks yet."
     else:
         out = "Duck killer scores in {}: ".format(chan)
-        scores = db.execute(select([table.c.name, table.c.shot]) \
-            .where(table.c.network == conn.name) \
-            .where(table.c.chan == chan.lower()) \
-            .order_by(desc(table.c.shot)))
+        scores = db.execute(killers_query, {'network': conn.name, 'chan': chan.lower()})
         if scores:
             for row in scores:
                 if row[1] == 0:
@@ -1,7 +1,9 @@
 import re
 import time
+from sqlalchemy import Table, Column, String, PrimaryKeyConstraint
 from cloudbot import hook
 from cloudbot.event import EventType
+from cloudbot.util import database
 from plugins import grab
 from plugins import lenny
 
@@ -9,29 +11,24 @@ import random
 
 import random
 
-db_ready = []
 opt_out = []
 delay = 10
 floodcheck = {}
 
-def db_init(db, conn_name):
-    """Check to see if the DB has the herald table. Connection name is for caching the result per connection.
-    :type db: sqlalchemy.orm.Session
-    """
-    global db_ready
-    if db_ready.count(conn_name) < 1:
-        db.execute(
-            "create table if not exists herald(name, chan, quote, primary key(name, chan))")
-        db.commit()
-        db_ready.append(conn_name)
+table = Table(
+    'herald',
+    database.metadata,
+    Column('name', String),
+    Column('chan', String),
+    Column('quote', String),
+    PrimaryKeyConstraint('name', 'chan')
+)
 
 
 @hook.command()
 def herald(text, nick, chan, db, conn):
     """herald [message] adds a greeting for your nick that will be announced everytime you join the channel. Using .herald show will show your current herald and .herald delete will remove your greeting."""
 
-    db_init(db, conn.name)
-
     if text.lower() == "show":
         greeting = db.execute("select quote from herald where name = :name and chan = :chan", {
                               'name': nick.lower(), 'chan': chan}).fetchone()
@@ -55,8 +52,6 @@ def herald(text, nick, chan, db, conn):
 def harold(text, nick, chan, db, conn):
     """harold [message] adds a greeting for your nick that will be announced everytime you join the channel. Using .harold show will show your current harold and .harold delete will remove your greeting."""
 
-    db_init(db, conn.name)
-
     if text.lower() == "show":
         greeting = db.execute("select quote from herald where name = :name and chan = :chan", {
                               'name': nick.lower(), 'chan': chan}).fetchone()
@@ -80,7 +75,6 @@ def harold(text, nick, chan, db, conn):
 def deleteherald(text, chan, db, conn):
     """deleteherald [nickname] Delete [nickname]'s herald."""
 
-    db_init(db, conn.name)
     tnick = db.execute("select name from herald where name = :name and chan = :chan", {'name': text.lower(), 'chan': chan.lower()}).fetchone()
 
     if tnick:
@@ -1,45 +1,213 @@
-from collections import deque
+from collections import deque, OrderedDict
 import time
 import asyncio
 import re
+import threading
+
+from sqlalchemy import Table, Column, String, Float, PrimaryKeyConstraint
 
 from cloudbot import hook
-from cloudbot.util import timeformat
+from cloudbot.util import timeformat, database
 from cloudbot.event import EventType
 
-db_ready = []
+table = Table(
+    'seen_user',
+    database.metadata,
+    Column('name', String),
+    Column('time', Float),
+    Column('quote', String),
+    Column('chan', String),
+    Column('host', String),
+    PrimaryKeyConstraint('name', 'chan')
+)
+# .seen looks nicks up by channel, the primary key starts with the nick
+database.index(table, 'chan', 'name')
+
+seen_query = "select name, time, quote from seen_user where name = :name and chan = :chan"
+seen_glob_query = "select name, time, quote from seen_user where chan = :chan and name like :name escape '/' " \
+                  "order by time desc limit 1"
+database.register_query("history.seen", seen_query)
+database.register_query("history.seen_glob", seen_glob_query)
+
+# seen rows are buffered here and written in batches, rather than committing once for every message
+# (name, chan) -> row, only the latest row for each nick in each channel is kept
+seen_buffer = {}
+# rows being written by the current flush, still checked by .seen until they're committed
+seen_flushing = {}
+seen_lock = threading.Lock()
+flush_lock = threading.Lock()
 
+# flush every FLUSH_INTERVAL seconds, or as soon as there are FLUSH_SIZE buffered rows
+FLUSH_INTERVAL = 10
+FLUSH_SIZE = 500
 
-def db_init(db, conn_name):
-    """check to see that our db has the the seen table (connection name is for caching the result per connection)
+# recent exact .seen lookups, (name, chan) -> row or None. Set to 0 to disable.
+SEEN_CACHE_SIZE = 256
+seen_cache = OrderedDict()
+# bumped by every flush, so a lookup that raced with a flush doesn't cache the row it replaced
+seen_generation = 0
+
+
+@hook.on_start()
+def db_init(db):
+    """lowercases the names in older seen tables, for exact .seen lookups
     :type db: sqlalchemy.orm.Session
     """
-    global db_ready
-    if db_ready.count(conn_name) < 1:
-        db.execute("create table if not exists seen_user(name, time, quote, chan, host, primary key(name, chan))")
+    # names are always written in lowercase, so once there are no mixed case names left the migration has run
+    mixed = db.execute("select 1 from seen_user where name != lower(name) limit 1").fetchone()
+    if mixed:
+        # When both a mixed case and a lowercase row exist for the same nick and channel, the lowercase one is kept.
+        db.execute("update or ignore seen_user set name = lower(name) where name != lower(name)")
+        db.execute("delete from seen_user where name != lower(name)")
         db.commit()
-        db_ready.append(conn_name)
 
 
-def track_seen(event, db, conn):
+def flush_seen(db):
+    """writes all buffered seen rows in one transaction
+    :type db: sqlalchemy.orm.Session
+    """
+    global seen_generation
+    with flush_lock:
+        with seen_lock:
+            if not seen_buffer:
+                return
+            seen_flushing.update(seen_buffer)
+            seen_buffer.clear()
+            rows = list(seen_flushing.values())
+
+        try:
+            db.execute("insert or replace into seen_user(name, time, quote, chan, host) "
+                       "values(:name,:time,:quote,:chan,:host)", rows)
+            db.commit()
+        except Exception:
+            # put back anything which hasn't been replaced by a newer row since, so it's written by the next flush
+            with seen_lock:
+                for key, row in seen_flushing.items():
+                    seen_buffer.setdefault(key, row)
+                seen_flushing.clear()
+            raise
+
+        with seen_lock:
+            for key in seen_flushing:
+                seen_cache.pop(key, None)
+            seen_flushing.clear()
+            seen_generation += 1
+
+
+def get_buffered_seen(name, chan):
+    """
+    :type name: str
+    :type chan: str
+    :rtype: dict | None
+    """
+    with seen_lock:
+        return seen_buffer.get((name, chan)) or seen_flushing.get((name, chan))
+
+
+def get_cached_seen(name, chan):
+    """
+    :type name: str
+    :type chan: str
+    :rtype: (bool, dict | None)
+    """
+    with seen_lock:
+        try:
+            row = seen_cache[(name, chan)]
+        except KeyError:
+            return False, None
+        seen_cache.move_to_end((name, chan))
+        return True, row
+
+
+def cache_seen(name, chan, row, generation):
+    """
+    :type name: str
+    :type chan: str
+    :type row: dict | None
+    :type generation: int
+    """
+    if SEEN_CACHE_SIZE <= 0:
+        return
+    with seen_lock:
+        if generation != seen_generation:
+            return
+        seen_cache[(name, chan)] = row
+        seen_cache.move_to_end((name, chan))
+        while len(seen_cache) > SEEN_CACHE_SIZE:
+            seen_cache.popitem(last=False)
+
+
+def query_seen(name, chan, db):
+    """ Finds the last message from a nick in a channel. Names containing * are matched as globs, and the most recent
+    matching nick is returned.
+    :type name: str
+    :type chan: str
+    :type db: sqlalchemy.orm.Session
+    :rtype: dict | None
+    """
+    name = name.lower()
+    if "*" not in name:
+        # messages which haven't been written to the database yet are always the newest
+        buffered = get_buffered_seen(name, chan)
+        if buffered is not None:
+            return buffered
+
+        cached, row = get_cached_seen(name, chan)
+        if cached:
+            return row
+
+        generation = seen_generation
+
+        result = db.execute(seen_query, {'name': name, 'chan': chan}).fetchone()
+        row = dict(zip(('name', 'time', 'quote'), result)) if result else None
+        cache_seen(name, chan, row, generation)
+        return row
+
+    # flush first, so the query sees everything
+    flush_seen(db)
+    pattern = name.replace("/", "//").replace("%", "/%").replace("_", "/_").replace("*", "%")
+    result = db.execute(seen_glob_query, {'name': pattern, 'chan': chan}).fetchone()
+    return dict(zip(('name', 'time', 'quote'), result)) if result else None
+
+
+def track_seen(event, content, db):
     """ Tracks messages for the .seen command
     :type event: cloudbot.event.Event
+    :type content: str
     :type db: sqlalchemy.orm.Session
-    :type conn: cloudbot.client.Client
     """
-    db_init(db, conn)
     # keep private messages private
-    if event.chan[:1] == "#" and not re.findall('^s/.*/.*/$', event.content.lower()):
-        db.execute(
-            "insert or replace into seen_user(name, time, quote, chan, host) values(:name,:time,:quote,:chan,:host)",
-            {'name': event.nick.lower(), 'time': time.time(), 'quote': event.content, 'chan': event.chan,
-             'host': event.mask})
-        db.commit()
+    if event.chan[:1] == "#" and not re.findall('^s/.*/.*/$', content.lower()):
+        name = event.nick.lower()
+        row = {'name': name, 'time': time.time(), 'quote': content, 'chan': event.chan, 'host': event.mask}
+        with seen_lock:
+            seen_buffer[(name, event.chan)] = row
+            buffered = len(seen_buffer)
 
+        if buffered >= FLUSH_SIZE:
+            flush_seen(db)
 
-def track_history(event, message_time, conn):
+
+@hook.periodic(FLUSH_INTERVAL)
+def seen_flusher(db):
+    """
+    :type db: sqlalchemy.orm.Session
+    """
+    flush_seen(db)
+
+
+@hook.on_stop()
+def flush_on_stop(db):
+    """
+    :type db: sqlalchemy.orm.Session
+    """
+    flush_seen(db)
+
+
+def track_history(event, content, message_time, conn):
     """
     :type event: cloudbot.event.Event
+    :type content: str
     :type conn: cloudbot.client.Client
     """
     try:
@@ -50,7 +218,7 @@ def track_history(event, message_time, conn):
         # really really
         history = conn.history[event.chan]
 
-    data = (event.nick, message_time, event.content)
+    data = (event.nick, message_time, content)
     history.append(data)
 
 
@@ -61,12 +229,13 @@ def chat_tracker(event, db, conn):
     :type event: cloudbot.event.Event
     :type conn: cloudbot.client.Client
     """
+    content = event.content
     if event.type is EventType.action:
-        event.content = "\x01ACTION {}\x01".format(event.content)
+        content = "\x01ACTION {}\x01".format(content)
 
     message_time = time.time()
-    track_seen(event, db, conn)
-    track_history(event, message_time, conn)
+    track_seen(event, content, db)
+    track_history(event, content, message_time, conn)
 
 
 @asyncio.coroutine
@@ -101,23 +270,15 @@ def seen(text, nick, chan, db, event, conn):
     if not re.match("^[A-Za-z0-9_|\^\*\`.\-\]\[\{\}\\\\]*$", text.lower()):
         return "I can't look up that name, its impossible to use!"
 
-    db_init(db, conn.name)
-
-    if '_' in text:
-        text = text.replace("_", "/_")
-
-    last_seen = db.execute("select name, time, quote from seen_user where name like :name escape '/' and chan = :chan",
-                            {'name': text, 'chan': chan}).fetchone()
-
-    text = text.replace("/", "")
+    last_seen = query_seen(text, chan, db)
 
     if last_seen:
-        reltime = timeformat.time_since(last_seen[1])
-        if last_seen[0] != text.lower():  # for glob matching
-            text = last_seen[0]
-        if last_seen[2][0:1] == "\x01":
-            return '{} was last seen {} ago: * {} {}'.format(text, reltime, text, last_seen[2][8:-1])
+        reltime = timeformat.time_since(last_seen['time'])
+        if last_seen['name'] != text.lower():  # for glob matching
+            text = last_seen['name']
+        if last_seen['quote'][0:1] == "\x01":
+            return '{} was last seen {} ago: * {} {}'.format(text, reltime, text, last_seen['quote'][8:-1])
         else:
-            return '{} was last seen {} ago saying: {}'.format(text, reltime, last_seen[2])
+            return '{} was last seen {} ago saying: {}'.format(text, reltime, last_seen['quote'])
     else:
         return "I've never seen {} talking in this channel.".format(text)
@@ -2,15 +2,17 @@
 
 import requests
 from bs4 import BeautifulSoup
+from sqlalchemy import Table, Column, String
 
 from cloudbot import hook
-from cloudbot.util import formatting
+from cloudbot.util import formatting, database
 
-
-@hook.on_start()
-def init(db):
-    db.execute("create table if not exists horoscope(nick primary key, sign)")
-    db.commit()
+table = Table(
+    'horoscope',
+    database.metadata,
+    Column('nick', String, primary_key=True),
+    Column('sign', String)
+)
 
 
 @hook.command(autohelp=False)
@@ -26,8 +28,6 @@ def horoscope(text, db, bot, notice, nick):
     else:
         sign = text
 
-    db.execute("create table if not exists horoscope(nick primary key, sign)")
-
     if not sign:
         sign = db.execute("select sign from horoscope where "
                           "nick=lower(:nick)", {'nick': nick}).fetchone()
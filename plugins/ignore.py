@@ -1,4 +1,3 @@
-import asyncio
 from fnmatch import fnmatch
 
 from sqlalchemy import Table, Column, UniqueConstraint, PrimaryKeyConstraint, String, Boolean
@@ -65,18 +64,13 @@ def is_ignored(conn, chan, mask):
 
 
 # noinspection PyUnusedLocal
-@asyncio.coroutine
-@hook.sieve(priority=50)
+@hook.sieve(priority=50, types=["command", "regex"], threaded=False)
 def ignore_sieve(bot, event, _hook):
     """
     :type bot: cloudbot.bot.CloudBot
     :type event: cloudbot.event.Event
     :type _hook: cloudbot.plugin.Hook
     """
-    # don't block event hooks
-    if _hook.type in ("irc_raw", "event"):
-        return event
-
     # don't block an event that could be unignoring
     if _hook.type == "command" and event.triggered_command in ("unignore", "global_unignore"):
         return event
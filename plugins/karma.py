@@ -2,29 +2,39 @@ import re
 import operator
 
 from collections import defaultdict
+from sqlalchemy import Table, Column, String, Integer, PrimaryKeyConstraint
 from cloudbot import hook
 from cloudbot.event import EventType
+from cloudbot.util import database
 
 karmaplus_re = re.compile('^.*\+\+$')
 karmaminus_re = re.compile('^.*\-\-$')
-db_ready = []
-
-def db_init(db, conn_name):
-    """Check to see if the DB has the herald table. Connection name is for caching the result per connection.
-    :type db: sqlalchemy.orm.Session
-    """
-    global db_ready
-    if db_ready.count(conn_name) < 1:
-        db.execute("create table if not exists karma(name, chan, thing, score INTEGER, primary key(name, chan, thing))")
-        db.commit()
-        db_ready.append(conn_name)
+
+table = Table(
+    'karma',
+    database.metadata,
+    Column('name', String),
+    Column('chan', String),
+    Column('thing', String),
+    Column('score', Integer),
+    PrimaryKeyConstraint('name', 'chan', 'thing')
+)
+# the primary key starts with the nick, but .points looks things up across every nick, and .topten reads a channel
+database.index(table, 'thing', 'chan')
+database.index(table, 'chan')
+
+points_query = "select score from karma where thing = :thing"
+chan_points_query = "select score from karma where thing = :thing and chan = :chan"
+chan_scores_query = "select thing, score from karma where chan = :chan"
+database.register_query("karma.points_global", points_query)
+database.register_query("karma.points", chan_points_query)
+database.register_query("karma.pointstop", chan_scores_query)
 
 
 @hook.command("pp", "addpoint")
 def addpoint(text, nick, chan, db, conn):
     """.addpoint or (.pp) <thing> adds a point to the <thing>"""
     text = text.strip()
-    db_init(db, conn.name)
     karma = db.execute("select score from karma where name = :name and chan = :chan and thing = :thing", {'name':nick, 'chan': chan, 'thing': text.lower()}).fetchone()
     if karma:
         score = int(karma[0])
@@ -51,7 +61,6 @@ def re_addpt(match, nick, chan, db, conn, notice):
 def rmpoint(text, nick, chan, db, conn):
     """.rmpoint or (.mm) <thing> subtracts a point from the <thing>"""
     text = text.strip()
-    db_init(db, conn.name)
     karma = db.execute("select score from karma where name = :name and chan = :chan and thing = :thing", {'name':nick, 'chan': chan, 'thing': text.lower()}).fetchone()
     if karma:
         score = int(karma[0])
@@ -68,7 +77,6 @@ def rmpoint(text, nick, chan, db, conn):
 @hook.command("pluspts", autohelp=False)
 def pluspts(nick, chan, db, conn):
     """prints the things you have liked"""
-    db_init(db, conn.name)
     output = ""
     likes = db.execute("select thing, score from karma where name = :name and chan = :chan and score >= 0 order by score desc", { 'name': nick, 'chan': chan }).fetchall()
     for like in likes:
@@ -78,7 +86,6 @@ def pluspts(nick, chan, db, conn):
 @hook.command("minuspts", autohelp=False)
 def minuspts(nick, chan, db, conn):
     """prints the things you have liked"""
-    db_init(db, conn.name)
     output = ""
     likes = db.execute("select thing, score from karma where name = :name and chan = :chan and score <= 0 order by score", { 'name': nick, 'chan': chan }).fetchall()
     for like in likes:
@@ -99,16 +106,15 @@ def re_rmpt(match, nick, chan, db, conn, notice):
 @hook.command("points", autohelp=False)
 def points(text, chan, db, conn):
     """.points <thing> will print the total points for <thing> in the channel."""
-    db_init(db, conn.name)
     score = 0
     karma = ""
     thing = ""
     if text.endswith("-global"):
         thing = text[:-7].strip()
-        karma = db.execute("select score from karma where thing = :thing", {'thing': thing.lower()}).fetchall()
+        karma = db.execute(points_query, {'thing': thing.lower()}).fetchall()
     else:
         text = text.strip()
-        karma = db.execute("select score from karma where thing = :thing and chan = :chan", {'thing': text.lower(), 'chan': chan }).fetchall()
+        karma = db.execute(chan_points_query, {'thing': text.lower(), 'chan': chan }).fetchall()
     if karma:
         pos = 0
         neg = 0
@@ -127,7 +133,6 @@ def points(text, chan, db, conn):
 @hook.command("topten", "pointstop", "loved", autohelp=False)
 def pointstop(text, chan, db, message, conn, notice):
     """.topten or .pointstop prints the top 10 things with the highest points in the channel. To see the top 10 items in all of the channels the bot sits in use .topten global."""
-    db_init(db, conn.name)
     scores = []
     points = defaultdict(int)
     items = ""
@@ -136,7 +141,7 @@ def pointstop(text, chan, db, message, conn, notice):
         items = db.execute("select thing, score from karma").fetchall()
         out = "The top {} favorite things in all channels are: "
     else:
-        items = db.execute("select thing, score from karma where chan = :chan", {'chan':chan}).fetchall()
+        items = db.execute(chan_scores_query, {'chan':chan}).fetchall()
         out = "The top {} favorite things in {} are: "
     if items:
         for item in items:
@@ -157,7 +162,6 @@ def pointstop(text, chan, db, message, conn, notice):
 @hook.command("bottomten", "pointsbottom", "hated", autohelp=False)
 def pointsbottom(text, chan, db, message, conn, notice):
     """.bottomten or .pointsbottom prints the top 10 things with the highest points in the channel. To see the top 10 items in all of the channels the bot sits in use .topten global."""
-    db_init(db, conn.name)
     scores = []
     points = defaultdict(int)
     items = ""
@@ -166,7 +170,7 @@ def pointsbottom(text, chan, db, message, conn, notice):
         items = db.execute("select thing, score from karma").fetchall()
         out = "The {} most hated things in all channels are: "
     else:
-        items = db.execute("select thing, score from karma where chan = :chan", {'chan':chan}).fetchall()
+        items = db.execute(chan_scores_query, {'chan':chan}).fetchall()
         out = "The {} most hated things in {} are: "
     if items:
         for item in items:
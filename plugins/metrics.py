@@ -0,0 +1,89 @@
+"""
+metrics.py
+
+Shows how often hooks run and how long they take, writes the metrics to a file, and serves them over HTTP.
+
+Set "file" in the "metrics" config section to write the metrics there every minute, and "http_enabled" to serve them
+on http_address:http_port, both in the Prometheus text format.
+"""
+
+import asyncio
+
+from cloudbot import hook
+from cloudbot.util.metrics import MetricsProtocol, write_dump
+
+WRITE_INTERVAL = 60
+
+server = None
+
+
+@asyncio.coroutine
+@hook.on_start()
+def start_server(bot):
+    global server
+    config = bot.config.get("metrics", {})
+    if not config.get("http_enabled", False):
+        return
+    address = config.get("http_address", "127.0.0.1")
+    port = config.get("http_port", 9102)
+    metrics = bot.plugin_manager.metrics
+    server = yield from bot.loop.create_server(lambda: MetricsProtocol(metrics), address, port)
+
+
+@hook.on_stop()
+def stop_server(bot):
+    global server
+    if server is not None:
+        bot.loop.call_soon_threadsafe(server.close)
+        server = None
+
+
+@asyncio.coroutine
+@hook.periodic(WRITE_INTERVAL)
+def write_metrics(bot, async):
+    path = bot.config.get("metrics", {}).get("file")
+    if not path:
+        return
+    # the dump is taken in the event loop, so hooks finishing meanwhile can't change it
+    yield from async(write_dump, path, bot.plugin_manager.metrics.dump())
+
+
+def format_ms(seconds):
+    return "{:.1f}".format(seconds * 1000)
+
+
+@hook.command("hookstats", autohelp=False, permissions=["botcontrol"])
+def hook_stats(text, bot):
+    """[hook] - shows the hooks which have spent the most time running, or those matching [hook]"""
+    metrics = bot.plugin_manager.metrics
+    # copied first, as hooks finishing in the event loop add to it
+    hooks = [(name, stats) for name, stats in list(metrics.hooks.items()) if text.lower() in name.lower()]
+    if not hooks:
+        return "No hooks have run yet." if not text else "No hooks matching {} have run yet.".format(text)
+    hooks.sort(key=lambda item: item[1].run.sum, reverse=True)
+
+    timeouts = metrics.counters.get("timeouts", {})
+    lines = []
+    for name, stats in hooks[:10]:
+        run = stats.run
+        queued = stats.queued
+        lines.append("{}: {} calls, {} errors, {} timeouts. Run ms p50 {} p95 {} p99 {} max {}, queued ms p95 {} max {}"
+                     .format(name, stats.calls, stats.errors, timeouts.get(name, 0), format_ms(run.quantile(0.5)),
+                             format_ms(run.quantile(0.95)), format_ms(run.quantile(0.99)), format_ms(run.max),
+                             format_ms(queued.quantile(0.95)), format_ms(queued.max)))
+    if text:
+        return lines
+
+    rejections = sorted(list(metrics.sieve_rejections.items()), key=lambda item: item[1], reverse=True)
+    if rejections:
+        lines.append("Sieve rejections: " + ", ".join("{}: {}".format(name, count) for name, count in rejections))
+
+    stuck = []
+    for plugin in list(bot.plugin_manager.plugins.values()):
+        if plugin.executor is not None:
+            executor_stats = plugin.executor.stats()
+            if executor_stats["stuck"]:
+                stuck.append("{}: {stuck} (pool replaced {replaced} times)".format(plugin.title, **executor_stats))
+    if stuck:
+        lines.append("Threads left running after timing out: " + ", ".join(stuck))
+    return lines
@@ -22,8 +22,10 @@ try:
 except ImportError:
     objgraph = None
 
+from sqlalchemy import text
+
 from cloudbot import hook
-from cloudbot.util import web
+from cloudbot.util import web, database
 
 
 def get_name(thread_id):
@@ -70,6 +72,149 @@ def threaddump_command():
     return get_thread_dump()
 
 
+@hook.command("dbpool", autohelp=False, permissions=["botcontrol"])
+def db_pool_stats(bot):
+    """- shows the load and wait times of the database workers used by coroutine hooks"""
+    return ["Worker {worker}: {leases} hooks, {pending} calls queued, {completed} calls, "
+            "wait avg {avg_wait:.3f}s max {max_wait:.3f}s".format(**stats) for stats in bot.db_pool.stats()]
+
+
+def explain(connection, query):
+    """
+    :type connection: sqlalchemy.engine.Connection
+    :type query: sqlalchemy.sql.expression.Executable | str
+    :return: The detail of each step of SQLite's plan for the query
+    :rtype: list[str]
+    """
+    if isinstance(query, str):
+        query = text(query)
+    compiled = query.compile(dialect=connection.dialect)
+    # the plan doesn't depend on the values, so parameters without one are left empty
+    params = [compiled.binds[name].value for name in compiled.positiontup]
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute("EXPLAIN QUERY PLAN " + str(compiled), params)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+@hook.command("dbcheck", autohelp=False, permissions=["botcontrol"])
+def db_check(bot):
+    """- checks the queries plugins run often can use an index, listing any which read a whole table"""
+    if bot.db_engine.dialect.name != "sqlite":
+        return "Query plans can only be checked on SQLite databases."
+    if not database.queries:
+        return "No queries are registered."
+
+    lines = []
+    with bot.db_engine.connect() as connection:
+        for name, query in sorted(database.queries.items()):
+            try:
+                scans = database.full_scans(explain(connection, query))
+            except Exception as e:
+                lines.append("{}: couldn't be checked: {}".format(name, e))
+                continue
+            if scans:
+                lines.append("{}: {}".format(name, "; ".join(scans)))
+    lines.insert(0, "{} of {} registered queries use an index.".format(len(database.queries) - len(lines),
+                                                                        len(database.queries)))
+    return lines
+
+
+@hook.command("decodestats", autohelp=False, permissions=["botcontrol"])
+def decode_stats(conn):
+    """- shows how incoming lines on this connection have been decoded"""
+    decoder = getattr(conn, "decoder", None)
+    if decoder is None:
+        return "This connection doesn't decode lines itself."
+    stats = decoder.stats()
+    codecs = ", ".join("{}: {}".format(name, count) for name, count in stats["decoded"].items())
+    return ("{lines} lines, {ascii} ascii, {cache_hits} decoded with a remembered codec, {failures} failed attempts, "
+            "{fallbacks} undecodable. Remembering {senders} senders and {channels} channels. ".format(**stats) + codecs)
+
+
+@hook.command("sendqueue", autohelp=False, permissions=["botcontrol"])
+def send_queue_stats(conn):
+    """- shows how many lines are waiting to be sent on this connection"""
+    send_queue = getattr(conn, "send_queue", None)
+    if send_queue is None:
+        return "This connection doesn't queue lines."
+    return ("Queued: {urgent} urgent, {normal} normal, {bulk} bulk. Sent {sent} lines in {writes} writes, "
+            "dropped {dropped}, collapsed {collapsed} duplicates.".format(**send_queue.stats()))
+
+
+@hook.command("ingress", autohelp=False, permissions=["botcontrol"])
+def ingress_stats(conn):
+    """- shows how many received lines are waiting to be handled on this connection"""
+    ingress = getattr(conn, "ingress", None)
+    if ingress is None:
+        return "This connection doesn't queue received lines."
+    return ("Queued: {control} control, {command} commands, {passive} passive, {running} running{paused}. "
+            "Handled {processed} of {enqueued}, shed {shed}, paused reading {pauses} times. "
+            "Wait avg {avg_wait:.3f}s max {max_wait:.3f}s, oldest queued {oldest_wait:.3f}s."
+            .format(paused=" (reading paused)" if ingress.paused else "", **ingress.stats()))
+
+
+@hook.command("ircstate", autohelp=False, permissions=["botcontrol"])
+def irc_state_stats(conn, chan):
+    """- shows how many channels and users are tracked on this connection"""
+    state = getattr(conn, "state", None)
+    if state is None:
+        return "This connection doesn't track channel state."
+    return ("Tracking {users} users in {channels} channels, {memberships} memberships. "
+            "{count} users in {chan}.".format(count=len(state.channel_nicks(chan)), chan=chan, **state.stats()))
+
+
+@hook.command("periodic", autohelp=False, permissions=["botcontrol"])
+def periodic_stats(bot):
+    """- shows how long each periodic hook takes to run, and how often it overran its interval"""
+    lines = []
+    for stats in bot.plugin_manager.scheduler.stats():
+        if stats["last_duration"] is None:
+            durations = "not run yet"
+        else:
+            durations = "last {last_duration:.3f}s avg {avg_duration:.3f}s max {max_duration:.3f}s".format(**stats)
+        lines.append("{} every {interval}s ({mode}): {runs} runs{running}, {}, {overruns} overruns, {missed} missed. "
+                     "Next in {next_in:.1f}s.".format(stats["key"].description, durations,
+                                                      running=" (running)" if stats["running"] else "", **stats))
+    return lines or "No periodic hooks are loaded."
+
+
+@asyncio.coroutine
+@hook.command("shards", autohelp=False, permissions=["botcontrol"])
+def shard_stats(bot):
+    """- shows the CPU use and event loop latency of each worker process, when running sharded"""
+    if bot.shard_link is None:
+        return "Not running sharded."
+    try:
+        workers = yield from bot.shard_link.get_stats()
+    except asyncio.TimeoutError:
+        return "The supervisor didn't answer."
+    lines = []
+    for index, stats in sorted(workers.items()):
+        if not stats["alive"]:
+            lines.append("Worker {} ({}): not running".format(index, ", ".join(stats["names"])))
+            continue
+        if "pid" not in stats:
+            lines.append("Worker {} ({}): no stats reported yet".format(index, ", ".join(stats["names"])))
+            continue
+        lines.append("Worker {} ({}): pid {pid}, cpu {cpu_percent:.1f}% ({cpu_time:.1f}s total), loop lag avg "
+                     "{avg_lag:.3f}s max {max_lag:.3f}s, max rss {max_rss} KiB, started {starts} times"
+                     .format(index, ", ".join(stats["names"]), **stats))
+    return lines
+
+
+@hook.command("startup", autohelp=False, permissions=["botcontrol"])
+def startup_stats(text, bot):
+    """[count] - shows the plugins which took longest to import, create tables for and start, slowest first"""
+    try:
+        count = int(text) if text else 5
+    except ValueError:
+        return "Expected a number of plugins to show."
+    return bot.plugin_manager.startup.report(max(count, 0))
+
+
 @hook.command("objtypes", autohelp=False, permissions=["botcontrol"])
 def show_types():
     if objgraph is None:
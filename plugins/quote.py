@@ -5,7 +5,7 @@ import time
 from cloudbot import hook
 from cloudbot.util import database
 
-from sqlalchemy import select
+from sqlalchemy import select, bindparam
 from sqlalchemy import Table, Column, String, PrimaryKeyConstraint
 from sqlalchemy.types import REAL
 from sqlalchemy.exc import IntegrityError
@@ -22,6 +22,48 @@ qtable = Table(
     Column('deleted', String(5), default=0),
     PrimaryKeyConstraint('chan', 'nick', 'time')
 )
+# lookups by channel, and by nick in a channel, use the primary key
+database.index(qtable, 'nick', 'time')
+
+# how many quotes match, and one of them by its position in time order
+nick_count_query = select([qtable]) \
+    .where(qtable.c.deleted != 1) \
+    .where(qtable.c.nick == bindparam('nick')) \
+    .count()
+nick_query = select([qtable.c.time, qtable.c.nick, qtable.c.msg]) \
+    .where(qtable.c.deleted != 1) \
+    .where(qtable.c.nick == bindparam('nick')) \
+    .order_by(qtable.c.time) \
+    .limit(1) \
+    .offset(bindparam('offset'))
+nick_chan_count_query = select([qtable]) \
+    .where(qtable.c.deleted != 1) \
+    .where(qtable.c.chan == bindparam('chan')) \
+    .where(qtable.c.nick == bindparam('nick')) \
+    .count()
+nick_chan_query = select([qtable.c.time, qtable.c.nick, qtable.c.msg]) \
+    .where(qtable.c.deleted != 1) \
+    .where(qtable.c.chan == bindparam('chan')) \
+    .where(qtable.c.nick == bindparam('nick')) \
+    .order_by(qtable.c.time) \
+    .limit(1) \
+    .offset(bindparam('offset'))
+chan_count_query = select([qtable]) \
+    .where(qtable.c.deleted != 1) \
+    .where(qtable.c.chan == bindparam('chan')) \
+    .count()
+chan_query = select([qtable.c.time, qtable.c.nick, qtable.c.msg]) \
+    .where(qtable.c.deleted != 1) \
+    .where(qtable.c.chan == bindparam('chan')) \
+    .order_by(qtable.c.time) \
+    .limit(1) \
+    .offset(bindparam('offset'))
+database.register_query("quote.count_by_nick", nick_count_query)
+database.register_query("quote.get_quote_by_nick", nick_query)
+database.register_query("quote.count_by_nick_chan", nick_chan_count_query)
+database.register_query("quote.get_quote_by_nick_chan", nick_chan_query)
+database.register_query("quote.count_by_chan", chan_count_query)
+database.register_query("quote.get_quote_by_chan", chan_query)
 
 
 def format_quote(q, num, n_quotes):
@@ -79,72 +121,40 @@ def get_quote_num(num, count, name):
 def get_quote_by_nick(db, nick, num=False):
     """Returns a formatted quote from a nick, random or selected by number"""
 
-    count_query = select([qtable]) \
-        .where(qtable.c.deleted != 1) \
-        .where(qtable.c.nick == nick.lower()) \
-        .count()
-    count = db.execute(count_query).fetchall()[0][0]
+    count = db.execute(nick_count_query, {'nick': nick.lower()}).fetchall()[0][0]
 
     try:
         num = get_quote_num(num, count, nick)
     except Exception as error_message:
         return error_message
 
-    query = select([qtable.c.time, qtable.c.nick, qtable.c.msg]) \
-        .where(qtable.c.deleted != 1) \
-        .where(qtable.c.nick == nick.lower()) \
-        .order_by(qtable.c.time)\
-        .limit(1) \
-        .offset((num - 1))
-    data = db.execute(query).fetchall()[0]
+    data = db.execute(nick_query, {'nick': nick.lower(), 'offset': num - 1}).fetchall()[0]
     return format_quote(data, num, count)
 
 
 def get_quote_by_nick_chan(db, chan, nick, num=False):
     """Returns a formatted quote from a nick in a channel, random or selected by number"""
-    count_query = select([qtable]) \
-        .where(qtable.c.deleted != 1) \
-        .where(qtable.c.chan == chan) \
-        .where(qtable.c.nick == nick.lower()) \
-        .count()
-    count = db.execute(count_query).fetchall()[0][0]
+    count = db.execute(nick_chan_count_query, {'chan': chan, 'nick': nick.lower()}).fetchall()[0][0]
 
     try:
         num = get_quote_num(num, count, nick)
     except Exception as error_message:
         return error_message
 
-    query = select([qtable.c.time, qtable.c.nick, qtable.c.msg]) \
-        .where(qtable.c.deleted != 1) \
-        .where(qtable.c.chan == chan) \
-        .where(qtable.c.nick == nick.lower()) \
-        .order_by(qtable.c.time) \
-        .limit(1) \
-        .offset((num - 1))
-    data = db.execute(query).fetchall()[0]
+    data = db.execute(nick_chan_query, {'chan': chan, 'nick': nick.lower(), 'offset': num - 1}).fetchall()[0]
     return format_quote(data, num, count)
 
 
 def get_quote_by_chan(db, chan, num=False):
     """Returns a formatted quote from a channel, random or selected by number"""
-    count_query = select([qtable]) \
-        .where(qtable.c.deleted != 1) \
-        .where(qtable.c.chan == chan) \
-        .count()
-    count = db.execute(count_query).fetchall()[0][0]
+    count = db.execute(chan_count_query, {'chan': chan}).fetchall()[0][0]
 
     try:
         num = get_quote_num(num, count, chan)
     except Exception as error_message:
         return error_message
 
-    query = select([qtable.c.time, qtable.c.nick, qtable.c.msg]) \
-        .where(qtable.c.deleted != 1) \
-        .where(qtable.c.chan == chan) \
-        .order_by(qtable.c.time)\
-        .limit(1) \
-        .offset((num - 1))
-    data = db.execute(query).fetchall()[0]
+    data = db.execute(chan_query, {'chan': chan, 'offset': num - 1}).fetchall()[0]
     return format_quote(data, num, count)
 
 
@@ -54,9 +54,9 @@ def delete_status(db, conn, chan):
     db.commit()
 
 
-@hook.sieve()
+@hook.sieve(types=["regex"], threaded=False)
 def sieve_regex(bot, event, _hook):
-    if _hook.type == "regex" and event.chan.startswith("#") and _hook.plugin.title != "factoids":
+    if event.chan.startswith("#") and _hook.plugin.title != "factoids":
         status = status_cache.get((event.conn.name, event.chan))
         if status != "ENABLED" and (status == "DISABLED" or not default_enabled):
             bot.logger.info("[{}] Denying {} from {}".format(event.conn.name, _hook.function_name, event.chan))
@@ -24,6 +24,7 @@ from cloudbot.util import database
 from cloudbot.util.timeparse import time_parse
 from cloudbot.util.timeformat import format_time, time_since
 from cloudbot.util import colors
+from cloudbot.util.timerqueue import TimerQueue
 
 
 table = Table(
@@ -39,16 +40,6 @@ table = Table(
 )
 
 
-@asyncio.coroutine
-def delete_reminder(async, db, network, remind_time, user):
-    query = table.delete() \
-        .where(table.c.network == network.lower()) \
-        .where(table.c.remind_time == remind_time) \
-        .where(table.c.added_user == user.lower())
-    yield from async(db.execute, query)
-    yield from async(db.commit)
-
-
 @asyncio.coroutine
 def delete_all(async, db, network, user):
     query = table.delete() \
@@ -72,55 +63,102 @@ def add_reminder(async, db, network, added_user, added_chan, message, remind_tim
     yield from async(db.commit)
 
 
+# reminders waiting to be sent, keyed by (network, user, added time) and grouped by (network, user)
+reminders = None
+
+# how long to wait before trying again to send a reminder to a network which isn't connected
+RETRY_DELAY = 30
+
+
 @asyncio.coroutine
 @hook.on_start()
-def load_cache(async, db):
-    global reminder_cache
-    reminder_cache = []
-
-    for network, remind_time, added_time, user, message in (yield from async(_load_cache_db, db)):
-        reminder_cache.append((network, remind_time, added_time, user, message))
+def load_cache(bot, async, db):
+    global reminders
+    if reminders is not None:
+        reminders.close()
+    reminders = TimerQueue(bot.loop, lambda key, reminder: asyncio.async(send_reminder(bot, reminder), loop=bot.loop))
+
+    # only this process's networks, when running sharded the other workers send the rest
+    networks = [name.lower() for name in bot.connections]
+    if not networks:
+        return
+    for reminder in (yield from async(_load_cache_db, db, networks)):
+        queue_reminder(reminder)
 
 
-def _load_cache_db(db):
-    query = db.execute(table.select())
+def _load_cache_db(db, networks):
+    query = db.execute(table.select().where(table.c.network.in_(networks)))
     return [(row["network"], row["remind_time"], row["added_time"], row["added_user"], row["message"]) for row in query]
 
 
-@asyncio.coroutine
-@hook.periodic(30, initial_interval=30)
-def check_reminders(bot, async, db):
-    current_time = datetime.now()
+@hook.on_stop()
+def stop_reminders(bot):
+    if reminders is not None:
+        bot.loop.call_soon_threadsafe(reminders.close)
+
+
+def queue_reminder(reminder, due=None):
+    """
+    :param due: When to send the reminder as a timestamp, its remind time by default
+    :type reminder: (str, datetime, datetime, str, str)
+    :type due: float
+    """
+    network, remind_time, added_time, user, message = reminder
+    if due is None:
+        due = remind_time.timestamp()
+    reminders.add((network, user, added_time), due, reminder, group=(network, user))
+
+
+def _delete_sent(bot, network, remind_time, user):
+    db = bot.db_session()
+    try:
+        db.execute(table.delete()
+                   .where(table.c.network == network)
+                   .where(table.c.remind_time == remind_time)
+                   .where(table.c.added_user == user))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _get_conn(bot, network):
+    """
+    :param network: A network name, as stored with reminders in lowercase
+    :type network: str
+    :return: The connection to the network, or None if this process doesn't run it
+    """
+    for name, conn in bot.connections.items():
+        if name.lower() == network:
+            return conn
+    return None
 
-    for reminder in reminder_cache:
-        network, remind_time, added_time, user, message = reminder
-        if remind_time <= current_time:
-            if network not in bot.connections:
-                # connection is invalid
-                yield from add_reminder(async, db, network, remind_time, user)
-                yield from load_cache(async, db)
-                continue
 
-            conn = bot.connections[network]
-
-            if not conn.ready:
-                return
+@asyncio.coroutine
+def send_reminder(bot, reminder):
+    network, remind_time, added_time, user, message = reminder
+    conn = _get_conn(bot, network)
+    if conn is None:
+        # the network isn't run by this process, or isn't configured any more
+        return
+    if not conn.ready:
+        # not connected yet, try again later
+        queue_reminder(reminder, time.time() + RETRY_DELAY)
+        return
 
-            remind_text = colors.parse(time_since(added_time, count=2))
-            alert = colors.parse("{}, you have a reminder from $(b){}$(clear) ago!".format(user, remind_text))
+    remind_text = colors.parse(time_since(added_time, count=2))
+    alert = colors.parse("{}, you have a reminder from $(b){}$(clear) ago!".format(user, remind_text))
 
-            conn.message(user, alert)
-            conn.message(user, '"{}"'.format(message))
+    conn.message(user, alert)
+    conn.message(user, '"{}"'.format(message))
 
-            delta = (remind_time-added_time).seconds
-            if delta > (30*60):
-                late_time = time_since(remind_time, count=2)
-                late = "(I'm sorry for delivering this message $(b){}$(clear) late," \
-                       " it seems I was unable to deliver it on time)".format(late_time)
-                conn.message(user, colors.parse(late))
+    delta = (remind_time-added_time).seconds
+    if delta > (30*60):
+        late_time = time_since(remind_time, count=2)
+        late = "(I'm sorry for delivering this message $(b){}$(clear) late," \
+               " it seems I was unable to deliver it on time)".format(late_time)
+        conn.message(user, colors.parse(late))
 
-            yield from delete_reminder(async, db, network, remind_time, user)
-            yield from load_cache(async, db)
+    yield from bot.loop.run_in_executor(None, _delete_sent, bot, network, remind_time, user)
 
 
 @asyncio.coroutine
@@ -128,14 +166,14 @@ def check_reminders(bot, async, db):
 def remind(text, nick, chan, db, conn, notice, async):
     """<1 minute, 30 seconds>: <do task> -- reminds you to <do task> in <1 minute, 30 seconds>"""
 
-    count = len([x for x in reminder_cache if x[0] == conn.name and x[3] == nick.lower()])
+    count = reminders.count((conn.name.lower(), nick.lower()))
 
     if text == "clear":
         if count == 0:
             return "You have no reminders to delete."
 
         yield from delete_all(async, db, conn.name, nick)
-        yield from load_cache(async, db)
+        reminders.remove_group((conn.name.lower(), nick.lower()))
         return "Deleted all ({}) reminders for {}!".format(count, nick)
 
     # split the input on the first ":"
@@ -172,7 +210,7 @@ def remind(text, nick, chan, db, conn, notice, async):
 
     # finally, add the reminder and send a confirmation message
     yield from add_reminder(async, db, conn.name, nick, chan, message, remind_time, current_time)
-    yield from load_cache(async, db)
+    queue_reminder((conn.name.lower(), remind_time, current_time, nick.lower(), message))
 
     remind_text = format_time(seconds, count=2)
     output = "Alright, I'll remind you \"{}\" in $(b){}$(clear)!".format(message, remind_text)
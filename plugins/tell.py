@@ -2,7 +2,7 @@ import re
 from datetime import datetime
 from sqlalchemy import Table, Column, String, Boolean, DateTime
 
-from sqlalchemy.sql import select
+from sqlalchemy.sql import select, bindparam
 
 from cloudbot import hook
 from cloudbot.util import timeformat, database
@@ -19,6 +19,14 @@ table = Table(
     Column('time_sent', DateTime),
     Column('time_read', DateTime)
 )
+database.index(table, 'connection', 'target', 'is_read')
+
+unread_query = select([table.c.sender, table.c.message, table.c.time_sent]) \
+    .where(table.c.connection == bindparam('connection')) \
+    .where(table.c.target == bindparam('target')) \
+    .where(table.c.is_read == 0) \
+    .order_by(table.c.time_sent)
+database.register_query("tell.get_unread", unread_query)
 
 @hook.on_start
 def load_cache(db):
@@ -34,12 +42,7 @@ def load_cache(db):
 
 
 def get_unread(db, server, target):
-    query = select([table.c.sender, table.c.message, table.c.time_sent]) \
-        .where(table.c.connection == server.lower()) \
-        .where(table.c.target == target.lower()) \
-        .where(table.c.is_read == 0) \
-        .order_by(table.c.time_sent)
-    return db.execute(query).fetchall()
+    return db.execute(unread_query, {'connection': server.lower(), 'target': target.lower()}).fetchall()
 
 
 def count_unread(db, server, target):
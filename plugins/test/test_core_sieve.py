@@ -0,0 +1,56 @@
+import copy
+
+from cloudbot import hook
+from cloudbot.plugin import RawHook, SieveHook
+from plugins.core_sieve import sieve_suite
+
+
+class DummyPlugin:
+    title = "herald"
+    file_name = "herald.py"
+
+
+class DummyConn:
+    name = "testconn"
+    config = {"acls": {"welcome": {"deny-except": ["#allowed"]}, "log": {"deny-except": ["#allowed"]}}}
+
+
+class DummyEvent:
+    conn = DummyConn()
+    nick = "nick"
+
+    def __init__(self, chan):
+        self.chan = chan
+
+
+@hook.irc_raw("JOIN")
+def welcome(chan):
+    pass
+
+
+@hook.irc_raw("*")
+def log(chan):
+    pass
+
+
+def make_hook(hook_class, func, hook_type):
+    # the hook classes take their options out of the decorator's kwargs, so each test gets its own copy
+    func_hook = copy.copy(func._cloudbot_hook[hook_type])
+    func_hook.kwargs = dict(func_hook.kwargs)
+    return hook_class(DummyPlugin(), func_hook)
+
+
+def test_acl_blocks_raw_hook():
+    sieve = make_hook(SieveHook, sieve_suite, "sieve")
+    join_hook = make_hook(RawHook, welcome, "irc_raw")
+    assert sieve.applies_to(join_hook)
+
+    assert sieve_suite(None, DummyEvent("#other"), join_hook) is None
+    event = DummyEvent("#Allowed")
+    assert sieve_suite(None, event, join_hook) is event
+
+
+def test_catch_all_raw_hook_unrestricted():
+    log_hook = make_hook(RawHook, log, "irc_raw")
+    event = DummyEvent("#other")
+    assert sieve_suite(None, event, log_hook) is event